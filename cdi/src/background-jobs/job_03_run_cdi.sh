@@ -5,4 +5,6 @@ run_cdi_scripts() {
         echo "CDI script execution failed!"
         exit 1
     fi
+    # compare the step performance with the previous run #
+    docker compose exec cdi python -m libs.telemetry || true
 }
@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-import time
+import os
 import sys
 
 # from netCDF4 import Dataset
@@ -14,6 +14,11 @@ from STEP_0203_percent_rank_SPI_anom import main as step_0203
 from STEP_0301_CDI_weighted_sum import main as step_0301
 from STEP_0302_percent_rank_CDI_weighted_sum import main as step_0302
 from STEP_0303_export_ranking_data_rasters import main as step_0303
+from libs.config_reader import ConfigParser, SETTINGS_FILES, REGION_VARIABLE
+from libs.region_batch import select_regions
+import libs.cube_cache as cube_cache
+import libs.telemetry as telemetry
+from libs.step_scheduler import StepScheduler
 from argparse import ArgumentParser
 
 """
@@ -27,34 +32,165 @@ Packages:
 """
 
 
-def log_time(step_name, func, *args):
-    # log the time taken to execute the function
-    # if any error occured, exit the program with sys.exit(1)
-    start_time = time.time()
+def get_outputs(config):
+    """
+    This function returns the output files of the steps for the region of the settings
+    Args:
+        config (ConfigParser): the settings of the region
+
+    Returns:
+        Dictionary of step number -> fully-qualified name of the output file
+    """
+    output_dir = config.get('output_dir').replace("\\", '/')
+    region = config.get('region_name')
+    return {
+        "0101": os.path.join(output_dir, "STEP_0101_LST_anomaly_{}.nc".format(region)),
+        "0102": os.path.join(output_dir, "STEP_0102_NDVI_anomaly_{}.nc".format(region)),
+        "0103": os.path.join(output_dir, "STEP_0103_SPI_anomaly_{}.nc".format(region)),
+        "0201": os.path.join(output_dir, "STEP_0201_LST_anomaly_pct_rank_{}.nc".format(region)),
+        "0202": os.path.join(output_dir, "STEP_0202_NDVI_anomaly_pct_rank_{}.nc".format(region)),
+        "0203": os.path.join(output_dir, "STEP_0203_SPI_anomaly_pct_rank_{}.nc".format(region)),
+        "0204": os.path.join(output_dir, "STEP_0204_SM_pct_rank_{}.nc".format(region)),
+        "0301": os.path.join(output_dir, "STEP_0301_CDI_weighted_sum_{}.nc".format(region)),
+        "0302": os.path.join(output_dir, "STEP_0302_CDI_pct_rank_{}.nc".format(region))
+    }
+
+
+def run_for_region(region, function, *args):
+    """
+    This function executes a step for a region of the regions setting: the settings of the step are those of the region
+    Args:
+        region (str): name of the region
+        function: the main function of the step
+        args: the arguments of the function
+    """
+    previous = os.environ.get(REGION_VARIABLE)
+    os.environ[REGION_VARIABLE] = region
     try:
-        print(f"Executing {step_name}...")
-        func(*args)
-    except Exception as e:
-        print(f"Error in {step_name}: {e}")
-        sys.exit(1)
+        function(*args)
     finally:
-        end_time = time.time()
-        elapsed_time = end_time - start_time
-        print(f"{step_name} completed in {elapsed_time:.2f} seconds.\n")
+        if previous is None:
+            del os.environ[REGION_VARIABLE]
+        else:
+            os.environ[REGION_VARIABLE] = previous
+
+
+def create_scheduler(args):
+    """
+    This function defines the processing steps, their dependencies and their input and output files
+    Args:
+        args: the parsed command line options, passed on to the steps
+
+    Returns:
+        StepScheduler object with the steps in the order of the pipeline
+    """
+    config = ConfigParser()
+    raw_data_dirs = config.get('raw_data_dirs')
+    outputs = get_outputs(config)
+    scheduler = StepScheduler(os.path.join(config.get('scratch_dir').replace("\\", '/'), "STEP_0000_step_state.json"))
+    scheduler.add_step("Step 0101", step_0101, (args,), inputs=[raw_data_dirs['lst_hdf']], outputs=[outputs["0101"]])
+    scheduler.add_step("Step 0102", step_0102, (args,), inputs=[raw_data_dirs['ndvi_hdf']], outputs=[outputs["0102"]])
+    scheduler.add_step("Step 0103", step_0103, (args,), inputs=[raw_data_dirs['chirps_tif']], outputs=[outputs["0103"]])
+    # scheduler.add_step("Step 0104", step_0104, (args,), inputs=[raw_data_dirs['fldas_data']])
+    scheduler.add_step("Step 0201", step_0201, (args,), ["Step 0101"], [outputs["0101"]], [outputs["0201"]])
+    scheduler.add_step("Step 0202", step_0202, (args,), ["Step 0102"], [outputs["0102"]], [outputs["0202"]])
+    scheduler.add_step("Step 0203", step_0203, (args,), ["Step 0103"], [outputs["0103"]], [outputs["0203"]])
+    # scheduler.add_step("Step 0204", step_0204, (args,), ["Step 0104"], outputs=[outputs["0204"]])
+    ranks = [outputs["0201"], outputs["0202"], outputs["0203"], outputs["0204"]]
+    scheduler.add_step("Step 0301", step_0301, (), ["Step 0201", "Step 0202", "Step 0203"], ranks, [outputs["0301"]])
+    scheduler.add_step("Step 0302", step_0302, (args,), ["Step 0301"], [outputs["0301"]], [outputs["0302"]])
+    # the GeoTIFFs of the latest date are exported in updates mode, so the export has no fixed output files #
+    scheduler.add_step("Step 0303", step_0303, (args,), ["Step 0302"], ranks + [outputs["0302"]])
+    return scheduler
+
+
+def create_region_scheduler(args, regions):
+    """
+    This function defines the processing steps of several regions: the ingestion steps read the raw files once for all
+        the regions (see RegionBatch), and the following steps are executed per region, named 'Step <number> <region>'
+    Args:
+        args: the parsed command line options, passed on to the steps
+        regions (list of str): names of the regions of the regions setting
+
+    Returns:
+        StepScheduler object with the steps in the order of the pipeline
+    """
+    config = ConfigParser()
+    raw_data_dirs = config.get('raw_data_dirs')
+    outputs = {r: get_outputs(ConfigParser(r)) for r in regions}
+    scheduler = StepScheduler(os.path.join(config.get('scratch_dir').replace("\\", '/'), "STEP_0000_regions_step_state.json"))
+    scheduler.add_step("Step 0101", step_0101, (args,), inputs=[raw_data_dirs['lst_hdf']], outputs=[outputs[r]["0101"] for r in regions])
+    scheduler.add_step("Step 0102", step_0102, (args,), inputs=[raw_data_dirs['ndvi_hdf']], outputs=[outputs[r]["0102"] for r in regions])
+    scheduler.add_step("Step 0103", step_0103, (args,), inputs=[raw_data_dirs['chirps_tif']], outputs=[outputs[r]["0103"] for r in regions])
+    # scheduler.add_step("Step 0104", step_0104, (args,), inputs=[raw_data_dirs['fldas_data']])
+    for r in regions:
+        o = outputs[r]
+        scheduler.add_step("Step 0201 {}".format(r), run_for_region, (r, step_0201, args), ["Step 0101"], [o["0101"]], [o["0201"]])
+        scheduler.add_step("Step 0202 {}".format(r), run_for_region, (r, step_0202, args), ["Step 0102"], [o["0102"]], [o["0202"]])
+        scheduler.add_step("Step 0203 {}".format(r), run_for_region, (r, step_0203, args), ["Step 0103"], [o["0103"]], [o["0203"]])
+        # scheduler.add_step("Step 0204 {}".format(r), run_for_region, (r, step_0204, args), ["Step 0104"], outputs=[o["0204"]])
+    for r in regions:
+        o = outputs[r]
+        ranks = [o["0201"], o["0202"], o["0203"], o["0204"]]
+        rank_steps = ["Step 0201 {}".format(r), "Step 0202 {}".format(r), "Step 0203 {}".format(r)]
+        scheduler.add_step("Step 0301 {}".format(r), run_for_region, (r, step_0301), rank_steps, ranks, [o["0301"]])
+        scheduler.add_step("Step 0302 {}".format(r), run_for_region, (r, step_0302, args), ["Step 0301 {}".format(r)], [o["0301"]], [o["0302"]])
+        scheduler.add_step("Step 0303 {}".format(r), run_for_region, (r, step_0303, args), ["Step 0302 {}".format(r)], ranks + [o["0302"]])
+    return scheduler
+
+
+def expand_step_names(names, only=None, start=None):
+    """
+    This function expands the step names of the --only and --from options to the steps of all the regions,
+        e.g. 'Step 0201' to 'Step 0201 <region>' for each region
+    Args:
+        names (list of str): names of the steps, in the order they were added
+        only (list of str): optional names of the only steps to execute
+        start (str): optional name of the first step to execute
+
+    Returns:
+        Tuple of the expanded only and start options
+    """
+    def matches(name, step):
+        return name == step or name.startswith(step + " ")
+    if only is not None:
+        only = [name for name in names if any(matches(name, step) for step in only)] or only
+    if start is not None:
+        start = next((name for name in names if matches(name, start)), start)
+    return only, start
 
 
 def main(args):
-    log_time("Step 0101", step_0101, args)
-    log_time("Step 0102", step_0102, args)
-    log_time("Step 0103", step_0103, args)
-    # log_time("Step 0104", step_0104, args)
-    log_time("Step 0201", step_0201)
-    log_time("Step 0202", step_0202)
-    log_time("Step 0203", step_0203)
-    # log_time("Step 0204", step_0204)
-    log_time("Step 0301", step_0301)
-    log_time("Step 0302", step_0302)
-    log_time("Step 0303", step_0303, args)
+    if not args.no_telemetry:
+        run_id = telemetry.start_run()
+        print("Recording the step telemetry of run {} in '{}'".format(run_id, telemetry.get_log_dir()))
+    args.regions = select_regions(args.regions)
+    if args.regions is None:
+        scheduler = create_scheduler(args)
+        steps = scheduler.select_steps(args.only, args.start)
+    else:
+        # the steps following the ingestion steps are executed per region, concurrently if jobs > 1 #
+        scheduler = create_region_scheduler(args, args.regions)
+        steps = scheduler.select_steps(*expand_step_names(scheduler.select_steps(), args.only, args.start))
+    # the settings files are inputs of every step #
+    base_path = os.environ.get('CDI_CONFIG_DIR', os.path.dirname(os.path.abspath(__file__)))
+    settings_files = [os.path.join(base_path, f) for f in SETTINGS_FILES]
+    # reprocessing all files always executes the steps #
+    force = args.force or str(args.mode) == 'all'
+    jobs = args.jobs
+    if args.fused:
+        # execute the steps one at a time in this process, so the cubes the steps write are reused from memory #
+        # by the following steps instead of being read back (see cube_cache) #
+        cube_cache.enable()
+        jobs = 1
+    try:
+        failures = scheduler.run(steps, jobs, force, settings_files)
+    finally:
+        cube_cache.disable()
+    if len(failures) > 0:
+        for name in failures.keys():
+            print("-- {} {}".format(name, failures[name]))
+        sys.exit(1)
     print("Finished processing CDI data")
 
 
@@ -63,5 +199,35 @@ if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument("-m", "--mode", default="updates",
                         help="The mode of the current processing: updates or all. Default is updates")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="Number of worker processes for the raw file conversions of steps 0101 - 0103 "
+                             "and the monthly rankings of steps 0201 - 0302. Default is 1")
+    parser.add_argument("--convert-timeout", type=float, default=900,
+                        help="Number of seconds allowed per HDF4 to HDF5 conversion in steps 0101 and 0102. Default is 900")
+    parser.add_argument("-j", "--jobs", type=int, default=3,
+                        help="Number of steps to execute concurrently when they do not depend on each other. Default is 3")
+    parser.add_argument("--only", nargs='+', metavar="STEP",
+                        help="Execute only these steps, e.g. --only 0201 0202")
+    parser.add_argument("--from", dest="start", metavar="STEP",
+                        help="Execute this step and the steps after it in the pipeline, e.g. --from 0301")
+    parser.add_argument("--force", action="store_true",
+                        help="Execute the steps even if their input files are unchanged since their last run")
+    parser.add_argument("--no-telemetry", action="store_true",
+                        help="Do not record the time, CPU, memory and I/O of the steps in the logs directory")
+    parser.add_argument("--fused", action="store_true",
+                        help="Reuse the data cubes the steps write instead of reading them back: the steps are executed "
+                             "one at a time (ignoring --jobs) in one process, and the anomaly, totals, rank and sum cubes "
+                             "they write are kept in memory for the following steps. All files are still written, "
+                             "and are the same as without this option")
+    parser.add_argument("--regions", nargs='*', metavar="NAME",
+                        help="Process the named regions of the regions setting (all the regions if no name is given): "
+                             "steps 0101 - 0104 read each raw file once for all the regions, "
+                             "and the following steps of the regions are executed concurrently")
+    options = parser.parse_args()
+    # accept the step numbers with or without the 'Step ' prefix #
+    if options.only is not None:
+        options.only = ["Step {}".format(s.replace("Step ", "").replace("STEP_", "")) for s in options.only]
+    if options.start is not None:
+        options.start = "Step {}".format(options.start.replace("Step ", "").replace("STEP_", ""))
     # execute the programs with the supplied options
-    main(parser.parse_args())
+    main(options)
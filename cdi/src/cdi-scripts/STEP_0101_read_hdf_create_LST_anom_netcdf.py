@@ -1,14 +1,17 @@
 # -*- coding: utf-8 -*-
 import os
-import subprocess
 from libs.config_reader import ConfigParser
 from libs.file_operations import FileHandler
+from libs.cube_store import CubeStore, get_calendar_value
 from libs.subgrid_calculations import HDFSubGrid
+from libs.region_batch import RegionBatch, select_regions
 from libs.statistics_operations import StatisticOperations
+import libs.cube_cache as cube_cache
+import libs.hdf_functions as hdf
 import libs.netcdf_functions as netcdf
+import libs.parallel_operations as parallel
 from argparse import ArgumentParser
 import numpy as np
-import numpy.ma as ma
 import re
 from datetime import datetime, date, timedelta
 
@@ -17,13 +20,19 @@ class LandSurfaceTemp:
     """
     This is the core processing class for executing all Land-Surface Temperature operations
     """
-    def __init__(self):
-        self.__config = ConfigParser()
+    def __init__(self, region=None):
+        """
+        Args:
+            region (str): optional name of the region of the regions setting (default is the region of region_name/bounds)
+        """
+        self.__config = ConfigParser(region)
         self.__raw_data_dir = self.__config.get('raw_data_dirs', 'lst_hdf').replace("\\", '/')
         self.__working_dir = self.__config.get('scratch_dir').replace("\\", '/') + '/LST'
         self.__output_dir = self.__config.get('output_dir').replace("\\", '/')
         self.__region = self.__config.get('region_name')
         self.__bounds = self.__config.get('bounds')
+        self.__storage = self.__config.get('netcdf_storage')
+        self.__export_files = self.__config.get('export_working_files')
         self.__hdf_group = self.__config.get('hdf_groups', 'lst')
         self.__file_patterns = self.__config.get('file_patterns')
         self.__file_patterns['lst_netcdf_regex'] = "STEP_0101_LST_{}_((?:19|20)\\d\\d)(0[1-9]|1[0-2])\\.nc".format(self.__region)
@@ -36,8 +45,8 @@ class LandSurfaceTemp:
         self.__working_file_match = re.compile(r'{}'.format(self.__file_patterns['lst_netcdf_regex']))
         self.__latitudes = self.__config.get('latitudes')
         self.__longitudes = self.__config.get('longitudes')
+        self.__cube_file = os.path.join(self.__working_dir, "STEP_0101_LST_cube_{}.nc".format(self.__region))
         self.__missing = -9999.0
-        self.netcdf_files = []
 
     def __get_hdf_date(self, file_name):
         """
@@ -72,75 +81,74 @@ class LandSurfaceTemp:
         time_delta = test_date - origin_date
         return int(time_delta.days)
 
-    def __get_calendar_times(self, files):
+    def __open_cube(self, read_only=False):
         """
-        This function builds a list of the valid times as days since Jan 1, 1900
+        This function returns the working cube of the LST values (see CubeStore)
         Args:
-            files: list of the HDF file names as strings
+            read_only (boolean): optional flag to open an existing cube for reading only (default is False)
 
         Returns:
-            List (floats) of the valid times as number of days since Jan 1, 1900
+            CubeStore object, to open with a 'with' statement
         """
-        origin_date = date(1900, 1, 1)
-        times = []
-        for f in files:
-            (year, month) = self.__working_file_match.match(f).groups()
-            test_date = date(int(year), int(month), 1)
-            time_delta = test_date - origin_date
-            times.append(float(time_delta.days))
-        return times
+        variables = {
+            'LST_Delta': {'units': "K", 'long_name': "Monthly Land-surface Temperature Day-Night delta"}
+        }
+        return CubeStore(self.__cube_file, self.__latitudes, self.__longitudes, variables, self.__storage, read_only)
 
-    def __get_lst_files_by_month(self, month):
+    def __get_working_files(self):
         """
-        This function reads the working data directory to find available files to process by month
+        This function finds the LST NetCDF files per month in the working directory (exported, or created by earlier versions)
         Returns:
-            List of fully-qualified names
+            Dictionary of 'YYYYMM' date -> fully-qualified name
         """
-        results = []
-        try:
-            test_pattern = self.__file_patterns['lst_netcdf_regex'].split('(0')[0] + str(month) + "\\.nc"
-            file_test = re.compile(r'{}'.format(test_pattern))
-
-            results = [
-                '{}/{}'.format(self.__working_dir, f) for f in sorted(os.listdir(self.__working_dir))
-                if file_test.match(f)
-            ]
-        except IOError as ioe:
-            print(ioe)
-        except Exception as ex:
-            print(ex)
-        finally:
-            return results
+        files = {}
+        for f in self.__fileHandler.get_working_file_names('lst_netcdf_regex'):
+            (year, month) = self.__working_file_match.match(f).groups()
+            files[year + month] = '{}/{}'.format(self.__working_dir, f)
+        return files
 
-    def convert_h4_to_h5(self):
+    def convert_h4_to_h5(self, workers=1, timeout=None):
         """
+        This function converts the raw HDF4 files to HDF5, running up to 'workers' conversions at a time
+        Args:
+            workers (int): optional number of simultaneous conversions (default is 1)
+            timeout (float): optional number of seconds allowed per conversion (default is no limit)
 
         Returns:
-
+            Dictionary of HDF4 file name -> error description for the files that failed
         """
         try:
             raw_files = self.__fileHandler.get_raw_file_names('lst_hdf_regex')
-            base_path = os.path.dirname(os.path.abspath(__file__))
-            for f in raw_files:
-                if f.find("_h5") < 0:
-                    raw_file_path = "{}/{}".format(self.__raw_data_dir, f)
-                    file_name = raw_file_path.split('.hdf')[0]
-                    h5_path = file_name + '_h5.hdf'
-                    subprocess.run(
-                        base_path + '/libs/h4toh5convert {} {}'.format(
-                            raw_file_path,
-                            h5_path
-                        ),
-                        shell=True,
-                        check=True
-                    )
-                    os.remove(raw_file_path)
-
+            h4_files = [f for f in raw_files if f.find("_h5") < 0]
+            return self.__fileHandler.convert_h4_to_h5(h4_files, workers, timeout)
         except IOError:
             raise
         except Exception:
             raise
 
+    def __get_netcdf_name(self, file_name):
+        """
+        This function returns the name of the NetCDF file created in the working directory for a HDF file
+        Args:
+            file_name (str): name of the HDF file
+
+        Returns:
+            String of the NetCDF file name
+        """
+        return self.__get_working_name(self.__get_hdf_date(file_name))
+
+    def __get_working_name(self, date_string):
+        """
+        This function returns the name of the NetCDF file of a month in the working directory,
+            which also identifies the month in the working cube
+        Args:
+            date_string (str): year/month in 'YYYYMM' format
+
+        Returns:
+            String of the NetCDF file name
+        """
+        return "STEP_0101_LST_{}_{}.nc".format(self.__region, date_string)
+
     def get_files_to_process(self, all_hdf=False):
         """
         This function gets the list of HDF files to convert to NetCDF subsets
@@ -152,20 +160,14 @@ class LandSurfaceTemp:
         """
         files = []
         try:
-            raw_files = sorted(self.__fileHandler.get_raw_file_names('lst_hdf_regex'), reverse=True)
             if all_hdf:  # include all HDF files
-                files = raw_files
-            else:  # determine which HDF files have not been converted to NetCDF
-                working_files = self.__fileHandler.get_working_file_names('lst_netcdf_regex')
-                # parse out the year/days from the file name #
-                for f in raw_files:
-                    name = f
-                    if name.find('/') > -1:
-                        name = name.split('/')[1]
-                    file_date = self.__get_hdf_date(name)
-                    test_file = "STEP_0101_LST_{}_{}.nc".format(self.__region, file_date)
-                    if test_file not in working_files:
-                        files.append(f)
+                files = sorted(self.__fileHandler.get_raw_file_names('lst_hdf_regex'), reverse=True)
+            else:  # determine which HDF files are new or changed since they were stored in the working cube
+                with self.__open_cube() as cube:
+                    # load the NetCDF files of earlier runs into the cube #
+                    cube.import_files(self.__get_working_files(), ['LST_Delta'])
+                    stored = set(self.__get_working_name(d) for d in cube.get_dates())
+                files = sorted(self.__fileHandler.get_new_or_changed_files('lst_hdf_regex', self.__get_netcdf_name, stored), reverse=True)
         except IOError:
             raise
         except Exception:
@@ -173,34 +175,65 @@ class LandSurfaceTemp:
         finally:
             return files
 
-    def create_lst_netcdf_file(self, file_name):
+    def __create_lst_delta(self, file_name, data_set=None):
         """
-        This function reads the required parameters from a HDF file and creates a NetCDF file of the subset data for the current region
+        This function reads the required parameters from a HDF file and computes the LST delta of the current region
         Args:
             file_name (str): the name of the HDF file to process
+            data_set (h5py File): optional open HDF file, shared with other regions (default is None: open the file)
 
         Returns:
-            None: results are a NetCDF file created in the working directory for the particular year/month
+            2D numpy float32 array of the LST delta values, with NaN for the missing values
         """
         raw_file_path = "{}/{}".format(self.__raw_data_dir, file_name)
-        file_date = self.__get_hdf_date(file_name)
-        output_file = os.path.join(self.__working_dir, "STEP_0101_LST_{}_{}.nc".format(self.__region, file_date))
-        output_data_set = None
         try:
-
             # extract SubGrids of the required parameters #
-            with HDFSubGrid(self.__bounds, raw_file_path, self.__hdf_group) as sg:
-                lst_day = sg.create_sub_grid('LST_Day').astype(float) * 0.02  # data is scaled in the HDF file
-                lst_night = sg.create_sub_grid('LST_Night').astype(float) * 0.02  # data is scaled in the HDF file
-                qc_day = sg.create_sub_grid('QC_Day')
-                qc_night = sg.create_sub_grid('QC_Night')
+            with HDFSubGrid(self.__bounds, raw_file_path, self.__hdf_group, data_set) as sg:
+                sub_grids = sg.create_sub_grids(['LST_Day', 'LST_Night', 'QC_Day', 'QC_Night'])
+            lst_day = sub_grids['LST_Day'].astype(float) * 0.02  # data is scaled in the HDF file
+            lst_night = sub_grids['LST_Night'].astype(float) * 0.02  # data is scaled in the HDF file
+            qc_day = sub_grids['QC_Day']
+            qc_night = sub_grids['QC_Night']
 
             # compute the LST delta #
-            filtered_lst_day = ma.masked_where(np.logical_or(qc_day < 16, lst_day == 0), lst_day)
-            filtered_lst_night = ma.masked_where(np.logical_or(qc_night < 16, lst_night == 0), lst_night)
-            delta = np.ma.clip(np.ma.subtract(filtered_lst_day, filtered_lst_night), -40.0, 40.0)
-            lst_delta = np.round(delta.filled(self.__missing), 3)
+            valid_lst_day = np.logical_and(qc_day >= 16, lst_day != 0)
+            valid_lst_night = np.logical_and(qc_night >= 16, lst_night != 0)
+            delta = np.clip(lst_day - lst_night, -40.0, 40.0)
+            return np.round(np.where(np.logical_and(valid_lst_day, valid_lst_night), delta, np.nan), 3).astype(np.float32)
+        except IOError:
+            raise
+        except Exception:
+            raise
+
+    def process_lst_file(self, file_name, data_set=None):
+        """
+        This function computes the LST delta of a HDF file for the working cube, and creates the NetCDF file of the month
+            if the per-month files are exported (export_working_files setting)
+        Args:
+            file_name (str): the name of the HDF file to process
+            data_set (h5py File): optional open HDF file, shared with other regions (default is None: open the file)
+
+        Returns:
+            Dictionary of parameter name -> 2D numpy array of the values
+        """
+        lst_delta = self.__create_lst_delta(file_name, data_set)
+        if self.__export_files:
+            self.create_lst_netcdf_file(file_name, lst_delta)
+        return {'LST_Delta': lst_delta}
 
+    def create_lst_netcdf_file(self, file_name, lst_delta):
+        """
+        This function creates a NetCDF file of the LST delta of a HDF file in the working directory
+        Args:
+            file_name (str): the name of the HDF file
+            lst_delta (numpy array): the LST delta values of the current region
+
+        Returns:
+            None: results are a NetCDF file created in the working directory for the particular year/month
+        """
+        output_file = os.path.join(self.__working_dir, self.__get_netcdf_name(file_name))
+        output_data_set = None
+        try:
             # create the output file #
             out_properties = {
                 'latitudes': self.__latitudes,
@@ -211,11 +244,11 @@ class LandSurfaceTemp:
             output_data_set = netcdf.initialize_dataset(output_file, out_properties)
 
             # add LST delta to output data set #
-            lst_var = output_data_set.createVariable('LST_Delta', 'float32', ('time', 'latitude', 'longitude'))
+            lst_var = netcdf.create_variable(output_data_set, 'LST_Delta', self.__storage)
             lst_var.units = "K"
             lst_var.missing_value = self.__missing
             lst_var.long_name = "Monthly Land-surface Temperature Day-Night delta"
-            lst_var[0] = lst_delta
+            lst_var[0] = netcdf.nan_to_missing(lst_delta, self.__missing)
         except IOError:
             raise
         except Exception:
@@ -224,48 +257,67 @@ class LandSurfaceTemp:
             if output_data_set is not None:
                 output_data_set.close()
 
-    def update_lst_anomaly_file(self):
+    def update_lst_anomaly_file(self, incremental=False):
         """
-        This function processes the files for a particular month and adds the anomaly arrays to the final NetCDF file
+        This function processes the values of the working cube for a particular month and adds the anomaly arrays to the final NetCDF file
+            In incremental mode the existing anomaly file is extended with the new times, and only the calendar months
+            whose values changed since the last update are computed again; the file is recreated if it can not be extended
+        Args:
+            incremental (boolean): optional flag to update the existing anomaly file (default is False: recreate the file)
         """
         output_file = os.path.join(self.__output_dir, "STEP_0101_LST_anomaly_{}.nc".format(self.__region))
         output_data_set = None
         try:
-            # get list of LST NetCDF files #
-            self.netcdf_files = sorted(self.__fileHandler.get_working_file_names('lst_netcdf_regex'))
-            # initialize the LST anomaly file #
-            out_properties = {
-                'latitudes': self.__latitudes,
-                'longitudes': self.__longitudes,
-                'times': self.__get_calendar_times(self.netcdf_files),
-                'time_units': 'days since 1900-01-01 00:00:00.0 UTC'
-            }
-            print("Creating LST anomaly file")
-            output_data_set = netcdf.initialize_dataset(output_file, out_properties)
-            # add LST delta to output data set #
-            lst_var = output_data_set.createVariable('lst_anom', 'float32', ('time', 'latitude', 'longitude'))
-            lst_var.units = "K"
-            lst_var.missing_value = self.__missing
-            lst_var.long_name = "Monthly Land-surface Temperature anomaly"
-
-            # determine the order of the months #
-            month_list = []
-            for m in range(0, 12):
-                null, month = self.__working_file_match.match(self.netcdf_files[m]).groups()
-                month_list.append(month)
-            # loop thru months and process the anomaly per year #
-            stats_ops = StatisticOperations()
-            for idx, m in enumerate(month_list):
-                # get the list of files for a particular month #
-                files = self.__get_lst_files_by_month(m)
-                # compute the LST anomalies per year for a particular month #
-                month_anomalies = stats_ops.compute_anomalies_from_files(files, "LST_Delta")
-                # set the starting index to the month index #
-                index = idx
-                # loop thru the years and add the data to the NetCDF file #
-                for y in month_anomalies:
-                    lst_var[index] = y
-                    index += 12  # increment 1 year
+            with self.__open_cube(True) as cube:
+                # get the list of LST dates #
+                dates = cube.get_dates()
+                out_properties = {
+                    'latitudes': self.__latitudes,
+                    'longitudes': self.__longitudes,
+                    'times': [get_calendar_value(d) for d in dates],
+                    'time_units': 'days since 1900-01-01 00:00:00.0 UTC'
+                }
+                # open the LST anomaly file for an update, or initialize it #
+                if incremental:
+                    output_data_set = netcdf.open_dataset_for_update(output_file, out_properties)
+                if output_data_set is None:
+                    print("Creating LST anomaly file")
+                    output_data_set = netcdf.initialize_dataset(output_file, out_properties, unlimited_time=True)
+                    # add LST delta to output data set #
+                    lst_var = netcdf.create_variable(output_data_set, 'lst_anom', self.__storage)
+                    lst_var.units = "K"
+                    lst_var.missing_value = self.__missing
+                    lst_var.long_name = "Monthly Land-surface Temperature anomaly"
+                else:
+                    print("Updating LST anomaly file")
+                    lst_var = output_data_set.variables['lst_anom']
+
+                # determine the order of the months #
+                month_list = [d[4:6] for d in dates[0:12]]
+                # keep the anomalies for the ranking in the fused mode #
+                anomalies = None
+                if cube_cache.is_enabled():
+                    anomalies = np.full((len(dates), len(self.__latitudes), len(self.__longitudes)), self.__missing, dtype=np.float32)
+                # loop thru months and process the anomaly per year #
+                stats_ops = StatisticOperations()
+                for idx, m in enumerate(month_list):
+                    # get the dates of a particular month #
+                    month_dates = [d for d in dates if d[4:6] == m]
+                    # skip the months whose values have not changed since the anomalies were computed #
+                    fingerprint_name = 'source_fingerprint_{}'.format(m)
+                    fingerprint = cube.get_fingerprint(month_dates)
+                    if fingerprint_name in lst_var.ncattrs() and lst_var.getncattr(fingerprint_name) == fingerprint:
+                        # the anomalies of the unchanged month are taken from the file #
+                        if anomalies is not None:
+                            values = netcdf.missing_to_nan(lst_var[idx:len(dates):12], self.__missing)
+                            anomalies[idx:len(dates):12] = netcdf.nan_to_missing(values, self.__missing)
+                        continue
+                    # compute the LST anomalies per year for a particular month and add them to the NetCDF file, #
+                    # starting at the month index #
+                    stats_ops.write_anomalies(month_dates, lambda d: cube.read_values('LST_Delta', d), lst_var, idx, cube=anomalies)
+                    lst_var.setncattr(fingerprint_name, fingerprint)
+                if anomalies is not None:
+                    cube_cache.put(output_file, 'lst_anom', anomalies, self.__missing)
         except IOError:
             raise
         except Exception:
@@ -274,16 +326,103 @@ class LandSurfaceTemp:
             if output_data_set is not None:
                 output_data_set.close()
 
+    def create_lst_netcdf_files(self, files, workers=1):
+        """
+        This function runs process_lst_file for a list of HDF files, in parallel worker processes if requested
+            The values are written to the working cube by the current process;
+            the converted files are recorded in the catalog of the working directory
+        Args:
+            files (list of str): the names of the HDF files to process
+            workers (int): optional number of worker processes (default is 1)
+
+        Returns:
+            Dictionary of HDF file name -> error description for the files that failed
+        """
+        with self.__open_cube() as cube:
+            cube.reserve([self.__get_hdf_date(f) for f in files])
+            return self.__fileHandler.process_raw_files(
+                'lst_hdf_regex', files, self.process_lst_file, self.__get_netcdf_name, workers,
+                lambda f, values: cube.write(self.__get_hdf_date(f), values)
+            )
+
+    def open_raw_file(self, file_name):
+        """
+        This function opens a HDF file of the raw data directory, to share it between the regions of a RegionBatch
+        """
+        return hdf.open_dataset("{}/{}".format(self.__raw_data_dir, file_name))
+
+    def process_raw_file(self, file_name, data_set):
+        """
+        This function computes the values of the current region from an open HDF file (see RegionBatch)
+        """
+        return self.process_lst_file(file_name, data_set)
+
+    def open_working_cube(self):
+        """
+        This function returns the working cube of the current region (see RegionBatch)
+        """
+        return self.__open_cube()
+
+    def reserve_raw_files(self, cube, files):
+        """
+        This function reserves the months of HDF files in the working cube (see RegionBatch)
+        """
+        cube.reserve([self.__get_hdf_date(f) for f in files])
+
+    def store_raw_result(self, cube, file_name, values):
+        """
+        This function writes the values of a HDF file to the working cube (see RegionBatch)
+        """
+        cube.write(self.__get_hdf_date(file_name), values)
+
+    def record_raw_files(self, files, failures):
+        """
+        This function records the converted HDF files in the catalog of the working directory (see RegionBatch)
+        """
+        try:
+            self.__fileHandler.record_processed_files('lst_hdf_regex', files, failures, self.__get_netcdf_name)
+        finally:
+            self.__fileHandler.save_catalog()
+
+
+def process_regions(args, regions):
+    """
+    This function processes the LST of several regions, reading each HDF file once for all the regions (see RegionBatch)
+    """
+    mode = str(args.mode)
+    lst = {r: LandSurfaceTemp(r) for r in regions}
+
+    failures = lst[regions[0]].convert_h4_to_h5(args.workers, args.convert_timeout)
+    parallel.report_failures(failures, None, "LST HDF4 to HDF5 conversion")
+
+    # determine the files to process per region #
+    files_to_process = {r: lst[r].get_files_to_process(mode == 'all') for r in regions}
+    file_count = sum(len(f) for f in files_to_process.values())
+    print("Processing {} months for LST in {} regions.".format(file_count, len(regions)))
+
+    # convert the HDF files once for all the regions #
+    failures = RegionBatch(lst).run(files_to_process, args.workers)
+    parallel.report_failures(failures, file_count, "LST HDF to NetCDF conversion")
+
+    # create the LST anomaly file of each region #
+    for r in regions:
+        lst[r].update_lst_anomaly_file(mode != 'all')
+
 
 def main(args):
     """
     This is the main entry point for the program
     """
+    regions = select_regions(getattr(args, 'regions', None))
+    if regions is not None:
+        process_regions(args, regions)
+        return
     mode = str(args.mode)
     # initialize a new LST class #
     lst = LandSurfaceTemp()
 
-    lst.convert_h4_to_h5()
+    failures = lst.convert_h4_to_h5(args.workers, args.convert_timeout)
+    parallel.report_failures(failures, None, "LST HDF4 to HDF5 conversion")
 
     # determine the files to process #
     if mode == 'all':
@@ -297,11 +436,11 @@ def main(args):
             print("Processing needed months for LST.")
 
     # convert any unprocessed HDF files to NetCDF format #
-    for f in files_to_process:
-        lst.create_lst_netcdf_file(f)
+    failures = lst.create_lst_netcdf_files(files_to_process, args.workers)
+    parallel.report_failures(failures, len(files_to_process), "LST HDF to NetCDF conversion")
 
     # create the LST anomaly file #
-    lst.update_lst_anomaly_file()
+    lst.update_lst_anomaly_file(mode != 'all')
 
 
 if __name__ == '__main__':
@@ -309,5 +448,12 @@ if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument("-m", "--mode", default="updates",
                         help="The mode of the current processing: updates or all. Default is updates")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="Number of worker processes (and simultaneous HDF4 to HDF5 conversions) for the HDF file conversions. Default is 1")
+    parser.add_argument("--convert-timeout", type=float, default=900,
+                        help="Number of seconds allowed per HDF4 to HDF5 conversion. Default is 900")
+    parser.add_argument("--regions", nargs='*', metavar="NAME",
+                        help="Process the named regions of the regions setting (all the regions if no name is given), "
+                             "reading each HDF file once")
     # execute the programs with the supplied options
     main(parser.parse_args())
@@ -1,14 +1,17 @@
 # -*- coding: utf-8 -*-
 import os
-import subprocess
 from libs.config_reader import ConfigParser
 from libs.file_operations import FileHandler
+from libs.cube_store import CubeStore, get_calendar_value
 from libs.subgrid_calculations import HDFSubGrid
+from libs.region_batch import RegionBatch, select_regions
 from libs.statistics_operations import StatisticOperations
+import libs.cube_cache as cube_cache
+import libs.hdf_functions as hdf
 import libs.netcdf_functions as netcdf
+import libs.parallel_operations as parallel
 from argparse import ArgumentParser
 import numpy as np
-import numpy.ma as ma
 import re
 from datetime import date, timedelta
 
@@ -17,13 +20,19 @@ class NormalizedDifferenceVegetationIndex:
     """
     This is the core processing class for executing all NDVI (normalized difference vegetation index) operations
     """
-    def __init__(self):
-        self.__config = ConfigParser()
+    def __init__(self, region=None):
+        """
+        Args:
+            region (str): optional name of the region of the regions setting (default is the region of region_name/bounds)
+        """
+        self.__config = ConfigParser(region)
         self.__raw_data_dir = self.__config.get('raw_data_dirs', 'ndvi_hdf').replace("\\", '/')
         self.__working_dir = self.__config.get('scratch_dir').replace("\\", '/') + '/NDVI'
         self.__output_dir = self.__config.get('output_dir').replace("\\", '/')
         self.__region = self.__config.get('region_name')
         self.__bounds = self.__config.get('bounds')
+        self.__storage = self.__config.get('netcdf_storage')
+        self.__export_files = self.__config.get('export_working_files')
         self.__hdf_group = self.__config.get('hdf_groups', 'ndvi')
         self.__file_patterns = self.__config.get('file_patterns')
         self.__file_patterns['ndvi_netcdf_regex'] = "STEP_0102_NDVI_{}_((?:19|20)\\d\\d)(0[1-9]|1[0-2])\\.nc".format(self.__region)
@@ -36,8 +45,8 @@ class NormalizedDifferenceVegetationIndex:
         self.__working_file_match = re.compile(r'{}'.format(self.__file_patterns['ndvi_netcdf_regex']))
         self.__latitudes = self.__config.get('latitudes')
         self.__longitudes = self.__config.get('longitudes')
+        self.__cube_file = os.path.join(self.__working_dir, "STEP_0102_NDVI_cube_{}.nc".format(self.__region))
         self.__missing = -9999.0
-        self.netcdf_files = []
 
     def __get_hdf_date(self, file_name):
         """
@@ -67,75 +76,74 @@ class NormalizedDifferenceVegetationIndex:
         time_delta = test_date - origin_date
         return int(time_delta.days)
 
-    def __get_calendar_times(self, files):
+    def __open_cube(self, read_only=False):
         """
-        This function builds a list of the valid times as days since Jan 1, 1900
+        This function returns the working cube of the NDVI values (see CubeStore)
         Args:
-            files: list of the HDF file names as strings
+            read_only (boolean): optional flag to open an existing cube for reading only (default is False)
 
         Returns:
-            List (floats) of the valid times as number of days since Jan 1, 1900
+            CubeStore object, to open with a 'with' statement
         """
-        origin_date = date(1900, 1, 1)
-        times = []
-        for f in files:
-            (year, month) = self.__working_file_match.match(f).groups()
-            test_date = date(int(year), int(month), 1)
-            time_delta = test_date - origin_date
-            times.append(float(time_delta.days))
-        return times
+        variables = {
+            'NDVI': {'units': "NDVI", 'long_name': "Monthly QC filtered NDVI data"}
+        }
+        return CubeStore(self.__cube_file, self.__latitudes, self.__longitudes, variables, self.__storage, read_only)
 
-    def __get_ndvi_files_by_month(self, month):
+    def __get_working_files(self):
         """
-        This function reads the working data directory to find available files to process by month
+        This function finds the NDVI NetCDF files per month in the working directory (exported, or created by earlier versions)
         Returns:
-            List of fully-qualified names
+            Dictionary of 'YYYYMM' date -> fully-qualified name
         """
-        results = []
-        try:
-            test_pattern = self.__file_patterns['ndvi_netcdf_regex'].split('(0')[0] + str(month) + "\\.nc"
-            file_test = re.compile(r'{}'.format(test_pattern))
-
-            results = [
-                '{}/{}'.format(self.__working_dir, f) for f in sorted(os.listdir(self.__working_dir))
-                if file_test.match(f)
-            ]
-        except IOError as ioe:
-            print(ioe)
-        except Exception as ex:
-            print(ex)
-        finally:
-            return results
+        files = {}
+        for f in self.__fileHandler.get_working_file_names('ndvi_netcdf_regex'):
+            (year, month) = self.__working_file_match.match(f).groups()
+            files[year + month] = '{}/{}'.format(self.__working_dir, f)
+        return files
 
-    def convert_h4_to_h5(self):
+    def convert_h4_to_h5(self, workers=1, timeout=None):
         """
+        This function converts the raw HDF4 files to HDF5, running up to 'workers' conversions at a time
+        Args:
+            workers (int): optional number of simultaneous conversions (default is 1)
+            timeout (float): optional number of seconds allowed per conversion (default is no limit)
 
         Returns:
-
+            Dictionary of HDF4 file name -> error description for the files that failed
         """
         try:
             raw_files = self.__fileHandler.get_raw_file_names('ndvi_hdf_regex')
-            base_path = os.path.dirname(os.path.abspath(__file__))
-            for f in raw_files:
-                if f.find("_h5") < 0:
-                    raw_file_path = "{}/{}".format(self.__raw_data_dir, f)
-                    file_name = raw_file_path.split('.hdf')[0]
-                    h5_path = file_name + '_h5.hdf'
-                    subprocess.run(
-                        base_path + '/libs/h4toh5convert {} {}'.format(
-                            raw_file_path,
-                            h5_path
-                        ),
-                        shell=True,
-                        check=True
-                    )
-                    os.remove(raw_file_path)
-
+            h4_files = [f for f in raw_files if f.find("_h5") < 0]
+            return self.__fileHandler.convert_h4_to_h5(h4_files, workers, timeout)
         except IOError:
             raise
         except Exception:
             raise
 
+    def __get_netcdf_name(self, file_name):
+        """
+        This function returns the name of the NetCDF file created in the working directory for a HDF file
+        Args:
+            file_name (str): name of the HDF file
+
+        Returns:
+            String of the NetCDF file name
+        """
+        return self.__get_working_name(self.__get_hdf_date(file_name))
+
+    def __get_working_name(self, date_string):
+        """
+        This function returns the name of the NetCDF file of a month in the working directory,
+            which also identifies the month in the working cube
+        Args:
+            date_string (str): year/month in 'YYYYMM' format
+
+        Returns:
+            String of the NetCDF file name
+        """
+        return "STEP_0102_NDVI_{}_{}.nc".format(self.__region, date_string)
+
     def get_files_to_process(self, all_hdf=False):
         """
         This function gets the list of HDF files to convert to NetCDF subsets
@@ -147,17 +155,14 @@ class NormalizedDifferenceVegetationIndex:
         """
         files = []
         try:
-            raw_files = self.__fileHandler.get_raw_file_names('ndvi_hdf_regex')
             if all_hdf:  # include all HDF files
-                files = raw_files
-            else:  # determine which HDF files have not been converted to NetCDF
-                working_files = self.__fileHandler.get_working_file_names('ndvi_netcdf_regex')
-                # parse out the year/days from the file name #
-                for f in raw_files:
-                    file_date = self.__get_hdf_date(f)
-                    test_file = "STEP_0102_NDVI_{}_{}.nc".format(self.__region, file_date)
-                    if test_file not in working_files:
-                        files.append(f)
+                files = self.__fileHandler.get_raw_file_names('ndvi_hdf_regex')
+            else:  # determine which HDF files are new or changed since they were stored in the working cube
+                with self.__open_cube() as cube:
+                    # load the NetCDF files of earlier runs into the cube #
+                    cube.import_files(self.__get_working_files(), ['NDVI'])
+                    stored = set(self.__get_working_name(d) for d in cube.get_dates())
+                files = self.__fileHandler.get_new_or_changed_files('ndvi_hdf_regex', self.__get_netcdf_name, stored)
         except IOError:
             raise
         except Exception:
@@ -165,30 +170,61 @@ class NormalizedDifferenceVegetationIndex:
         finally:
             return files
 
-    def create_ndvi_netcdf_file(self, file_name):
+    def __create_ndvi_data(self, file_name, data_set=None):
         """
-        This function reads the required parameters from a HDF file and creates a NetCDF file of the subset data for the current region
+        This function reads the required parameters from a HDF file and filters the NDVI data of the current region by quality
         Args:
             file_name (str): the name of the HDF file to process
+            data_set (h5py File): optional open HDF file, shared with other regions (default is None: open the file)
 
         Returns:
-            None: results are a NetCDF file created in the working directory for the particular year/month
+            2D numpy float32 array of the QC filtered NDVI values, with NaN for the missing values
         """
         raw_file_path = "{}/{}".format(self.__raw_data_dir, file_name)
-        file_date = self.__get_hdf_date(file_name)
-        output_file = os.path.join(self.__working_dir, "STEP_0102_NDVI_{}_{}.nc".format(self.__region, file_date))
-        output_data_set = None
         try:
             # extract SubGrids of the required parameters #
-            with HDFSubGrid(self.__bounds, raw_file_path, self.__hdf_group) as sg:
-                ndvi_data = sg.create_sub_grid('CMG 0.05 Deg Monthly NDVI') * 0.0001  # data is scaled in the HDF file
-                qc_data = sg.create_sub_grid('CMG 0.05 Deg Monthly VI Quality')
+            with HDFSubGrid(self.__bounds, raw_file_path, self.__hdf_group, data_set) as sg:
+                sub_grids = sg.create_sub_grids(['CMG 0.05 Deg Monthly NDVI', 'CMG 0.05 Deg Monthly VI Quality'])
+            ndvi_data = sub_grids['CMG 0.05 Deg Monthly NDVI'] * 0.0001  # data is scaled in the HDF file
+            qc_data = sub_grids['CMG 0.05 Deg Monthly VI Quality']
 
             # filter the NDVI data by quality #
             qc_filter = np.logical_or(np.logical_or(np.logical_and(qc_data > 17407, qc_data < 18432), qc_data < 11263), ndvi_data == -0.3)
-            data_mask = ma.masked_where(qc_filter, ndvi_data)
-            filtered_ndvi_data = data_mask.filled(self.__missing)
+            return np.where(qc_filter, np.nan, ndvi_data).astype(np.float32)
+        except IOError:
+            raise
+        except Exception:
+            raise
+
+    def process_ndvi_file(self, file_name, data_set=None):
+        """
+        This function computes the QC filtered NDVI data of a HDF file for the working cube, and creates the NetCDF file
+            of the month if the per-month files are exported (export_working_files setting)
+        Args:
+            file_name (str): the name of the HDF file to process
+            data_set (h5py File): optional open HDF file, shared with other regions (default is None: open the file)
+
+        Returns:
+            Dictionary of parameter name -> 2D numpy array of the values
+        """
+        filtered_ndvi_data = self.__create_ndvi_data(file_name, data_set)
+        if self.__export_files:
+            self.create_ndvi_netcdf_file(file_name, filtered_ndvi_data)
+        return {'NDVI': filtered_ndvi_data}
 
+    def create_ndvi_netcdf_file(self, file_name, filtered_ndvi_data):
+        """
+        This function creates a NetCDF file of the QC filtered NDVI data of a HDF file in the working directory
+        Args:
+            file_name (str): the name of the HDF file
+            filtered_ndvi_data (numpy array): the QC filtered NDVI values of the current region
+
+        Returns:
+            None: results are a NetCDF file created in the working directory for the particular year/month
+        """
+        output_file = os.path.join(self.__working_dir, self.__get_netcdf_name(file_name))
+        output_data_set = None
+        try:
             # create the output file #
             out_properties = {
                 'latitudes': self.__latitudes,
@@ -199,11 +235,11 @@ class NormalizedDifferenceVegetationIndex:
             output_data_set = netcdf.initialize_dataset(output_file, out_properties)
 
             # add NDVI data to output data set #
-            ndvi_var = output_data_set.createVariable('NDVI', 'float32', ('time', 'latitude', 'longitude'))
+            ndvi_var = netcdf.create_variable(output_data_set, 'NDVI', self.__storage)
             ndvi_var.units = "NDVI"
             ndvi_var.missing_value = self.__missing
             ndvi_var.long_name = "Monthly QC filtered NDVI data"
-            ndvi_var[0] = filtered_ndvi_data
+            ndvi_var[0] = netcdf.nan_to_missing(filtered_ndvi_data, self.__missing)
         except IOError:
             raise
         except Exception:
@@ -212,48 +248,67 @@ class NormalizedDifferenceVegetationIndex:
             if output_data_set is not None:
                 output_data_set.close()
 
-    def update_ndvi_anomaly_file(self):
+    def update_ndvi_anomaly_file(self, incremental=False):
         """
-        This function processes the files for a particular month and adds the anomaly arrays to the final NetCDF file
+        This function processes the values of the working cube for a particular month and adds the anomaly arrays to the final NetCDF file
+            In incremental mode the existing anomaly file is extended with the new times, and only the calendar months
+            whose values changed since the last update are computed again; the file is recreated if it can not be extended
+        Args:
+            incremental (boolean): optional flag to update the existing anomaly file (default is False: recreate the file)
         """
         output_file = os.path.join(self.__output_dir, "STEP_0102_NDVI_anomaly_{}.nc".format(self.__region))
         output_data_set = None
         try:
-            # get list of NDVI NetCDF files #
-            self.netcdf_files = sorted(self.__fileHandler.get_working_file_names('ndvi_netcdf_regex'))
-            # initialize the NDVI anomaly file #
-            out_properties = {
-                'latitudes': self.__latitudes,
-                'longitudes': self.__longitudes,
-                'times': self.__get_calendar_times(self.netcdf_files),
-                'time_units': 'days since 1900-01-01 00:00:00.0 UTC'
-            }
-            print("Creating NDVI anomaly file")
-            output_data_set = netcdf.initialize_dataset(output_file, out_properties)
-            # add NDVI anomalies to output data set #
-            ndvi_var = output_data_set.createVariable('ndvi_anom', 'float32', ('time', 'latitude', 'longitude'))
-            ndvi_var.units = "NDVI"
-            ndvi_var.missing_value = self.__missing
-            ndvi_var.long_name = "Monthly NDVI anomaly"
-
-            # determine the order of the months #
-            month_list = []
-            for m in range(0, 12):
-                null, month = self.__working_file_match.match(self.netcdf_files[m]).groups()
-                month_list.append(month)
-            # loop thru months and process the anomaly per year #
-            stats_ops = StatisticOperations()
-            for idx, m in enumerate(month_list):
-                # get the list of files for a particular month #
-                files = self.__get_ndvi_files_by_month(m)
-                # compute the NDVI anomalies per year for a particular month #
-                month_anomalies = stats_ops.compute_anomalies_from_files(files, "NDVI")
-                # set the starting index to the month index #
-                index = idx
-                # loop thru the years and add the data to the NetCDF file #
-                for y in month_anomalies:
-                    ndvi_var[index] = y
-                    index += 12  # increment 1 year
+            with self.__open_cube(True) as cube:
+                # get the list of NDVI dates #
+                dates = cube.get_dates()
+                out_properties = {
+                    'latitudes': self.__latitudes,
+                    'longitudes': self.__longitudes,
+                    'times': [get_calendar_value(d) for d in dates],
+                    'time_units': 'days since 1900-01-01 00:00:00.0 UTC'
+                }
+                # open the NDVI anomaly file for an update, or initialize it #
+                if incremental:
+                    output_data_set = netcdf.open_dataset_for_update(output_file, out_properties)
+                if output_data_set is None:
+                    print("Creating NDVI anomaly file")
+                    output_data_set = netcdf.initialize_dataset(output_file, out_properties, unlimited_time=True)
+                    # add NDVI anomalies to output data set #
+                    ndvi_var = netcdf.create_variable(output_data_set, 'ndvi_anom', self.__storage)
+                    ndvi_var.units = "NDVI"
+                    ndvi_var.missing_value = self.__missing
+                    ndvi_var.long_name = "Monthly NDVI anomaly"
+                else:
+                    print("Updating NDVI anomaly file")
+                    ndvi_var = output_data_set.variables['ndvi_anom']
+
+                # determine the order of the months #
+                month_list = [d[4:6] for d in dates[0:12]]
+                # keep the anomalies for the ranking in the fused mode #
+                anomalies = None
+                if cube_cache.is_enabled():
+                    anomalies = np.full((len(dates), len(self.__latitudes), len(self.__longitudes)), self.__missing, dtype=np.float32)
+                # loop thru months and process the anomaly per year #
+                stats_ops = StatisticOperations()
+                for idx, m in enumerate(month_list):
+                    # get the dates of a particular month #
+                    month_dates = [d for d in dates if d[4:6] == m]
+                    # skip the months whose values have not changed since the anomalies were computed #
+                    fingerprint_name = 'source_fingerprint_{}'.format(m)
+                    fingerprint = cube.get_fingerprint(month_dates)
+                    if fingerprint_name in ndvi_var.ncattrs() and ndvi_var.getncattr(fingerprint_name) == fingerprint:
+                        # the anomalies of the unchanged month are taken from the file #
+                        if anomalies is not None:
+                            values = netcdf.missing_to_nan(ndvi_var[idx:len(dates):12], self.__missing)
+                            anomalies[idx:len(dates):12] = netcdf.nan_to_missing(values, self.__missing)
+                        continue
+                    # compute the NDVI anomalies per year for a particular month and add them to the NetCDF file, #
+                    # starting at the month index #
+                    stats_ops.write_anomalies(month_dates, lambda d: cube.read_values('NDVI', d), ndvi_var, idx, cube=anomalies)
+                    ndvi_var.setncattr(fingerprint_name, fingerprint)
+                if anomalies is not None:
+                    cube_cache.put(output_file, 'ndvi_anom', anomalies, self.__missing)
         except IOError:
             raise
         except Exception:
@@ -262,18 +317,106 @@ class NormalizedDifferenceVegetationIndex:
             if output_data_set is not None:
                 output_data_set.close()
 
+    def create_ndvi_netcdf_files(self, files, workers=1):
+        """
+        This function runs process_ndvi_file for a list of HDF files, in parallel worker processes if requested
+            The values are written to the working cube by the current process;
+            the converted files are recorded in the catalog of the working directory
+        Args:
+            files (list of str): the names of the HDF files to process
+            workers (int): optional number of worker processes (default is 1)
+
+        Returns:
+            Dictionary of HDF file name -> error description for the files that failed
+        """
+        with self.__open_cube() as cube:
+            cube.reserve([self.__get_hdf_date(f) for f in files])
+            return self.__fileHandler.process_raw_files(
+                'ndvi_hdf_regex', files, self.process_ndvi_file, self.__get_netcdf_name, workers,
+                lambda f, values: cube.write(self.__get_hdf_date(f), values)
+            )
+
+    def open_raw_file(self, file_name):
+        """
+        This function opens a HDF file of the raw data directory, to share it between the regions of a RegionBatch
+        """
+        return hdf.open_dataset("{}/{}".format(self.__raw_data_dir, file_name))
+
+    def process_raw_file(self, file_name, data_set):
+        """
+        This function computes the values of the current region from an open HDF file (see RegionBatch)
+        """
+        return self.process_ndvi_file(file_name, data_set)
+
+    def open_working_cube(self):
+        """
+        This function returns the working cube of the current region (see RegionBatch)
+        """
+        return self.__open_cube()
+
+    def reserve_raw_files(self, cube, files):
+        """
+        This function reserves the months of HDF files in the working cube (see RegionBatch)
+        """
+        cube.reserve([self.__get_hdf_date(f) for f in files])
+
+    def store_raw_result(self, cube, file_name, values):
+        """
+        This function writes the values of a HDF file to the working cube (see RegionBatch)
+        """
+        cube.write(self.__get_hdf_date(file_name), values)
+
+    def record_raw_files(self, files, failures):
+        """
+        This function records the converted HDF files in the catalog of the working directory (see RegionBatch)
+        """
+        try:
+            self.__fileHandler.record_processed_files('ndvi_hdf_regex', files, failures, self.__get_netcdf_name)
+        finally:
+            self.__fileHandler.save_catalog()
+
+
+def process_regions(args, regions):
+    """
+    This function processes the NDVI of several regions, reading each HDF file once for all the regions (see RegionBatch)
+    """
+    mode = str(args.mode)
+    ndvi = {r: NormalizedDifferenceVegetationIndex(r) for r in regions}
+
+    # verify raw files are HDF5 format #
+    failures = ndvi[regions[0]].convert_h4_to_h5(args.workers, args.convert_timeout)
+    parallel.report_failures(failures, None, "NDVI HDF4 to HDF5 conversion")
+
+    # determine the files to process per region #
+    files_to_process = {r: ndvi[r].get_files_to_process(mode == 'all') for r in regions}
+    file_count = sum(len(f) for f in files_to_process.values())
+    print("Processing {} months for NDVI in {} regions.".format(file_count, len(regions)))
+
+    # convert the HDF files once for all the regions #
+    failures = RegionBatch(ndvi).run(files_to_process, args.workers)
+    parallel.report_failures(failures, file_count, "NDVI HDF to NetCDF conversion")
+
+    # create the NDVI anomaly file of each region #
+    for r in regions:
+        ndvi[r].update_ndvi_anomaly_file(mode != 'all')
+
 
 def main(args):
     """
     This is the main entry point for the program
     """
+    regions = select_regions(getattr(args, 'regions', None))
+    if regions is not None:
+        process_regions(args, regions)
+        return
     mode = str(args.mode)
 
     # initialize a new NDVI class #
     ndvi = NormalizedDifferenceVegetationIndex()
 
     # verify raw files are HDF5 format #
-    ndvi.convert_h4_to_h5()
+    failures = ndvi.convert_h4_to_h5(args.workers, args.convert_timeout)
+    parallel.report_failures(failures, None, "NDVI HDF4 to HDF5 conversion")
 
     # determine the files to process #
     if mode == 'all':
@@ -287,11 +430,11 @@ def main(args):
             print("Processing needed months for NDVI.")
 
     # convert any unprocessed HDF files to NetCDF format #
-    for f in files_to_process:
-        ndvi.create_ndvi_netcdf_file(f)
+    failures = ndvi.create_ndvi_netcdf_files(files_to_process, args.workers)
+    parallel.report_failures(failures, len(files_to_process), "NDVI HDF to NetCDF conversion")
 
     # create the NDVI anomaly file #
-    ndvi.update_ndvi_anomaly_file()
+    ndvi.update_ndvi_anomaly_file(mode != 'all')
 
 
 if __name__ == '__main__':
@@ -299,5 +442,12 @@ if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument("-m", "--mode", default="updates",
                         help="The mode of the current processing: updates or all. Default is updates")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="Number of worker processes (and simultaneous HDF4 to HDF5 conversions) for the HDF file conversions. Default is 1")
+    parser.add_argument("--convert-timeout", type=float, default=900,
+                        help="Number of seconds allowed per HDF4 to HDF5 conversion. Default is 900")
+    parser.add_argument("--regions", nargs='*', metavar="NAME",
+                        help="Process the named regions of the regions setting (all the regions if no name is given), "
+                             "reading each HDF file once")
     # execute the programs with the supplied options
     main(parser.parse_args())
@@ -2,29 +2,39 @@
 import os
 from libs.config_reader import ConfigParser
 from libs.file_operations import FileHandler
+from libs.cube_store import CubeStore, get_calendar_value
 from libs.subgrid_calculations import CHIRPSSubGrid
+from libs.region_batch import RegionBatch, select_regions
 from libs.statistics_operations import StatisticOperations
+import libs.cube_cache as cube_cache
 import libs.netcdf_functions as netcdf
-from libs.spi_calculations import calculate_monthly_spi as spi_calc
+import libs.parallel_operations as parallel
+from libs.spi_calculations import calculate_monthly_spi_fast as spi_calc, calculate_period_totals
 from argparse import ArgumentParser
 import numpy as np
-import numpy.ma as ma
+import rasterio
 import re
-from datetime import date, timedelta
+from datetime import date
 
 
 class StandardizedPrecipitationIndex:
     """
     This is the core processing class for executing all SPI (standardized precipitation index) operations
     """
-    def __init__(self):
-        self.__config = ConfigParser()
+    def __init__(self, region=None):
+        """
+        Args:
+            region (str): optional name of the region of the regions setting (default is the region of region_name/bounds)
+        """
+        self.__config = ConfigParser(region)
         self.__spi_periods = sorted(self.__config.get('spi_periods'))
         self.__raw_data_dir = self.__config.get('raw_data_dirs', 'chirps_tif').replace("\\", '/')
         self.__working_dir = self.__config.get('scratch_dir').replace("\\", '/') + '/SPI'
         self.__output_dir = self.__config.get('output_dir').replace("\\", '/')
         self.__region = self.__config.get('region_name')
         self.__bounds = self.__config.get('bounds')
+        self.__storage = self.__config.get('netcdf_storage')
+        self.__export_files = self.__config.get('export_working_files')
         self.__file_patterns = self.__config.get('file_patterns')
         self.__file_patterns['chirps_netcdf_regex'] = "STEP_0103_CHIRPS_{}_((?:19|20)\\d\\d)(0[1-9]|1[0-2])\\.nc".format(self.__region)
         self.__file_patterns['spi_netcdf_regex'] = "STEP_0103_SPI_{}_((?:19|20)\\d\\d)(0[1-9]|1[0-2])\\.nc".format(self.__region)
@@ -38,9 +48,11 @@ class StandardizedPrecipitationIndex:
         self.__working_spi_file_match = re.compile(r'{}'.format(self.__file_patterns['spi_netcdf_regex']))
         self.__latitudes = self.__config.get('latitudes')
         self.__longitudes = self.__config.get('longitudes')
+        self.__cube_file = os.path.join(self.__working_dir, "STEP_0103_CHIRPS_cube_{}.nc".format(self.__region))
         self.__missing = -9999.0
         self.netcdf_files = []
         self.__precip_times = []
+        self.__precip_dates = []
         self.__start_index = {}
 
     def __get_chirps_date(self, file_name):
@@ -85,49 +97,28 @@ class StandardizedPrecipitationIndex:
         time_delta = test_date - origin_date
         return int(time_delta.days)
 
-    @staticmethod
-    def __get_calendar_times(files, match_regex):
+    def __open_cube(self):
         """
-        This function builds a list of the valid times as days since Jan 1, 1900
-        Args:
-            files: list of the file names as strings
-            match_regex: regex of the file name pattern to parse
-
+        This function returns the working cube of the CHIRPS precipitation values (see CubeStore)
         Returns:
-            List (floats) of the valid times as number of days since Jan 1, 1900
+            CubeStore object, to open with a 'with' statement
         """
-        origin_date = date(1900, 1, 1)
-        times = []
-        for f in files:
-            (year, month) = match_regex.match(f).groups()
-            test_date = date(int(year), int(month), 1)
-            time_delta = test_date - origin_date
-            times.append(float(time_delta.days))
-        return times
+        variables = {
+            'precip_mm': {'units': "mm", 'long_name': "Monthly precipitation amount"}
+        }
+        return CubeStore(self.__cube_file, self.__latitudes, self.__longitudes, variables, self.__storage)
 
-    def __get_calendar_times_by_month(self, desired_month, period):
+    def __get_working_files(self):
         """
-        This function determines the time index values from the list of available dates that match a particular month of the year
-        Args:
-            desired_month (int): numeric value of the month (1 - 12)
-
+        This function finds the CHIRPS NetCDF files per month in the working directory (exported, or created by earlier versions)
         Returns:
-            list of the indices that match the desired dates
+            Dictionary of 'YYYYMM' date -> fully-qualified name
         """
-        try:
-            origin_date = date(1900, 1, 1)
-            indices = []
-            # loop thru the times of the precip file and find the indices by month #
-            for i in range(self.__start_index[period], len(self.__precip_times)):
-                time = self.__precip_times[i]
-                valid_time = origin_date + timedelta(days=int(time))
-                if valid_time.month == desired_month:
-                    indices.append(i)
-            return indices
-        except ValueError:
-            raise
-        except Exception:
-            raise
+        files = {}
+        for f in self.__fileHandler.get_working_file_names('chirps_netcdf_regex'):
+            (year, month) = self.__working_chirps_file_match.match(f).groups()
+            files[year + month] = '{}/{}'.format(self.__working_dir, f)
+        return files
 
     def __get_chirps_files_by_month(self, month):
         """
@@ -151,65 +142,62 @@ class StandardizedPrecipitationIndex:
         finally:
             return results
 
-    def __get_precip_from_netcdf(self, file_name):
+    def __create_spi_anomalies(self, precip_values, months):
         """
-        This function extracts the precipitation values from a CHIRPS NetCDF file
+        This function calculates the SPI and the SPI anomalies of a series of precipitation totals for all months at once
+            The totals are grouped by the calendar month of their date, so a month missing from the series does not shift
+            the later months; the calendar months with the same number of years are calculated as one batch,
+            viewed as (years, months, latitudes, longitudes)
         Args:
-            file_name (str): name of the CHIRPS NetCDF to read
+            precip_values: numpy 3D array of the monthly precipitation totals, with NaN for the missing totals
+            months (list of int): the calendar month (1 - 12) of each total
 
         Returns:
-            numpy 2D array of precipitation values for the month
+            numpy 3D float32 array of the SPI anomalies for the times of the totals, with NaN for the missing anomalies
         """
-        dataset = None
-        values = []
-        try:
-            file_path = '{}/{}'.format(self.__working_dir, file_name)
-            dataset = netcdf.open_dataset(file_path)
-            values = netcdf.extract_data(dataset, 'precip_mm')
-        except IOError:
-            raise
-        except Exception:
-            raise
-        finally:
-            if dataset is not None:
-                dataset.close()
-            return values
+        stats_ops = StatisticOperations()
+        months = np.asarray(months)
+        anomalies = np.full(precip_values.shape, np.nan, dtype=np.float32)
+        # group the time indices of the calendar months by their number of years #
+        batches = {}
+        for month in range(1, 13):
+            indices = np.flatnonzero(months == month)
+            if len(indices) > 0:
+                batches.setdefault(len(indices), []).append(indices)
+        for month_indices in batches.values():
+            # view the totals of the batch per year and month: missing totals have no precipitation #
+            indices = np.stack(month_indices, axis=1)
+            values = precip_values[indices]
+            values[np.isnan(values)] = 0.0
+            # compute the SPI values and the anomalies of the batch of months #
+            spi = spi_calc(values)
+            del values
+            anomalies[indices] = stats_ops.compute_anomalies_from_values(spi)
+            del spi
+        return anomalies
+
+    def __get_netcdf_name(self, file_name):
+        """
+        This function returns the name of the NetCDF file created in the working directory for a TIF file
+        Args:
+            file_name (str): name of the TIF file
 
-    def __create_spi_data_from_precip(self, month, period):
+        Returns:
+            String of the NetCDF file name
+        """
+        return self.__get_working_name(self.__get_chirps_date(file_name))
+
+    def __get_working_name(self, date_string):
         """
-        This function loads the precipitation values for a particular month and desired totaling period (1-month, 3-month, etc.)
-            and calculates the SPI for that data
+        This function returns the name of the NetCDF file of a month in the working directory,
+            which also identifies the month in the working cube
         Args:
-            month (int): the numeric value of the month (1 - 12)
-            period (int): the numeric value of the totaling period
+            date_string (str): year/month in 'YYYYMM' format
 
         Returns:
-            list of 2D numpy arrays, and a list of the time dimension indices
+            String of the NetCDF file name
         """
-        precip_file = os.path.join(self.__working_dir, "STEP_0103_Precip_Totals_{}.nc".format(self.__region))
-        input_dataset = netcdf.open_dataset(precip_file)
-        try:
-            precip_values = []
-            # determine the time positions for the month #
-            times = self.__get_calendar_times_by_month(month, period)
-            # extract the period precipitation values for the month series #
-            for t in times:
-                v = netcdf.extract_data(input_dataset, 'precip_{}_month'.format(period), t)
-                precip_values.append(np.where(v == self.__missing, 0.0, v))
-            # compute the SPI values #
-            spi_values = spi_calc(precip_values)
-            # cleanup memory #
-            del precip_values
-            # return the SPI values #
-            return spi_values, times
-        except ValueError:
-            raise
-        except IOError:
-            raise
-        except Exception:
-            raise
-        finally:
-            input_dataset.close()
+        return "STEP_0103_CHIRPS_{}_{}.nc".format(self.__region, date_string)
 
     def get_chirps_files_to_process(self, all_tif=False):
         """
@@ -222,21 +210,14 @@ class StandardizedPrecipitationIndex:
         """
         files = []
         try:
-            raw_files = self.__fileHandler.get_raw_file_names('chirps_tif_regex')
             if all_tif:  # include all TIF files
-                files = raw_files
-            else:  # determine which TIF files have not been converted to NetCDF
-                working_files = self.__fileHandler.get_working_file_names('chirps_netcdf_regex')
-                # compare the raw files with the processed files #
-                for f in raw_files:
-                    # parse out the year/days from the file name #
-                    (year, month) = self.__raw_file_match.match(f).groups()
-                    file_date = "{}{}".format(year, month)
-                    # prepare the NetCDF filename to test for #
-                    test_file = "STEP_0103_CHIRPS_{}_{}.nc".format(self.__region, file_date)
-                    if test_file not in working_files:
-                        # add the file name to the list to process #
-                        files.append(f)
+                files = self.__fileHandler.get_raw_file_names('chirps_tif_regex')
+            else:  # determine which TIF files are new or changed since they were stored in the working cube
+                with self.__open_cube() as cube:
+                    # load the NetCDF files of earlier runs into the cube #
+                    cube.import_files(self.__get_working_files(), ['precip_mm'])
+                    stored = set(self.__get_working_name(d) for d in cube.get_dates())
+                files = self.__fileHandler.get_new_or_changed_files('chirps_tif_regex', self.__get_netcdf_name, stored)
         except IOError:
             raise
         except Exception:
@@ -244,24 +225,38 @@ class StandardizedPrecipitationIndex:
         finally:
             return files
 
-    def create_chirps_netcdf_file(self, file_name):
+    def process_chirps_file(self, file_name, data_set=None):
         """
-        This function reads the values from a CHIRPS TIF file and creates a NetCDF file of the subset data for the current region
+        This function reads the values from a CHIRPS TIF file for the working cube, and creates the NetCDF file of the month
+            if the per-month files are exported (export_working_files setting)
         Args:
             file_name (str): the name of the TIF file to process
+            data_set (rasterio DatasetReader): optional open TIF file, shared with other regions (default is None: open the file)
 
         Returns:
-            None: results are a NetCDF file created in the working directory for the particular year/month
+            Dictionary of parameter name -> 2D numpy array of the values
         """
         raw_file_path = "{}/{}".format(self.__raw_data_dir, file_name)
-        file_date = self.__get_chirps_date(file_name)
-        output_file = os.path.join(self.__working_dir, "STEP_0103_CHIRPS_{}_{}.nc".format(self.__region, file_date))
+        # extract SubGrids of the required parameters #
+        with CHIRPSSubGrid(self.__bounds, raw_file_path, data_set) as sg:
+            precip_data = sg.create_sub_grid()
+        if self.__export_files:
+            self.create_chirps_netcdf_file(file_name, precip_data)
+        return {'precip_mm': precip_data}
+
+    def create_chirps_netcdf_file(self, file_name, precip_data):
+        """
+        This function creates a NetCDF file of the precipitation values of a CHIRPS TIF file in the working directory
+        Args:
+            file_name (str): the name of the TIF file
+            precip_data (numpy array): the precipitation values of the current region
+
+        Returns:
+            None: results are a NetCDF file created in the working directory for the particular year/month
+        """
+        output_file = os.path.join(self.__working_dir, self.__get_netcdf_name(file_name))
         output_data_set = None
         try:
-            # extract SubGrids of the required parameters #
-            with CHIRPSSubGrid(self.__bounds, raw_file_path) as sg:
-                precip_data = sg.create_sub_grid()
-
             # create the output file #
             out_properties = {
                 'latitudes': self.__latitudes,
@@ -272,7 +267,7 @@ class StandardizedPrecipitationIndex:
             output_data_set = netcdf.initialize_dataset(output_file, out_properties)
 
             # add precipitation data to output data set #
-            precip_var = output_data_set.createVariable('precip_mm', 'float32', ('time', 'latitude', 'longitude'))
+            precip_var = netcdf.create_variable(output_data_set, 'precip_mm', self.__storage)
             precip_var.units = "mm"
             precip_var.missing_value = self.__missing
             precip_var.long_name = "Monthly precipitation amount"
@@ -285,7 +280,7 @@ class StandardizedPrecipitationIndex:
             if output_data_set is not None:
                 output_data_set.close()
 
-    def create_precip_from_chirps(self):
+    def create_precip_from_chirps(self, block_months=120):
         """
         This function takes the precipitation data from the individual dates and adds monthly-period totals to a single NetCDF file.
             The list of periods to process are set int the configuration file.
@@ -293,18 +288,27 @@ class StandardizedPrecipitationIndex:
                 for the 1-month periods the values are simply copied to the new file
                 for the 3-month periods, the first 2 available months do not have any data; the 3rd available month uses the sum of values from months 1-3
                     each following month is the sum of that month and the previous two months
+            The totals of all periods are computed together from cumulative sums (see calculate_period_totals),
+            in blocks of months that are read from the working cube and written to the output file as single slabs
+        Args:
+            block_months (int): optional number of months per block, to limit the memory used (default is 120)
+
         Returns:
             None: data is directly written to the output NetCDF file
         """
         output_file = os.path.join(self.__working_dir, "STEP_0103_Precip_Totals_{}.nc".format(self.__region))
         output_data_set = None
-        min_range = min(self.__spi_periods)
+        cube = None
         max_range = max(self.__spi_periods)
         try:
-            chirps_files = sorted(self.__fileHandler.get_working_file_names('chirps_netcdf_regex'))
+            # open the working cube of the CHIRPS values #
+            cube = self.__open_cube()
+            cube.open()
+            chirps_dates = cube.get_dates()
 
             # get the valid times of the totals #
-            self.__precip_times = self.__get_calendar_times(chirps_files, self.__working_chirps_file_match)
+            self.__precip_times = [get_calendar_value(d) for d in chirps_dates]
+            self.__precip_dates = chirps_dates
 
             # create the output file #
             out_properties = {
@@ -316,56 +320,35 @@ class StandardizedPrecipitationIndex:
             output_data_set = netcdf.initialize_dataset(output_file, out_properties)
 
             # add precipitation data to output data set #
-            rows = len(self.__latitudes)
-            columns = len(self.__longitudes)
             precip_vars = []
-            empty_set = np.full((rows, columns), self.__missing)
             for p in self.__spi_periods:
                 self.__start_index[p] = (p - 1)
-                precip_var = output_data_set.createVariable('precip_{}_month'.format(p), 'float32', ('time', 'latitude', 'longitude'))
+                precip_var = netcdf.create_variable(output_data_set, 'precip_{}_month'.format(p), self.__storage)
                 precip_var.units = "mm"
                 precip_var.missing_value = self.__missing
                 precip_var.long_name = "{} Month precipitation amount".format(p)
-                for t in range(0, len(self.__precip_times)):
-                    precip_var[t] = empty_set
                 precip_vars.append(precip_var)
-            # separate 1-month periods from any that need totals #
-            if min_range == 1:
-                for i in range(0, len(chirps_files)):
-                    precip_vars[0][i] = self.__get_precip_from_netcdf(chirps_files[i])
-            # continue with the remaining periods #
-            if max_range > 1:
-                # load the range of the longest period, minus 1 month #
-                precip_values = []
-                for i in range(0, max_range):
-                    precip_values.append(self.__get_precip_from_netcdf(chirps_files[i]))
-                # loop thru the remaining times and create the monthly totals #
-                for i in range((max_range - 1), len(chirps_files)):
-                    offset = i - (max_range - 1)
-                    # load the current month #
-                    precip_values.append(self.__get_precip_from_netcdf(chirps_files[i]))
-                    # compute the monthly totals and append the values to the output array #
-                    for j, period in enumerate(self.__spi_periods):
-                        # determine the number of sub-totals within the max range period #
-                        """
-                        Example: assuming we want SPI values for 3-month, and 9-month ranges
-                            Our maximum range is 9 months for the current data set
-                            We have:
-                                7 3-month values starting at the 3rd index
-                                1 9-month value starting at the 9th index
-                        """
-                        if period > 1:
-                            first = 0
-                            last = period
-                            # loop thru the current subset of precipitation values and create the totals #
-                            for s in range(self.__start_index[period], max_range):
-                                first += 1
-                                last += 1
-                                total_precip = ma.sum(ma.masked_equal(precip_values[first:last], self.__missing), axis=0)
-                                precip_vars[j][s + offset] = total_precip.filled(self.__missing)
-                    # remove the first date from the precip array #
-                    precip_values = precip_values[1:]
-                del precip_values
+            # keep the totals for the SPI anomalies in the fused mode #
+            totals_cubes = None
+            if cube_cache.is_enabled():
+                totals_cubes = {p: np.empty((len(chirps_dates), len(self.__latitudes), len(self.__longitudes)), dtype=np.float32)
+                                for p in self.__spi_periods}
+            # loop thru the blocks of months and create the monthly totals #
+            for first in range(0, len(chirps_dates), block_months):
+                last = min(first + block_months, len(chirps_dates))
+                # load the block, with the months of the longest period before it #
+                history = min(first, max_range - 1)
+                precip_values = cube.read('precip_mm', chirps_dates[(first - history):last])
+                totals = calculate_period_totals(precip_values, self.__spi_periods)
+                # write the totals of the block #
+                for j, period in enumerate(self.__spi_periods):
+                    period_totals = netcdf.nan_to_missing(totals[period][history:], self.__missing)
+                    precip_vars[j][first:last] = period_totals
+                    if totals_cubes is not None:
+                        totals_cubes[period][first:last] = period_totals
+                del precip_values, totals
+            for period in (totals_cubes or {}).keys():
+                cube_cache.put(output_file, 'precip_{}_month'.format(period), totals_cubes[period], self.__missing)
         except IOError as ioe:
             print(ioe)
         except Exception as ex:
@@ -373,12 +356,18 @@ class StandardizedPrecipitationIndex:
         finally:
             if output_data_set is not None:
                 output_data_set.close()
+            if cube is not None:
+                cube.close()
 
     def create_spi_anomaly_file(self):
         """
         This function processes the SPI per month series and adds the anomaly values to the final NetCDF file
+            Each precipitation total is read once from the totals file, and its anomalies are written as a single slab
         """
         output_file = os.path.join(self.__output_dir, "STEP_0103_SPI_anomaly_{}.nc".format(self.__region))
+        precip_file = os.path.join(self.__working_dir, "STEP_0103_Precip_Totals_{}.nc".format(self.__region))
+        output_data_set = None
+        input_data_set = None
         try:
             # initialize the SPI anomaly file #
             out_properties = {
@@ -389,41 +378,33 @@ class StandardizedPrecipitationIndex:
             }
             print("Creating SPI anomaly file")
             output_data_set = netcdf.initialize_dataset(output_file, out_properties)
-            # add SPI anomaly to output data set #
+            input_data_set = netcdf.open_dataset(precip_file)
             rows = len(self.__latitudes)
             columns = len(self.__longitudes)
-            empty_set = np.full((rows, columns), self.__missing)
             for p in self.__spi_periods:
-                spi_var = output_data_set.createVariable('spi_{}_anom'.format(p), 'float32', ('time', 'latitude', 'longitude'))
+                # add SPI anomaly to output data set #
+                spi_var = netcdf.create_variable(output_data_set, 'spi_{}_anom'.format(p), self.__storage)
                 spi_var.units = "none"
                 spi_var.missing_value = self.__missing
                 spi_var.long_name = "Monthly SPI anomaly ({} month precip totals)".format(p)
-                for t in range(0, self.__start_index[p]):
-                    spi_var[t] = empty_set
-            # close the file and cleanup memory $
-            output_data_set.close()
-            del rows, columns, empty_set
-
-            # loop thru the months and compute the anomaly series #
-            stats_ops = StatisticOperations()
-            for i, p in enumerate(self.__spi_periods):
-                # open the NetCDF file in append mode #
-                output_data_set = netcdf.open_dataset(output_file, 'a')
-                spi_var = output_data_set.variables['spi_{}_anom'.format(p)]
-                for m in range(1, 13):
-                    # compute the spi values #
-                    (spi, times) = self.__create_spi_data_from_precip(m, p)
-                    # compute the monthly anomalies #
-                    anomalies = stats_ops.compute_anomalies_from_values(spi)
-                    # cleanup memory #
-                    del spi
-                    # add the anomalies to the NetCDF file #
-                    for idx, t in enumerate(times):
-                        spi_var[t] = anomalies[idx]
-                    # cleanup memory #
-                    del anomalies
-                # close file to write the data #
-                output_data_set.close()
+                start = min(self.__start_index[p], len(self.__precip_times))
+                empty_values = np.full((start, rows, columns), self.__missing)
+                spi_var[0:start] = empty_values
+                # read the precipitation totals of the period (from the cube cache in the fused mode) #
+                # and compute the anomalies of all months #
+                cached_values = cube_cache.get(precip_file, 'precip_{}_month'.format(p))
+                if cached_values is not None:
+                    precip_values = netcdf.missing_to_nan(cached_values[start:], self.__missing)
+                else:
+                    precip_values = netcdf.missing_to_nan(input_data_set.variables['precip_{}_month'.format(p)][start:], self.__missing)
+                months = [int(d[4:6]) for d in self.__precip_dates[start:]]
+                anomalies = netcdf.nan_to_missing(self.__create_spi_anomalies(precip_values, months), self.__missing)
+                spi_var[start:] = anomalies
+                # keep the anomalies for the ranking in the fused mode #
+                if cube_cache.is_enabled():
+                    cube_cache.put(output_file, 'spi_{}_anom'.format(p), np.concatenate([empty_values, anomalies]), self.__missing)
+                # cleanup memory #
+                del precip_values, anomalies
                 print("-- SPI anomalies calculated for {}-month totals".format(p))
         except IOError:
             raise
@@ -431,12 +412,102 @@ class StandardizedPrecipitationIndex:
             raise
         except Exception:
             raise
+        finally:
+            if input_data_set is not None:
+                input_data_set.close()
+            if output_data_set is not None:
+                output_data_set.close()
+
+    def create_chirps_netcdf_files(self, files, workers=1):
+        """
+        This function runs process_chirps_file for a list of TIF files, in parallel worker processes if requested
+            The values are written to the working cube by the current process;
+            the converted files are recorded in the catalog of the working directory
+        Args:
+            files (list of str): the names of the TIF files to process
+            workers (int): optional number of worker processes (default is 1)
+
+        Returns:
+            Dictionary of TIF file name -> error description for the files that failed
+        """
+        with self.__open_cube() as cube:
+            cube.reserve([self.__get_chirps_date(f) for f in files])
+            return self.__fileHandler.process_raw_files(
+                'chirps_tif_regex', files, self.process_chirps_file, self.__get_netcdf_name, workers,
+                lambda f, values: cube.write(self.__get_chirps_date(f), values)
+            )
+
+    def open_raw_file(self, file_name):
+        """
+        This function opens a TIF file of the raw data directory, to share it between the regions of a RegionBatch
+        """
+        return rasterio.open("{}/{}".format(self.__raw_data_dir, file_name))
+
+    def process_raw_file(self, file_name, data_set):
+        """
+        This function computes the values of the current region from an open TIF file (see RegionBatch)
+        """
+        return self.process_chirps_file(file_name, data_set)
+
+    def open_working_cube(self):
+        """
+        This function returns the working cube of the current region (see RegionBatch)
+        """
+        return self.__open_cube()
+
+    def reserve_raw_files(self, cube, files):
+        """
+        This function reserves the months of TIF files in the working cube (see RegionBatch)
+        """
+        cube.reserve([self.__get_chirps_date(f) for f in files])
+
+    def store_raw_result(self, cube, file_name, values):
+        """
+        This function writes the values of a TIF file to the working cube (see RegionBatch)
+        """
+        cube.write(self.__get_chirps_date(file_name), values)
+
+    def record_raw_files(self, files, failures):
+        """
+        This function records the converted TIF files in the catalog of the working directory (see RegionBatch)
+        """
+        try:
+            self.__fileHandler.record_processed_files('chirps_tif_regex', files, failures, self.__get_netcdf_name)
+        finally:
+            self.__fileHandler.save_catalog()
+
+
+def process_regions(args, regions):
+    """
+    This function processes the SPI of several regions, reading each TIF file once for all the regions (see RegionBatch)
+    """
+    mode = str(args.mode)
+    spi = {r: StandardizedPrecipitationIndex(r) for r in regions}
+
+    # determine the files to process per region #
+    files_to_process = {r: spi[r].get_chirps_files_to_process(mode == 'all') for r in regions}
+    file_count = sum(len(f) for f in files_to_process.values())
+    print("Processing {} files for CHIRPS in {} regions.".format(file_count, len(regions)))
+
+    # convert the TIF files once for all the regions #
+    failures = RegionBatch(spi).run(files_to_process, args.workers)
+    parallel.report_failures(failures, file_count, "CHIRPS TIF to NetCDF conversion")
+
+    # create the precip totals and the SPI anomaly file of each region #
+    for r in regions:
+        print("Creating precipitation totals for {}".format(r))
+        spi[r].create_precip_from_chirps()
+        spi[r].create_spi_anomaly_file()
 
 
 def main(args):
     """
     This is the main entry point for the program
     """
+    regions = select_regions(getattr(args, 'regions', None))
+    if regions is not None:
+        process_regions(args, regions)
+        return
     mode = str(args.mode)
     # initialize a new SPI class #
     spi = StandardizedPrecipitationIndex()
@@ -452,8 +523,8 @@ def main(args):
         else:
             print("Processing needed files for CHIRPS.")
     # convert any unprocessed TIF files to NetCDF format #
-    for f in files_to_process:
-        spi.create_chirps_netcdf_file(f)
+    failures = spi.create_chirps_netcdf_files(files_to_process, args.workers)
+    parallel.report_failures(failures, len(files_to_process), "CHIRPS TIF to NetCDF conversion")
 
     # create the 3-month precip totals #
     print("Creating precipitation totals")
@@ -468,5 +539,10 @@ if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument("-m", "--mode", default="updates",
                         help="The mode of the current processing: updates or all. Default is updates")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="Number of worker processes for the TIF file conversions. Default is 1")
+    parser.add_argument("--regions", nargs='*', metavar="NAME",
+                        help="Process the named regions of the regions setting (all the regions if no name is given), "
+                             "reading each TIF file once")
     # execute the programs with the supplied options
     main(parser.parse_args())
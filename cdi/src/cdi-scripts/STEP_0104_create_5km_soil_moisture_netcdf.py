@@ -2,8 +2,11 @@
 import os
 from libs.config_reader import ConfigParser
 from libs.file_operations import FileHandler
+from libs.cube_store import CubeStore
 from libs.subgrid_calculations import NetCDFSubGrid
+from libs.region_batch import RegionBatch, select_regions
 import libs.netcdf_functions as netcdf
+import libs.parallel_operations as parallel
 from argparse import ArgumentParser
 import numpy as np
 import re
@@ -14,13 +17,19 @@ class SoilMoisture:
     """
     This is the core processing class for executing all soil moisture creation operations
     """
-    def __init__(self):
-        self.__config = ConfigParser()
+    def __init__(self, region=None):
+        """
+        Args:
+            region (str): optional name of the region of the regions setting (default is the region of region_name/bounds)
+        """
+        self.__config = ConfigParser(region)
         self.__raw_data_dir = self.__config.get('raw_data_dirs', 'fldas_data').replace("\\", '/')
         self.__working_dir = self.__config.get('scratch_dir').replace("\\", '/') + '/SM'
         self.__output_dir = self.__config.get('output_dir').replace("\\", '/')
         self.__region = self.__config.get('region_name')
         self.__bounds = self.__config.get('bounds')
+        self.__storage = self.__config.get('netcdf_storage')
+        self.__export_files = self.__config.get('export_working_files')
         self.__file_patterns = self.__config.get('file_patterns')
         self.__file_patterns['sm_netcdf_regex'] = "STEP_0104_SM_{}_((?:19|20)\\d\\d)(0[1-9]|1[0-2])\\.nc".format(self.__region)
         self.__fileHandler = FileHandler(
@@ -32,6 +41,7 @@ class SoilMoisture:
         self.__working_file_match = re.compile(r'{}'.format(self.__file_patterns['sm_netcdf_regex']))
         self.__latitudes = self.__config.get('latitudes')
         self.__longitudes = self.__config.get('longitudes')
+        self.__cube_file = os.path.join(self.__working_dir, "STEP_0104_SM_cube_{}.nc".format(self.__region))
         self.__missing = -9999.0
         self.__soil_units = ""
 
@@ -62,6 +72,54 @@ class SoilMoisture:
         time_delta = test_date - origin_date
         return int(time_delta.days)
 
+    def __get_netcdf_name(self, file_name):
+        """
+        This function returns the name of the NetCDF file created in the working directory for a FLDAS file
+        Args:
+            file_name (str): name of the FLDAS file
+
+        Returns:
+            String of the NetCDF file name
+        """
+        return self.__get_working_name(self.__get_fldas_date(file_name))
+
+    def __get_working_name(self, date_string):
+        """
+        This function returns the name of the NetCDF file of a month in the working directory,
+            which also identifies the month in the working cube
+        Args:
+            date_string (str): year/month in 'YYYYMM' format
+
+        Returns:
+            String of the NetCDF file name
+        """
+        return "STEP_0104_SM_{}_{}.nc".format(self.__region, date_string)
+
+    def __open_cube(self):
+        """
+        This function returns the working cube of the soil moisture values (see CubeStore)
+        Returns:
+            CubeStore object, to open with a 'with' statement
+        """
+        variables = {
+            'RootZone_SM': {'standard_name': "soil_moisture_content", 'long_name': "soil moisture content 0cm to 40cm"},
+            'RootZone2_SM': {'standard_name': "soil_moisture_content", 'long_name': "soil moisture content 0cm to 100cm"},
+            'TotalColumn_SM': {'standard_name': "soil_moisture_content", 'long_name': "soil moisture content 0cm to 200cm"}
+        }
+        return CubeStore(self.__cube_file, self.__latitudes, self.__longitudes, variables, self.__storage)
+
+    def __get_working_files(self):
+        """
+        This function finds the soil moisture NetCDF files per month in the working directory (exported, or created by earlier versions)
+        Returns:
+            Dictionary of 'YYYYMM' date -> fully-qualified name
+        """
+        files = {}
+        for f in self.__fileHandler.get_working_file_names('sm_netcdf_regex'):
+            (year, month) = self.__working_file_match.match(f).groups()
+            files[year + month] = '{}/{}'.format(self.__working_dir, f)
+        return files
+
     def get_fldas_files_to_process(self, all_dates=False):
         """
         This function gets the list of FLDAS files to convert to Soil Moisture subsets
@@ -73,21 +131,14 @@ class SoilMoisture:
         """
         files = []
         try:
-            raw_files = self.__fileHandler.get_raw_file_names('fldas_data_regex')
             if all_dates:  # include all FLDAS files
-                files = raw_files
-            else:  # determine which FLDAS files have not been converted to Soil Moisture SubGrids
-                working_files = self.__fileHandler.get_working_file_names('sm_netcdf_regex')
-                # compare the raw files with the processed files #
-                for f in raw_files:
-                    # parse out the year/days from the file name #
-                    (year, month) = self.__raw_file_match.match(f).groups()
-                    file_date = "{}{}".format(year, month)
-                    # prepare the NetCDF filename to test for #
-                    test_file = "STEP_0104_SM_{}_{}.nc".format(self.__region, file_date)
-                    if test_file not in working_files:
-                        # add the file name to the list to process #
-                        files.append(f)
+                files = self.__fileHandler.get_raw_file_names('fldas_data_regex')
+            else:  # determine which FLDAS files are new or changed since they were stored in the working cube
+                with self.__open_cube() as cube:
+                    # load the NetCDF files of earlier runs into the cube #
+                    cube.import_files(self.__get_working_files(), ['RootZone_SM', 'RootZone2_SM', 'TotalColumn_SM'])
+                    stored = set(self.__get_working_name(d) for d in cube.get_dates())
+                files = self.__fileHandler.get_new_or_changed_files('fldas_data_regex', self.__get_netcdf_name, stored)
         except IOError:
             raise
         except Exception:
@@ -95,11 +146,12 @@ class SoilMoisture:
         finally:
             return files
 
-    def __create_soil_moisture_parameters(self, file_path):
+    def __create_soil_moisture_parameters(self, file_path, data_set=None):
         """
         This functions calculates the weighted values for the 2 "root zones" and the total soil moisture column using the 4 data sets in the global FLDAS files
         Args:
             file_path (str): fully qualified path of the FLDAS file
+            data_set (netCDF4 Dataset): optional open FLDAS file, shared with other regions (default is None: open the file)
 
         Returns:
             Three 2D numpy arrays of floats
@@ -107,7 +159,7 @@ class SoilMoisture:
         # initialize parameters #
         try:
             # create the SubGrids of the raw data #
-            with NetCDFSubGrid(self.__bounds, file_path, True) as sg:
+            with NetCDFSubGrid(self.__bounds, file_path, True, data_set=data_set) as sg:
                 soil_00_10 = sg.create_sub_grid('SoilMoi00_10cm_tavg')
                 soil_10_40 = sg.create_sub_grid('SoilMoi10_40cm_tavg')
                 soil_40_100 = sg.create_sub_grid('SoilMoi40_100cm_tavg')
@@ -125,23 +177,52 @@ class SoilMoisture:
         except Exception:
             raise
 
-    def create_soil_moisture_file(self, file_name):
+    def process_soil_moisture_file(self, file_name, data_set=None):
         """
-
+        This function computes the soil moisture parameters of a FLDAS file for the working cube, and creates the NetCDF file
+            of the month if the per-month files are exported (export_working_files setting)
         Args:
-            file_name:
+            file_name (str): the name of the FLDAS file to process
+            data_set (netCDF4 Dataset): optional open FLDAS file, shared with other regions (default is None: open the file)
 
         Returns:
-
+            Dictionary of parameter name -> 2D numpy array of the values, and the units of the values
         """
         raw_file_path = "{}/{}".format(self.__raw_data_dir, file_name)
-        file_date = self.__get_fldas_date(file_name)
-        output_file = os.path.join(self.__working_dir, "STEP_0104_SM_{}_{}.nc".format(self.__region, file_date))
+        root_zone1, root_zone2, total_zone = self.__create_soil_moisture_parameters(raw_file_path, data_set)
+        if self.__export_files:
+            self.create_soil_moisture_file(file_name, root_zone1, root_zone2, total_zone)
+        values = {'RootZone_SM': root_zone1, 'RootZone2_SM': root_zone2, 'TotalColumn_SM': total_zone}
+        return values, self.soil_units
+
+    def __store_soil_moisture(self, cube, file_name, result):
+        """
+        This function writes the soil moisture parameters of a FLDAS file to the working cube
+        Args:
+            cube (CubeStore): the open working cube
+            file_name (str): the name of the FLDAS file
+            result (tuple): the values and units returned by process_soil_moisture_file
+        """
+        values, units = result
+        for name in values.keys():
+            cube.set_attribute(name, 'units', units)
+        cube.write(self.__get_fldas_date(file_name), values)
+
+    def create_soil_moisture_file(self, file_name, root_zone1, root_zone2, total_zone):
+        """
+        This function creates a NetCDF file of the soil moisture parameters of a FLDAS file in the working directory
+        Args:
+            file_name (str): the name of the FLDAS file
+            root_zone1 (numpy array): the 0cm to 40cm soil moisture values of the current region
+            root_zone2 (numpy array): the 0cm to 100cm soil moisture values of the current region
+            total_zone (numpy array): the 0cm to 200cm soil moisture values of the current region
+
+        Returns:
+            None: results are a NetCDF file created in the working directory for the particular year/month
+        """
+        output_file = os.path.join(self.__working_dir, self.__get_netcdf_name(file_name))
         output_data_set = None
         try:
-            # generate soil moisture parameters #
-            root_zone1, root_zone2, total_zone = self.__create_soil_moisture_parameters(raw_file_path)
-
             # create the output file #
             out_properties = {
                 'latitudes': self.__latitudes,
@@ -152,21 +233,21 @@ class SoilMoisture:
             output_data_set = netcdf.initialize_dataset(output_file, out_properties)
 
             # add soil moisture parameters to output data set #
-            root_zone1_var = output_data_set.createVariable('RootZone_SM', 'float32', ('time', 'latitude', 'longitude'))
+            root_zone1_var = netcdf.create_variable(output_data_set, 'RootZone_SM', self.__storage)
             root_zone1_var.units = self.soil_units
             root_zone1_var.missing_value = self.__missing
             root_zone1_var.standard_name = "soil_moisture_content"
             root_zone1_var.long_name = "soil moisture content 0cm to 40cm"
             root_zone1_var[0] = root_zone1
 
-            root_zone2_var = output_data_set.createVariable('RootZone2_SM', 'float32', ('time', 'latitude', 'longitude'))
+            root_zone2_var = netcdf.create_variable(output_data_set, 'RootZone2_SM', self.__storage)
             root_zone2_var.units = self.soil_units
             root_zone2_var.missing_value = self.__missing
             root_zone2_var.standard_name = "soil_moisture_content"
             root_zone2_var.long_name = "soil moisture content 0cm to 100cm"
             root_zone2_var[0] = root_zone2
 
-            total_zone_var = output_data_set.createVariable('TotalColumn_SM', 'float32', ('time', 'latitude', 'longitude'))
+            total_zone_var = netcdf.create_variable(output_data_set, 'TotalColumn_SM', self.__storage)
             total_zone_var.units = self.soil_units
             total_zone_var.missing_value = self.__missing
             total_zone_var.standard_name = "soil_moisture_content"
@@ -180,11 +261,88 @@ class SoilMoisture:
             if output_data_set is not None:
                 output_data_set.close()
 
+    def create_soil_moisture_files(self, files, workers=1):
+        """
+        This function runs process_soil_moisture_file for a list of FLDAS files, in parallel worker processes if requested
+            The values are written to the working cube by the current process;
+            the converted files are recorded in the catalog of the working directory
+        Args:
+            files (list of str): the names of the FLDAS files to process
+            workers (int): optional number of worker processes (default is 1)
+
+        Returns:
+            Dictionary of FLDAS file name -> error description for the files that failed
+        """
+        with self.__open_cube() as cube:
+            cube.reserve([self.__get_fldas_date(f) for f in files])
+            return self.__fileHandler.process_raw_files(
+                'fldas_data_regex', files, self.process_soil_moisture_file, self.__get_netcdf_name, workers,
+                lambda f, result: self.__store_soil_moisture(cube, f, result)
+            )
+
+    def open_raw_file(self, file_name):
+        """
+        This function opens a FLDAS file of the raw data directory, to share it between the regions of a RegionBatch
+        """
+        return netcdf.open_dataset("{}/{}".format(self.__raw_data_dir, file_name))
+
+    def process_raw_file(self, file_name, data_set):
+        """
+        This function computes the values of the current region from an open FLDAS file (see RegionBatch)
+        """
+        return self.process_soil_moisture_file(file_name, data_set)
+
+    def open_working_cube(self):
+        """
+        This function returns the working cube of the current region (see RegionBatch)
+        """
+        return self.__open_cube()
+
+    def reserve_raw_files(self, cube, files):
+        """
+        This function reserves the months of FLDAS files in the working cube (see RegionBatch)
+        """
+        cube.reserve([self.__get_fldas_date(f) for f in files])
+
+    def store_raw_result(self, cube, file_name, values):
+        """
+        This function writes the values of a FLDAS file to the working cube (see RegionBatch)
+        """
+        self.__store_soil_moisture(cube, file_name, values)
+
+    def record_raw_files(self, files, failures):
+        """
+        This function records the converted FLDAS files in the catalog of the working directory (see RegionBatch)
+        """
+        try:
+            self.__fileHandler.record_processed_files('fldas_data_regex', files, failures, self.__get_netcdf_name)
+        finally:
+            self.__fileHandler.save_catalog()
+
+
+def process_regions(args, regions):
+    """
+    This function processes the soil moisture of several regions, reading each FLDAS file once for all the regions (see RegionBatch)
+    """
+    mode = str(args.mode)
+    soil_moisture = {r: SoilMoisture(r) for r in regions}
+    # determine the files to process per region #
+    files_to_process = {r: soil_moisture[r].get_fldas_files_to_process(mode == 'all') for r in regions}
+    file_count = sum(len(f) for f in files_to_process.values())
+    print("Processing {} months for 5km Soil Moisture in {} regions.".format(file_count, len(regions)))
+    # convert the FLDAS files once for all the regions #
+    failures = RegionBatch(soil_moisture).run(files_to_process, args.workers)
+    parallel.report_failures(failures, file_count, "FLDAS to Soil Moisture conversion")
+
 
 def main(args):
     """
     This is the main entry point for the program
     """
+    regions = select_regions(getattr(args, 'regions', None))
+    if regions is not None:
+        process_regions(args, regions)
+        return
     mode = str(args.mode)
     # initialize a new soil moisture class #
     soil_moisture = SoilMoisture()
@@ -200,8 +358,8 @@ def main(args):
         else:
             print("Processing needed months for 5km Soil Moisture.")
     # create any SubGrids required for processing #
-    for f in files_to_process:
-        soil_moisture.create_soil_moisture_file(f)
+    failures = soil_moisture.create_soil_moisture_files(files_to_process, args.workers)
+    parallel.report_failures(failures, len(files_to_process), "FLDAS to Soil Moisture conversion")
 
 
 if __name__ == '__main__':
@@ -209,5 +367,10 @@ if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument("-m", "--mode", default="updates",
                         help="The mode of the current processing: updates or all. Default is updates")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="Number of worker processes for the FLDAS file conversions. Default is 1")
+    parser.add_argument("--regions", nargs='*', metavar="NAME",
+                        help="Process the named regions of the regions setting (all the regions if no name is given), "
+                             "reading each FLDAS file once")
     # execute the programs with the supplied options
     main(parser.parse_args())
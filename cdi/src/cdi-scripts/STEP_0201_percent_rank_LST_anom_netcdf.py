@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
 import os
 from libs.config_reader import ConfigParser
-from libs.statistics_operations import StatisticOperations
 import libs.netcdf_functions as netcdf
+import libs.parallel_operations as parallel
+from libs.ranking_operations import MonthlyRanking
+from argparse import ArgumentParser
 # import numpy as np
 
 
@@ -12,10 +14,10 @@ class LandSurfaceTempRanking:
     """
     def __init__(self):
         self.__config = ConfigParser()
-        self.__stats = StatisticOperations()
         self.__output_dir = self.__config.get('output_dir').replace("\\", '/')
         self.__region = self.__config.get('region_name')
         self.__bounds = self.__config.get('bounds')
+        self.__storage = self.__config.get('netcdf_storage')
         self.__input_file = os.path.join(self.__output_dir, "STEP_0101_LST_anomaly_{}.nc".format(self.__region))
         self.__input_data_set = netcdf.open_dataset(self.__input_file)
         self.__latitudes = self.__config.get('latitudes')
@@ -40,7 +42,7 @@ class LandSurfaceTempRanking:
             output_data_set = netcdf.initialize_dataset(self.__output_file, out_properties)
 
             # variables #
-            lst_rank = output_data_set.createVariable('lst_anom_pct_rank', 'float32', ('time', 'latitude', 'longitude'))
+            lst_rank = netcdf.create_variable(output_data_set, 'lst_anom_pct_rank', self.__storage)
             lst_rank.units = '1'
             lst_rank.missing_value = self.__missing
             lst_rank.standard_name = "lst_anomaly_pct_rank"
@@ -53,48 +55,37 @@ class LandSurfaceTempRanking:
             if output_data_set is not None:
                 output_data_set.close()
 
-    def rank_parameter(self, index):
-        output_data_set = None
-        try:
-            # determine the number of years for the month #
-            years = int(self.__number_of_months / 12)
-            if index < (self.__number_of_months % 12):
-                years += 1
-            # load the data for the current month #
-            data = []
-            t = index  # set the input time to the starting index
-            for y in range(0, years):
-                data.append(netcdf.extract_data(self.__input_data_set, 'lst_anom', t))
-                t += 12  # increment by 1 year
-            # rank the data by year #
-            ranked_data = self.__stats.rank_parameter(data)
-            # open file for appending #
-            output_data_set = netcdf.open_dataset(self.__output_file, 'a')
-            # loop thru the years and set the data to the correct time index #
-            t = index
-            for y in range(0, len(ranked_data)):
-                output_data_set.variables['lst_anom_pct_rank'][t] = ranked_data[y]
-                t += 12
-        except IOError:
-            raise
-        except Exception:
-            raise
-        finally:
-            if output_data_set is not None:
-                output_data_set.close()
+    def rank_parameter(self, workers=1):
+        """
+        This function ranks the LST anomaly values of each month over the years and writes the ranks to the output file
+            Each month is read and written as a single strided slab (see MonthlyRanking)
+        Args:
+            workers (int): optional number of worker processes to rank the months (default is 1)
+
+        Returns:
+            dictionary of (variable, month index) -> error description for the months that failed
+        """
+        ranking = MonthlyRanking(self.__input_file, self.__output_file, {'lst_anom': 'lst_anom_pct_rank'}, self.__number_of_months)
+        return ranking.run(workers)
 
 
-def main():
+def main(args=None):
     """
     This is the main entry point for the program
     """
+    workers = args.workers if args is not None else 1
     # initialize a new LST Ranking class #
     rankings = LandSurfaceTempRanking()
     # loop thru the months and rank the LST anomalies #
     print("Ranking LST anomaly data...")
-    for index in range(0, 12):
-        rankings.rank_parameter(index)
+    failures = rankings.rank_parameter(workers)
+    parallel.report_failures(failures, None, "LST anomaly ranking", 'months')
 
 
 if __name__ == '__main__':
-    main()
+    # set up the command line argument parser
+    parser = ArgumentParser()
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="Number of worker processes to rank the months. Default is 1")
+    # execute the program with the supplied options
+    main(parser.parse_args())
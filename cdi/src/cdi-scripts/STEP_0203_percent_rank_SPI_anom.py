@@ -1,9 +1,10 @@
 # -*- coding: utf-8 -*-
 import os
 from libs.config_reader import ConfigParser
-from libs.statistics_operations import StatisticOperations
 import libs.netcdf_functions as netcdf
-import numpy as np
+import libs.parallel_operations as parallel
+from libs.ranking_operations import MonthlyRanking
+from argparse import ArgumentParser
 
 
 class StandardizedPrecipitationIndexRanking:
@@ -12,11 +13,11 @@ class StandardizedPrecipitationIndexRanking:
     """
     def __init__(self):
         self.__config = ConfigParser()
-        self.__stats = StatisticOperations()
         self.__spi_periods = sorted(self.__config.get('spi_periods'))
         self.__output_dir = self.__config.get('output_dir').replace("\\", '/')
         self.__region = self.__config.get('region_name')
         self.__bounds = self.__config.get('bounds')
+        self.__storage = self.__config.get('netcdf_storage')
         self.__input_file = os.path.join(self.__output_dir, "STEP_0103_SPI_anomaly_{}.nc".format(self.__region))
         self.__input_data_set = netcdf.open_dataset(self.__input_file)
         self.__latitudes = self.__config.get('latitudes')
@@ -24,9 +25,6 @@ class StandardizedPrecipitationIndexRanking:
         self.__times = self.__input_data_set.variables['time'][:]
         self.__number_of_months = len(self.__times)
         self.__missing = -9999.0
-        self.__rows = len(self.__latitudes)
-        self.__columns = len(self.__longitudes)
-        self.__empty_set = np.full((self.__rows, self.__columns), self.__missing)
         # initialize the output file and prepare internal value lists #
         self.__initialize_ranking_file()
 
@@ -50,7 +48,7 @@ class StandardizedPrecipitationIndexRanking:
 
             # variables #
             for p in self.__spi_periods:
-                lst_rank = output_data_set.createVariable('spi_{}_anom_pct_rank'.format(p), 'float32', ('time', 'latitude', 'longitude'))
+                lst_rank = netcdf.create_variable(output_data_set, 'spi_{}_anom_pct_rank'.format(p), self.__storage)
                 lst_rank.units = '1'
                 lst_rank.missing_value = self.__missing
                 lst_rank.standard_name = "spi_{}_anom_pct_rank".format(p)
@@ -63,76 +61,44 @@ class StandardizedPrecipitationIndexRanking:
             if output_data_set is not None:
                 output_data_set.close()
 
-    def __rank_parameter(self, period, index):
+    def rank_spi_parameters(self, workers=1):
         """
-        This function executes the statistical ranking for a particular parameter and month from the SPI values.
-            The data is written to the out NetCDF file
+        This function executes the statistical ranking of all 12 months for all SPI periods
+            Each month is read and written as a single strided slab (see MonthlyRanking); the years where all SPI values
+            of the month are missing (the first months of the longer periods) are left out of the ranking and set to missing
         Args:
-            period (int): the value of the monthly total period of precipitation used (e.g. 9-month totals to represent a month)
-            index (int): the 0-11 index value of the month to rank
+            workers (int): optional number of worker processes to rank the months of the periods (default is 1)
 
         Returns:
-            None: data is directly written to the output file
+            dictionary of (variable, month index) -> error description for the months that failed
         """
-        output_data_set = None
-        try:
-            # open file for appending #
-            output_data_set = netcdf.open_dataset(self.__output_file, 'a')
-            # determine the number of years for the month #
-            years = int(self.__number_of_months / 12)
-            if index < (self.__number_of_months % 12):
-                years += 1
-            # load the data for the current month #
-            data = []
-            t = index  # set the input time to the starting index
-            valid_index = index
-            for y in range(0, years):
-                values = netcdf.extract_data(self.__input_data_set, 'spi_{}_anom'.format(period), t)
-                if np.amax(values) > self.__missing:  # append the data for ranking
-                    data.append(values)
-                else:  # set the output data to missing, and skip to the next year
-                    output_data_set.variables['spi_{}_anom_pct_rank'.format(period)][t] = self.__empty_set
-                    valid_index += 12
-                t += 12  # increment by 1 year
-            # rank the data by year #
-            ranked_data = self.__stats.rank_parameter(data)
-            # loop thru the years and set the data to the correct time index #
-            t = valid_index
-            for y in range(0, len(ranked_data)):
-                output_data_set.variables['spi_{}_anom_pct_rank'.format(period)][t] = ranked_data[y]
-                t += 12
-        except IOError:
-            raise
-        except Exception:
-            raise
-        finally:
-            if output_data_set is not None:
-                output_data_set.close()
-
-    def rank_spi_parameters(self):
-        """
-        This function serves as a wrapper to execute the ranking for all 12 months
-        Returns:
-            None
-        """
-        # loop thru the parameters in the SPI anomaly file #
+        variables = {'spi_{}_anom'.format(p): 'spi_{}_anom_pct_rank'.format(p) for p in self.__spi_periods}
+        ranking = MonthlyRanking(self.__input_file, self.__output_file, variables, self.__number_of_months,
+                                 skip_missing_years=True)
+        failures = ranking.run(workers)
         for p in self.__spi_periods:
-            # rank each month series #
-            for index in range(0, 12):
-                self.__rank_parameter(p, index)
-            print("-- SPI anomalies ranked for {}-month totals".format(p))
+            if not any(v == 'spi_{}_anom'.format(p) for v, index in failures.keys()):
+                print("-- SPI anomalies ranked for {}-month totals".format(p))
+        return failures
 
 
-def main():
+def main(args=None):
     """
     This is the main entry point for the program
     """
+    workers = args.workers if args is not None else 1
     # initialize a new soil moisture class #
     rankings = StandardizedPrecipitationIndexRanking()
     # loop thru the months and rank the SPI anomalies #
     print("Ranking SPI anomaly data...")
-    rankings.rank_spi_parameters()
+    failures = rankings.rank_spi_parameters(workers)
+    parallel.report_failures(failures, None, "SPI anomaly ranking", 'months')
 
 
 if __name__ == '__main__':
-    main()
+    # set up the command line argument parser
+    parser = ArgumentParser()
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="Number of worker processes to rank the months of the SPI periods. Default is 1")
+    # execute the program with the supplied options
+    main(parser.parse_args())
@@ -2,9 +2,9 @@
 import os
 import sys
 from libs.config_reader import ConfigParser
+import libs.cube_cache as cube_cache
 import libs.netcdf_functions as netcdf
 import numpy as np
-import numpy.ma as ma
 
 
 class CompositeDroughtIndicator:
@@ -16,6 +16,7 @@ class CompositeDroughtIndicator:
         self.__output_dir = self.__config.get('output_dir').replace("\\", '/')
         self.__region = self.__config.get('region_name')
         self.__bounds = self.__config.get('bounds')
+        self.__storage = self.__config.get('netcdf_storage')
         self.__cdi_weights = self.__config.get('cdi_parameters', 'weights')
         self.__parameter_names = self.__config.get('cdi_parameters', 'names')
         self.__ranking_files = {
@@ -28,13 +29,11 @@ class CompositeDroughtIndicator:
         self.__datasets = {}
         self.__common_times = []
         self.__times = {}
-        self.__last_time_index = 0
         self.__latitudes = self.__config.get('latitudes')
         self.__longitudes = self.__config.get('longitudes')
         self.__missing = -9999.0
         self.__rows = len(self.__latitudes)
         self.__columns = len(self.__longitudes)
-        self.__empty_set = np.full((self.__rows, self.__columns), self.__missing)
         self.__check_weight_totals()
         self.__get_data_sets()
 
@@ -79,30 +78,47 @@ class CompositeDroughtIndicator:
         except Exception:
             raise
 
-    def __get_time_range(self, source):
+    def __get_time_indices(self, source):
         """
         This function gets the indices from an input time dimension where the NetCDF dates match the common dates between all inputs
+            The indices are found with a binary search, so the common dates do not need to be consecutive in the input
         Args:
             source (str): the name of the input parameter
 
         Returns:
-            list of indices matching the common dates to use
+            numpy array of the indices matching the common dates to use
         """
         try:
-            start_idx = 0
-            end_idx = 0
-            date_list = self.__times[source]
-            for d, date in enumerate(date_list):
-                if date == self.__common_times[0]:
-                    start_idx = d
-                elif date == self.__common_times[self.__last_time_index]:
-                    end_idx = d + 1
-            return range(start_idx, end_idx)
+            order = np.argsort(self.__times[source], kind='stable')
+            positions = np.searchsorted(self.__times[source], self.__common_times, sorter=order)
+            return order[positions]
         except ValueError:
             raise
         except Exception:
             raise
 
+    def __read_time_steps(self, source, indices):
+        """
+        This function reads the values of an input for a list of time indices
+            Consecutive indices are read as a single slab, other indices from the slab that spans them
+            The values are taken from the cube cache if the ranking file was written earlier in this process (fused mode)
+        Args:
+            source (str): the name of the input parameter
+            indices (numpy array): increasing time indices of the input
+
+        Returns:
+            3D numpy float32 array of the values, with NaN for the missing values
+        """
+        cached_values = cube_cache.get(self.__ranking_files[source], self.__parameter_names[source])
+        if cached_values is not None:
+            return netcdf.missing_to_nan(cached_values[indices], self.__missing)
+        first = int(indices[0])
+        last = int(indices[-1]) + 1
+        values = netcdf.missing_to_nan(self.__datasets[source].variables[self.__parameter_names[source]][first:last], self.__missing)
+        if last - first == len(indices):
+            return values
+        return values[indices - first]
+
     def get_common_dates(self):
         """
         This function compares the dates of all the CDI inputs to determine what dates all inputs have in common
@@ -110,25 +126,27 @@ class CompositeDroughtIndicator:
             None: values are directly stored to the class
         """
         try:
-            sets = []
             # load the time arrays from the ranking files #
             for param in self.__cdi_inputs:
                 self.__times[param] = netcdf.extract_data(self.__datasets[param], 'time', -1)
-                sets.append(set(self.__times[param]))
             # find the common dates between the four lists #
-            intersections = set.intersection(*sets)
-            date_list = list(intersections)
-            self.__common_times = sorted(date_list)
-            self.__last_time_index = len(self.__common_times) - 1
+            common_times = self.__times[self.__cdi_inputs[0]]
+            for param in self.__cdi_inputs[1:]:
+                common_times = np.intersect1d(common_times, self.__times[param])
+            self.__common_times = np.unique(common_times)
         except IOError:
             raise
         except Exception:
             raise
 
-    def compute_sum(self):
+    def compute_sum(self, memory_mb=512):
         """
         This function creates the weighted sum for each date of the CDI
-            If any input data array is completely empty for a given data, the sum is set to empty data for that date
+            If any input data array has no valid values above 0.0 for a given date, the sum is set to empty data for that date
+            The sums are computed for blocks of dates at once, sized to keep the input values of a block within a memory budget
+        Args:
+            memory_mb (int): optional memory budget for the values of a block of dates, in MB (default is 512)
+
         Returns:
             None: data is written directly to the output NetCDF file
         """
@@ -145,42 +163,48 @@ class CompositeDroughtIndicator:
             }
             output_data_set = netcdf.initialize_dataset(output_file, out_properties)
             # variables #
-            cdi_sum = output_data_set.createVariable('cdi_weighted_sum', 'float32', ('time', 'latitude', 'longitude'))
+            cdi_sum = netcdf.create_variable(output_data_set, 'cdi_weighted_sum', self.__storage)
             cdi_sum.units = '1'
             cdi_sum.missing_value = self.__missing
             cdi_sum.standard_name = "cdi_weighted_sum"
             cdi_sum.long_name = "Weighted Composite Drought Indicator"
 
-            # determine the data ranges for each parameter #
-            data_ranges = {}
+            # determine the time indices of the common dates for each parameter #
+            time_indices = {}
             for param in self.__cdi_inputs:
-                data_ranges[param] = self.__get_time_range(param)
+                time_indices[param] = self.__get_time_indices(param)
+
+            # size the blocks of dates: one float32 input block, its weighted values and the sum #
+            date_bytes = self.__rows * self.__columns * (4 + 8 + 8)
+            block_size = max(1, int(memory_mb * 1024 * 1024 / date_bytes))
+
+            # keep all sums for the cube cache in the fused mode #
+            cube = np.empty((len(self.__common_times), self.__rows, self.__columns), dtype=np.float32) if cube_cache.is_enabled() else None
 
             # load the data from each source using the common dates #
             print("Processing CDI values...")
-            for t in range(0, len(self.__common_times)):
-                cdi_weight_sum = None
-                valid_data = True
+            for first in range(0, len(self.__common_times), block_size):
+                last = min(first + block_size, len(self.__common_times))
+                # the sum is missing (NaN) where any of the inputs is missing; it is accumulated in float64, #
+                # so equal sums stay equal for the ranking of step 0302 #
+                cdi_weight_sum = np.zeros((last - first, self.__rows, self.__columns))
+                empty_dates = np.zeros(last - first, dtype=bool)
                 for param in self.__cdi_inputs:
                     # get the applicable data #
-                    data = ma.masked_equal(netcdf.extract_data(self.__datasets[param], self.__parameter_names[param],
-                                                               data_ranges[param][t]), self.__missing)
-                    # verify we have data to add to the sum #
-                    if np.amax(data) < 0.0:
-                        valid_data = False
-                    else:
-                        # weight the data #
-                        weighted_data = data * self.__cdi_weights[param]
-                        # update the weighted sum #
-                        if cdi_weight_sum is None:
-                            cdi_weight_sum = weighted_data
-                        else:
-                            cdi_weight_sum += weighted_data
-                # add the weighted sum to the NetCDF file #
-                if valid_data:
-                    cdi_sum[t] = cdi_weight_sum.filled(self.__missing)
-                else:
-                    cdi_sum[t] = self.__empty_set
+                    data = self.__read_time_steps(param, time_indices[param][first:last])
+                    # verify we have data to add to the sum: dates where all valid values are below 0.0 are empty #
+                    highest_values = np.fmax.reduce(data, axis=(1, 2))
+                    empty_dates |= highest_values < 0.0
+                    # weight the data and update the weighted sum #
+                    cdi_weight_sum += data * np.float64(self.__cdi_weights[param])
+                    del data
+                # add the weighted sums to the NetCDF file #
+                cdi_weight_sum[empty_dates] = np.nan
+                cdi_weight_sum = netcdf.nan_to_missing(cdi_weight_sum, self.__missing)
+                cdi_sum[first:last] = cdi_weight_sum
+                if cube is not None:
+                    cube[first:last] = cdi_weight_sum
+            cube_cache.put(output_file, 'cdi_weighted_sum', cube, self.__missing)
         except ValueError:
             raise
         except IOError:
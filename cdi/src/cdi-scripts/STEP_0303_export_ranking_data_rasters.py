@@ -2,12 +2,44 @@
 import os
 from libs.config_reader import ConfigParser
 from libs.file_operations import FileHandler
+import libs.cube_cache as cube_cache
 import libs.netcdf_functions as netcdf
+import libs.parallel_operations as parallel
+import libs.telemetry as telemetry
 from argparse import ArgumentParser
+import numpy as np
 import rasterio
 from rasterio.transform import Affine
 from datetime import date, timedelta
 
+# GeoTIFF export profiles: plain (untiled, uncompressed) or Cloud-Optimized GeoTIFF (tiled, compressed, with overviews) #
+GEOTIFF_PROFILES = ['plain', 'cog']
+
+
+def get_geotiff_options(export=None):
+    """
+    This function returns the driver and creation options of a GeoTIFF export profile
+    Args:
+        export (dictionary): optional export settings: profile, compress, blocksize (default is the plain profile)
+
+    Returns:
+        dictionary of keyword arguments for rasterio.open
+    """
+    profile = 'plain' if export is None else export.get('profile', 'plain')
+    if profile not in GEOTIFF_PROFILES:
+        raise ValueError("Unknown GeoTIFF export profile: {} (expected one of {})".format(profile, ', '.join(GEOTIFF_PROFILES)))
+    if profile == 'plain':
+        return {'driver': 'GTiff'}
+    # the missing values are not flagged as nodata, so the overviews use the nearest value instead of averaging them in #
+    return {
+        'driver': 'COG',
+        'compress': str(export.get('compress', 'deflate')).upper(),
+        'predictor': 'YES',
+        'blocksize': int(export.get('blocksize', 256)),
+        'overviews': 'AUTO',
+        'overview_resampling': 'NEAREST'
+    }
+
 
 class NetCDFtoTIFF:
     """
@@ -19,6 +51,8 @@ class NetCDFtoTIFF:
         self.__config = ConfigParser()
         self.__mode = mode
         self.__cdi_weights = self.__config.get('cdi_parameters', 'weights')
+        self.__options = get_geotiff_options(self.__config.get('geotiff_export'))
+        self.__file_times = {}
 
     def __enter__(self):
         if self.__parameter == 'cdi' or self.__cdi_weights[self.__parameter] > 0:
@@ -46,18 +80,20 @@ class NetCDFtoTIFF:
             self.__get_data()
             # get the transformation #
             self.__get_transformation()
-            # export the image(s) #
-            self.__export_geotiffs()
+            # name the image(s) to export #
+            self.__get_file_names()
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.__times = None
         self.__data = None
+        self.__file_times = {}
 
     def __get_data(self):
         """
         This function loads the applicable time(s) and data array(s) from the appropriate NetCDF file
             containing the CDI input or ranked sum
+            The data is taken from the cube cache if the file was written earlier in this process (fused mode)
         Returns:
             None: results are stored directly in the class instance
         """
@@ -78,9 +114,13 @@ class NetCDFtoTIFF:
             source = input_files[self.__parameter]
             source_parameter = input_parameters[self.__parameter]
             input_data_set = netcdf.open_dataset(source)
+            cached_data = cube_cache.get(source, source_parameter)
             if self.__mode == 'all':
                 self.__times = input_data_set.variables['time'][:]
-                self.__data = netcdf.extract_data(input_data_set, source_parameter, -1)
+                if cached_data is not None:
+                    self.__data = cached_data
+                else:
+                    self.__data = self.__read_values(input_data_set, source_parameter, -1)
             else:
                 all_times = input_data_set.variables['time'][:]
                 last = len(all_times) - 1
@@ -94,7 +134,10 @@ class NetCDFtoTIFF:
                     self.cdi_date = all_times[last]
                 # extract the data for the last CDI month #
                 self.__times = [all_times[last]]
-                self.__data = [netcdf.extract_data(input_data_set, source_parameter, last)]
+                if cached_data is not None:
+                    self.__data = [cached_data[last]]
+                else:
+                    self.__data = [self.__read_values(input_data_set, source_parameter, last)]
 
         except IOError:
             raise
@@ -104,6 +147,21 @@ class NetCDFtoTIFF:
             if input_data_set is not None:
                 input_data_set.close()
 
+    def __read_values(self, data_set, parameter, time):
+        """
+        This function reads the float32 values of the images from a NetCDF file, keeping the missing value of the file
+        Args:
+            data_set (NetCDF4): class object of the open NetCDF file
+            parameter (str): name of the parameter
+            time (int): index of the time array, or -1 for all times
+
+        Returns:
+            2D/3D numpy float32 array of the values
+        """
+        values = netcdf.extract_values(data_set, parameter, time)
+        values[np.isnan(values)] = self.__missing
+        return values
+
     def __get_transformation(self):
         res = 0.05
         try:
@@ -127,39 +185,55 @@ class NetCDFtoTIFF:
         data_date = origin_date + timedelta(days=time)
         return data_date.strftime('%Y%m')
 
-    def __export_geotiffs(self):
+    def __get_file_names(self):
+        """
+        This function names the GeoTiff image of each date requested
+        Returns:
+            None: the file names and their time indices are stored directly in the class instance
+        """
+        for t, time in enumerate(self.__times):
+            date_str = self.create_date_string(int(time))
+            filename = os.path.join(self.__working_dir, "STEP_0303_{}_pct_rank_{}_{}.tif".format(self.__parameter.upper(), self.__region, date_str))
+            self.__file_times[filename] = t
+
+    def get_file_names(self):
+        """
+        This function returns the names of the GeoTiff images to export
+        Returns:
+            List of fully-qualified paths/names of the images, empty if the parameter is not used in the CDI
+        """
+        return list(self.__file_times.keys())
+
+    @telemetry.timed('export_geotiff')
+    def export_geotiff(self, filename):
         """
-        This function takes the loaded NetCDF data and generates a GeoTiff image for each date requested
+        This function generates the GeoTiff image of a date from the loaded NetCDF data
+            Images can be exported concurrently from worker threads: each export opens and closes its own file
+        Args:
+            filename (str): fully-qualified path/name of the image, as returned by get_file_names
+
         Returns:
             None
         """
-        output = None
         try:
-            # loop thru times and generate a GeoTiff for each date #
-            for t, time in enumerate(self.__times):
-                date_str = self.create_date_string(int(time))
-                filename = os.path.join(self.__working_dir, "STEP_0303_{}_pct_rank_{}_{}.tif".format(self.__parameter.upper(), self.__region, date_str))
-                # create new GeoTiff #
-                output = rasterio.open(
-                    filename,
-                    'w',
-                    driver='GTiff',
-                    width=self.__cols,
-                    height=self.__rows,
-                    count=1,
-                    dtype=rasterio.float32,
-                    crs=self.__projection,
-                    transform=self.__transform
-                )
-                # write the data to the image #
-                output.write(self.__data[t].astype(rasterio.float32), 1)
+            # create new GeoTiff and write the data to the image #
+            telemetry.count_file()
+            with rasterio.open(
+                filename,
+                'w',
+                width=self.__cols,
+                height=self.__rows,
+                count=1,
+                dtype=rasterio.float32,
+                crs=self.__projection,
+                transform=self.__transform,
+                **self.__options
+            ) as output:
+                output.write(self.__data[self.__file_times[filename]], 1)
         except IOError:
             raise
         except Exception:
             raise
-        finally:
-            if output is not None:
-                output.close()
 
 
 def main(args):
@@ -167,14 +241,22 @@ def main(args):
     This is the main entry point for the program
     """
     mode = str(args.mode)
+    workers = getattr(args, 'workers', 1)
     # set the list of parameters to convert: cdi must be first #
     parameters = ["cdi", "lst", "ndvi", "spi", "sm"]
     cdi_date = None
+    failures = {}
+    total = 0
     for p in parameters:
-        # initialize a new TIFF export class #
+        # initialize a new TIFF export class: the data of one parameter is loaded at a time #
         with NetCDFtoTIFF(p, mode, cdi_date) as tif_exporter:
             if cdi_date is None:
                 cdi_date = tif_exporter.cdi_date
+            # export the images of all dates of the parameter #
+            files = tif_exporter.get_file_names()
+            total += len(files)
+            failures.update(parallel.run_tasks(tif_exporter.export_geotiff, files, workers, use_threads=True))
+    parallel.report_failures(failures, total, "GeoTIFF export")
 
 
 if __name__ == '__main__':
@@ -182,5 +264,7 @@ if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument("-m", "--mode", default="updates",
                         help="The times to export: latest or all. Default is updates")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="Number of worker threads to write the GeoTIFF files. Default is 1")
     # execute the program with the supplied option
     main(parser.parse_args())
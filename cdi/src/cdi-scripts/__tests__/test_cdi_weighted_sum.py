@@ -0,0 +1,88 @@
+import os
+import numpy as np
+import numpy.ma as ma
+import pytest
+import libs.netcdf_functions as netcdf
+from benchmarks import synthetic_inputs as synthetic
+from libs.config_reader import ConfigParser, REGION_VARIABLE
+from libs.cube_store import get_calendar_value
+from STEP_0301_CDI_weighted_sum import CompositeDroughtIndicator
+
+BOUNDS = {'n_lat': -25.675, 's_lat': -25.875, 'w_lon': 30.675, 'e_lon': 30.975}
+# the ranking files of the inputs: parameter -> (file prefix, months of the file) #
+INPUTS = {
+    'lst': ("STEP_0201_LST_anomaly_pct_rank", list(range(0, 30))),
+    'ndvi': ("STEP_0202_NDVI_anomaly_pct_rank", [m for m in range(0, 30) if m not in [5, 17]]),
+    'spi': ("STEP_0203_SPI_anomaly_pct_rank", list(range(2, 32)))
+}
+# months with all valid LST ranks below 0, and with all NDVI ranks missing #
+NEGATIVE_MONTH = 9
+MISSING_MONTH = 21
+
+
+def get_date(month):
+    return '{}{:02d}'.format(2001 + month // 12, month % 12 + 1)
+
+
+@pytest.fixture
+def inputs(tmp_path, monkeypatch):
+    monkeypatch.setenv('CDI_CONFIG_DIR', synthetic.write_settings(str(tmp_path), BOUNDS))
+    monkeypatch.delenv(REGION_VARIABLE, raising=False)
+    config = ConfigParser()
+    generator = np.random.default_rng(0)
+    values = {}
+    for param, (prefix, months) in INPUTS.items():
+        data = np.round(generator.uniform(0.0, 1.0, (len(months), len(config.get('latitudes')), len(config.get('longitudes')))), 3)
+        data[generator.random(data.shape) < 0.1] = -9999.0
+        if param == 'lst':
+            data[months.index(NEGATIVE_MONTH)] = np.where(data[months.index(NEGATIVE_MONTH)] < 0.0, -9999.0, -0.5)
+        if param == 'ndvi':
+            data[months.index(MISSING_MONTH)] = -9999.0
+        properties = {
+            'latitudes': config.get('latitudes'),
+            'longitudes': config.get('longitudes'),
+            'times': [get_calendar_value(get_date(m)) for m in months],
+            'time_units': 'days since 1900-01-01 00:00:00.0 UTC'
+        }
+        file_path = os.path.join(config.get('output_dir'), "{}_{}.nc".format(prefix, config.get('region_name')))
+        data_set = netcdf.initialize_dataset(file_path, properties)
+        variable = netcdf.create_variable(data_set, config.get('cdi_parameters', 'names')[param])
+        variable.missing_value = -9999.0
+        variable[:] = data
+        data_set.close()
+        values[param] = {m: data[i].astype(np.float32) for i, m in enumerate(months)}
+    return config, values
+
+
+def reference_sum(config, values, month):
+    """
+    The weighted sum of a date as computed one date at a time with masked arrays
+    """
+    weights = config.get('cdi_parameters', 'weights')
+    total = None
+    for param in INPUTS.keys():
+        data = ma.masked_equal(values[param][month].astype(float), -9999.0)
+        if np.amax(data) < 0.0:
+            return np.full(data.shape, -9999.0, dtype=np.float32)
+        total = data * weights[param] if total is None else total + data * weights[param]
+    return total.filled(-9999.0).astype(np.float32)
+
+
+@pytest.mark.parametrize("memory_mb", [512, 0.003])
+def test_weighted_sum_matches_dates(inputs, memory_mb):
+    config, values = inputs
+    cdi = CompositeDroughtIndicator()
+    cdi.get_common_dates()
+    cdi.compute_sum(memory_mb)
+
+    data_set = netcdf.open_dataset(os.path.join(config.get('output_dir'), "STEP_0301_CDI_weighted_sum_Synthetic.nc"))
+    times = netcdf.extract_data(data_set, 'time', -1)
+    sums = netcdf.missing_to_nan(netcdf.extract_values(data_set, 'cdi_weighted_sum', -1))
+    data_set.close()
+    # the common dates skip the months missing from the NDVI ranks #
+    months = [m for m in range(2, 30) if m not in [5, 17]]
+    assert np.array_equal(times, [get_calendar_value(get_date(m)) for m in months])
+    for t, m in enumerate(months):
+        assert np.array_equal(sums[t], netcdf.missing_to_nan(reference_sum(config, values, m)), equal_nan=True)
+    assert np.all(np.isnan(sums[months.index(NEGATIVE_MONTH)]))
+    assert np.all(np.isnan(sums[months.index(MISSING_MONTH)]))
@@ -0,0 +1,85 @@
+import json
+import os
+import shutil
+import numpy as np
+import pytest
+from libs.config_reader import ConfigParser, SETTINGS_FILES, REGION_VARIABLE
+
+BASE_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def config_dir(tmp_path, monkeypatch):
+    for f in SETTINGS_FILES:
+        shutil.copy(os.path.join(BASE_PATH, f), str(tmp_path / f))
+    monkeypatch.setenv('CDI_CONFIG_DIR', str(tmp_path))
+    return tmp_path
+
+
+def test_coordinates_are_read_only_arrays(config_dir):
+    config = ConfigParser()
+    latitudes = config.get('latitudes')
+    longitudes = config.get('longitudes')
+
+    assert latitudes[0] == -25.675 and latitudes[-1] == -27.825 and len(latitudes) == 44
+    assert longitudes[0] == 30.675 and longitudes[-1] == 32.825 and len(longitudes) == 44
+    with pytest.raises(ValueError):
+        latitudes[0] = 0.0
+    assert ConfigParser().get('latitudes') is latitudes
+
+
+def test_items_are_copies(config_dir):
+    patterns = ConfigParser().get('file_patterns')
+    patterns['test_regex'] = "test"
+
+    assert 'test_regex' not in ConfigParser().get('file_patterns')
+
+
+def test_changed_settings_are_reloaded(config_dir):
+    assert ConfigParser().get('region_name') == "Eswatini"
+    settings_file = str(config_dir / 'cdi_project_settings.conf')
+    with open(settings_file, 'r') as fh:
+        settings = json.loads(fh.read())
+    settings['region_name'] = "Test"
+    settings['bounds'] = {"n_lat": 10.025, "s_lat": 9.975, "w_lon": 20.025, "e_lon": 20.125}
+    with open(settings_file, 'w') as fh:
+        fh.write(json.dumps(settings))
+
+    config = ConfigParser()
+
+    assert config.get('region_name') == "Test"
+    assert np.array_equal(config.get('latitudes'), [10.025, 9.975])
+    assert np.array_equal(config.get('longitudes'), [20.025, 20.075, 20.125])
+
+
+def add_regions(config_dir, regions):
+    settings_file = str(config_dir / 'cdi_project_settings.conf')
+    with open(settings_file, 'r') as fh:
+        settings = json.loads(fh.read())
+    settings['regions'] = regions
+    with open(settings_file, 'w') as fh:
+        fh.write(json.dumps(settings))
+
+
+def test_region_settings(config_dir, monkeypatch):
+    add_regions(config_dir, [{"region_name": "North", "bounds": {"n_lat": 10.025, "s_lat": 9.975, "w_lon": 20.025, "e_lon": 20.125}}])
+    monkeypatch.delenv(REGION_VARIABLE, raising=False)
+    config = ConfigParser("North")
+
+    assert config.get('region_name') == "North"
+    assert np.array_equal(config.get('latitudes'), [10.025, 9.975])
+    assert config.get('scratch_dir') == ConfigParser().get('scratch_dir').rstrip("/\\") + "/North"
+    assert config.get('output_dir') == ConfigParser().get('output_dir')
+    assert ConfigParser("Eswatini").get('region_name') == "Eswatini"
+    assert ConfigParser().get_region_names() == ["Eswatini", "North"]
+    monkeypatch.setenv(REGION_VARIABLE, "North")
+    assert ConfigParser().get('region_name') == "North"
+    with pytest.raises(ValueError):
+        ConfigParser("South")
+
+
+def test_duplicate_region_names(config_dir, monkeypatch):
+    add_regions(config_dir, [{"region_name": "Eswatini", "bounds": {"n_lat": 10.025, "s_lat": 9.975, "w_lon": 20.025, "e_lon": 20.125}}])
+    monkeypatch.delenv(REGION_VARIABLE, raising=False)
+    with pytest.raises(ValueError):
+        ConfigParser().get_region_names()
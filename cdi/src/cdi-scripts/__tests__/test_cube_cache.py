@@ -0,0 +1,78 @@
+import numpy as np
+import numpy.ma as ma
+import pytest
+from netCDF4 import Dataset
+import libs.cube_cache as cube_cache
+import libs.netcdf_functions as netcdf
+from libs.ranking_operations import MonthlyRanking
+
+LATITUDES = [round(-25.675 - 0.05 * j, 3) for j in range(0, 4)]
+LONGITUDES = [round(30.675 + 0.05 * i, 3) for i in range(0, 6)]
+
+
+@pytest.fixture
+def cache():
+    cube_cache.enable()
+    yield
+    cube_cache.disable()
+
+
+def create_file(file_path, name, values=None, times=26):
+    properties = {
+        'latitudes': LATITUDES,
+        'longitudes': LONGITUDES,
+        'times': [float(t * 30) for t in range(0, times)],
+        'time_units': 'days since 1900-01-01 00:00:00'
+    }
+    data_set = netcdf.initialize_dataset(str(file_path), properties)
+    variable = netcdf.create_variable(data_set, name)
+    variable.missing_value = -9999.0
+    if values is not None:
+        variable[:] = values
+    data_set.close()
+
+
+def read_values(file_path, name):
+    data_set = netcdf.open_dataset(str(file_path))
+    values = netcdf.extract_data(data_set, name, -1)
+    data_set.close()
+    return values
+
+
+def test_cached_values_match_the_file(tmp_path, cache):
+    values = ma.masked_array(np.random.default_rng(0).normal(0.0, 1.0, (26, 4, 6)), mask=False)
+    values[3, 1, 2] = ma.masked
+    create_file(tmp_path / "values.nc", 'values', values)
+    cube_cache.put(str(tmp_path / "values.nc"), 'values', values)
+    assert np.array_equal(cube_cache.get(str(tmp_path / "values.nc"), 'values'), read_values(tmp_path / "values.nc", 'values'))
+
+
+def test_writing_discards_the_cached_values(tmp_path, cache):
+    create_file(tmp_path / "values.nc", 'values', np.zeros((26, 4, 6)))
+    cube_cache.put(str(tmp_path / "values.nc"), 'values', np.zeros((26, 4, 6)))
+    netcdf.open_dataset(str(tmp_path / "values.nc"), 'a').close()
+    assert cube_cache.get(str(tmp_path / "values.nc"), 'values') is None
+
+
+def test_disabled_cache_keeps_nothing(tmp_path):
+    cube_cache.put(str(tmp_path / "values.nc"), 'values', np.zeros((26, 4, 6)))
+    assert cube_cache.get(str(tmp_path / "values.nc"), 'values') is None
+
+
+def test_ranking_uses_and_fills_the_cache(tmp_path, cache):
+    values = np.round(np.random.default_rng(1).normal(0.0, 1.0, (26, 4, 6)), 1).astype(np.float32)
+    values[0:5] = -9999.0
+    create_file(tmp_path / "values.nc", 'values', values)
+    create_file(tmp_path / "ranks.nc", 'ranks')
+    # change the values in the file without discarding the cache: the ranks must come from the cached values #
+    cube_cache.put(str(tmp_path / "values.nc"), 'values', values)
+    data_set = Dataset(str(tmp_path / "values.nc"), 'a')
+    data_set.variables['values'][:] = np.zeros((26, 4, 6))
+    data_set.close()
+
+    ranking = MonthlyRanking(str(tmp_path / "values.nc"), str(tmp_path / "ranks.nc"), {'values': 'ranks'}, 26,
+                             skip_missing_years=True)
+    assert ranking.run() == {}
+    ranks = cube_cache.get(str(tmp_path / "ranks.nc"), 'ranks')
+    assert np.array_equal(ranks, read_values(tmp_path / "ranks.nc", 'ranks'))
+    assert not np.all(ranks[5:] == ranks[5])
@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+import libs.netcdf_functions as netcdf
+from libs.cube_store import CubeStore, get_calendar_value
+
+LATITUDES = [round(-25.675 - 0.05 * j, 3) for j in range(0, 6)]
+LONGITUDES = [round(30.675 + 0.05 * i, 3) for i in range(0, 8)]
+VARIABLES = {'values': {'units': "mm", 'long_name': "test values"}}
+
+
+def create_cube(file_path, latitudes=LATITUDES, read_only=False):
+    return CubeStore(str(file_path), latitudes, LONGITUDES, VARIABLES, read_only=read_only)
+
+
+def month_values(date_string):
+    return np.full((len(LATITUDES), len(LONGITUDES)), float(date_string), dtype=np.float32)
+
+
+def month_dates(first_year, last_year):
+    return ['{}{:02d}'.format(y, m) for y in range(first_year, last_year + 1) for m in range(1, 13)]
+
+
+def test_write_and_read(tmp_path):
+    dates = month_dates(2001, 2003)
+    with create_cube(tmp_path / "cube.nc") as cube:
+        cube.reserve(dates)
+        for d in dates[:-1]:
+            cube.write(d, {'values': month_values(d)})
+        # reserved slots are not listed until they are written #
+        assert cube.get_dates() == dates[:-1]
+
+    with create_cube(tmp_path / "cube.nc", read_only=True) as cube:
+        march = [d for d in dates[:-1] if d.endswith('03')]
+        assert np.array_equal(cube.read('values', march), np.array([month_values(d) for d in march]))
+        assert np.array_equal(cube.read_values('values', '200207'), month_values('200207'))
+        assert cube.get_attribute('values', 'units') == "mm"
+
+
+def test_reserve_keeps_chronological_order(tmp_path):
+    file_path = tmp_path / "cube.nc"
+    with create_cube(file_path) as cube:
+        cube.reserve(month_dates(2002, 2002))
+        for d in month_dates(2002, 2002):
+            cube.write(d, {'values': month_values(d)})
+        fingerprint = cube.get_fingerprint(['200205'])
+        # an earlier year rewrites the cube #
+        cube.reserve(month_dates(2001, 2001))
+        for d in month_dates(2001, 2001):
+            cube.write(d, {'values': month_values(d)})
+        assert cube.get_dates() == month_dates(2001, 2002)
+        assert cube.get_fingerprint(['200205']) == fingerprint
+        assert np.array_equal(cube.read('values', month_dates(2001, 2002)), np.array([month_values(d) for d in month_dates(2001, 2002)]))
+
+    data_set = netcdf.open_dataset(str(file_path))
+    assert np.array_equal(data_set.variables['time'][:], [get_calendar_value(d) for d in month_dates(2001, 2002)])
+    data_set.close()
+
+
+def test_series_storage_chunks_the_empty_cube(tmp_path):
+    file_path = tmp_path / "cube.nc"
+    with CubeStore(str(file_path), LATITUDES, LONGITUDES, VARIABLES, storage={"profile": "time_series"}) as cube:
+        cube.reserve(month_dates(2001, 2001))
+
+    data_set = netcdf.open_dataset(str(file_path))
+    assert tuple(data_set.variables['values'].chunking()) == (netcdf.SERIES_CHUNK_TIMES, len(LATITUDES), len(LONGITUDES))
+    data_set.close()
+
+
+def test_fingerprint_changes_when_written(tmp_path):
+    with create_cube(tmp_path / "cube.nc") as cube:
+        cube.reserve(['200101', '200201'])
+        cube.write('200101', {'values': month_values('200101')})
+        cube.write('200201', {'values': month_values('200201')})
+        fingerprint = cube.get_fingerprint(['200101', '200201'])
+        assert cube.get_fingerprint(['200101']) != fingerprint
+        cube.write('200201', {'values': month_values('200201')})
+        assert cube.get_fingerprint(['200101', '200201']) != fingerprint
+
+
+def test_import_files(tmp_path):
+    files = {}
+    for d in ['200101', '200102']:
+        files[d] = str(tmp_path / "values_{}.nc".format(d))
+        properties = {'latitudes': LATITUDES, 'longitudes': LONGITUDES, 'times': [get_calendar_value(d)], 'time_units': 'days since 1900-01-01 00:00:00'}
+        data_set = netcdf.initialize_dataset(files[d], properties)
+        netcdf.create_variable(data_set, 'values')[0] = month_values(d)
+        data_set.close()
+
+    with create_cube(tmp_path / "cube.nc") as cube:
+        assert cube.import_files(files, ['values']) == ['200101', '200102']
+        assert cube.import_files(files, ['values']) == []
+        assert np.array_equal(cube.read('values', ['200101', '200102']), np.array([month_values('200101'), month_values('200102')]))
+
+
+def test_incompatible_cube_is_replaced(tmp_path):
+    with create_cube(tmp_path / "cube.nc") as cube:
+        cube.reserve(['200101'])
+        cube.write('200101', {'values': month_values('200101')})
+    with create_cube(tmp_path / "cube.nc", latitudes=LATITUDES[1:]) as cube:
+        assert cube.get_dates() == []
+
+
+def test_missing_cube_read_only(tmp_path):
+    with pytest.raises(IOError):
+        create_cube(tmp_path / "cube.nc", read_only=True).open()
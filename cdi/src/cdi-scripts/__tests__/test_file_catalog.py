@@ -0,0 +1,124 @@
+import os
+import pytest
+from libs.file_operations import FileHandler, get_files_fingerprint
+
+PATTERNS = {'raw_regex': "raw_(\\d{6})\\.tif$"}
+
+
+def output_name(file_name):
+    return "out_{}.nc".format(file_name.split('raw_')[1][:6])
+
+
+def write_file(file_path, content="data"):
+    with open(file_path, 'w') as fh:
+        fh.write(content)
+
+
+def create_handler(raw_dir, working_dir):
+    return FileHandler(raw_data_dir=str(raw_dir), working_dir=str(working_dir), file_patterns=PATTERNS)
+
+
+def process(handler, working_dir, files):
+    for f in files:
+        output_file = os.path.join(str(working_dir), output_name(f))
+        write_file(output_file)
+        handler.record_processed_file('raw_regex', f, output_file)
+    handler.save_catalog()
+
+
+def test_new_or_changed_files(tmp_path):
+    raw_dir = tmp_path / "raw"
+    working_dir = tmp_path / "working"
+    os.makedirs(str(raw_dir / "2001"))
+    for name in ["raw_200001.tif", "raw_200002.tif", "2001/raw_200101.tif", "notes.txt"]:
+        write_file(str(raw_dir / name))
+
+    handler = create_handler(raw_dir, working_dir)
+    files = handler.get_new_or_changed_files('raw_regex', output_name)
+    assert sorted(files) == ["2001/raw_200101.tif", "raw_200001.tif", "raw_200002.tif"]
+    process(handler, working_dir, files)
+
+    # a new run only finds the new, changed and lost files #
+    write_file(str(raw_dir / "raw_200003.tif"))
+    write_file(str(raw_dir / "raw_200001.tif"), "corrected data")
+    os.remove(str(working_dir / "out_200101.nc"))
+    handler = create_handler(raw_dir, working_dir)
+    files = handler.get_new_or_changed_files('raw_regex', output_name)
+    assert sorted(files) == ["2001/raw_200101.tif", "raw_200001.tif", "raw_200003.tif"]
+    process(handler, working_dir, files)
+
+    handler = create_handler(raw_dir, working_dir)
+    assert handler.get_new_or_changed_files('raw_regex', output_name) == []
+
+
+def test_outputs_created_before_the_catalog(tmp_path):
+    raw_dir = tmp_path / "raw"
+    working_dir = tmp_path / "working"
+    os.makedirs(str(raw_dir))
+    os.makedirs(str(working_dir))
+    for month in ["01", "02"]:
+        write_file(str(raw_dir / "raw_2000{}.tif".format(month)))
+    write_file(str(working_dir / "out_200001.nc"))
+    write_file(str(working_dir / "file_catalog.json"), "{not json")
+
+    handler = create_handler(raw_dir, working_dir)
+
+    assert handler.get_new_or_changed_files('raw_regex', output_name) == ["raw_200002.tif"]
+
+
+class Converter:
+    def __init__(self, raw_dir, working_dir):
+        self.raw_dir = str(raw_dir)
+        self.working_dir = str(working_dir)
+
+    def convert(self, file_name):
+        with open(os.path.join(self.raw_dir, file_name), 'r') as fh:
+            content = fh.read()
+        with open(os.path.join(self.working_dir, output_name(file_name)), 'w') as fh:
+            fh.write("partial")
+            if content == "bad":
+                raise ValueError("bad data in {}".format(file_name))
+            fh.write(content)
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_process_raw_files(tmp_path, workers):
+    raw_dir = tmp_path / "raw"
+    working_dir = tmp_path / "working"
+    os.makedirs(str(raw_dir))
+    for month in range(1, 9):
+        write_file(str(raw_dir / "raw_2000{:02d}.tif".format(month)), "bad" if month in [2, 7] else "data")
+    handler = create_handler(raw_dir, working_dir)
+    files = handler.get_new_or_changed_files('raw_regex', output_name)
+
+    failures = handler.process_raw_files('raw_regex', files, Converter(raw_dir, working_dir).convert, output_name, workers)
+
+    assert list(failures.keys()) == [f for f in files if f in ["raw_200002.tif", "raw_200007.tif"]]
+    assert failures["raw_200002.tif"] == "ValueError: bad data in raw_200002.tif"
+    assert sorted(f for f in os.listdir(str(working_dir)) if f.endswith('.nc')) == \
+        ["out_2000{:02d}.nc".format(m) for m in [1, 3, 4, 5, 6, 8]]
+    # the failed files are converted again on the next run #
+    handler = create_handler(raw_dir, working_dir)
+    assert sorted(handler.get_new_or_changed_files('raw_regex', output_name)) == ["raw_200002.tif", "raw_200007.tif"]
+
+
+def test_process_raw_files_with_shared_outputs(tmp_path):
+    raw_dir = tmp_path / "raw"
+    os.makedirs(str(raw_dir))
+    handler = create_handler(raw_dir, tmp_path / "working")
+
+    with pytest.raises(ValueError):
+        handler.process_raw_files('raw_regex', ["raw_200001.tif", "v2/raw_200001.tif"], print, output_name, 2)
+
+
+def test_files_fingerprint(tmp_path):
+    files = [str(tmp_path / "raw_{}.tif".format(d)) for d in ['200101', '200201']]
+    for f in files:
+        write_file(f)
+    fingerprint = get_files_fingerprint(files)
+    assert get_files_fingerprint(list(reversed(files))) == fingerprint
+    write_file(files[1], "changed data")
+    changed = get_files_fingerprint(files)
+    assert changed != fingerprint
+    write_file(str(tmp_path / "raw_200301.tif"))
+    assert get_files_fingerprint(files + [str(tmp_path / "raw_200301.tif")]) != changed
@@ -0,0 +1,68 @@
+import json
+import os
+import numpy as np
+import pytest
+import rasterio
+import libs.netcdf_functions as netcdf
+from benchmarks import synthetic_inputs as synthetic
+from libs.config_reader import ConfigParser, REGION_VARIABLE
+from libs.cube_store import get_calendar_value
+from STEP_0303_export_ranking_data_rasters import NetCDFtoTIFF, get_geotiff_options
+
+BOUNDS = synthetic.REGIONS['country']
+
+
+def test_geotiff_options():
+    assert get_geotiff_options() == {'driver': 'GTiff'}
+    assert get_geotiff_options({'profile': 'plain', 'blocksize': 64}) == {'driver': 'GTiff'}
+    options = get_geotiff_options({'profile': 'cog', 'compress': 'zstd', 'blocksize': 64})
+    assert options['driver'] == 'COG' and options['compress'] == 'ZSTD' and options['blocksize'] == 64
+    with pytest.raises(ValueError):
+        get_geotiff_options({'profile': 'tiled'})
+
+
+@pytest.fixture
+def ranks(tmp_path, monkeypatch):
+    root_dir = synthetic.write_settings(str(tmp_path), BOUNDS)
+    settings_file = os.path.join(root_dir, 'cdi_project_settings.conf')
+    with open(settings_file, 'r') as fh:
+        settings = json.loads(fh.read())
+    settings['geotiff_export'] = {'profile': 'cog', 'compress': 'deflate', 'blocksize': 16}
+    with open(settings_file, 'w') as fh:
+        fh.write(json.dumps(settings))
+    monkeypatch.setenv('CDI_CONFIG_DIR', root_dir)
+    monkeypatch.delenv(REGION_VARIABLE, raising=False)
+    config = ConfigParser()
+    dates = ['200101', '200102', '200103']
+    values = np.random.default_rng(0).uniform(0.0, 1.0, (len(dates), 44, 44)).astype(np.float32)
+    values[:, 0:3, :] = -9999.0
+    properties = {
+        'latitudes': config.get('latitudes'),
+        'longitudes': config.get('longitudes'),
+        'times': [get_calendar_value(d) for d in dates],
+        'time_units': 'days since 1900-01-01 00:00:00.0 UTC'
+    }
+    data_set = netcdf.initialize_dataset(os.path.join(config.get('output_dir'), "STEP_0302_CDI_pct_rank_Synthetic.nc"), properties)
+    variable = netcdf.create_variable(data_set, 'cdi_wt_sum_pr')
+    variable.missing_value = -9999.0
+    variable[:] = values
+    data_set.close()
+    return dates, values
+
+
+@pytest.mark.parametrize("mode", ['all', 'latest'])
+def test_cog_export(ranks, mode):
+    dates, values = ranks
+    with NetCDFtoTIFF('cdi', mode) as exporter:
+        files = exporter.get_file_names()
+        for f in files:
+            exporter.export_geotiff(f)
+
+    expected_dates = dates if mode == 'all' else dates[-1:]
+    assert [os.path.basename(f) for f in files] == ["STEP_0303_CDI_pct_rank_Synthetic_{}.tif".format(d) for d in expected_dates]
+    for f, d in zip(files, expected_dates):
+        with rasterio.open(f) as image:
+            assert image.profile['tiled'] and image.block_shapes == [(16, 16)]
+            assert image.compression.name == 'deflate'
+            assert len(image.overviews(1)) > 0
+            assert np.array_equal(image.read(1), values[dates.index(d)])
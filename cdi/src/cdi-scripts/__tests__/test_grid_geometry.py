@@ -0,0 +1,35 @@
+import pytest
+from libs.grid_geometry import GridGeometry, MODIS_CMG_GRID, CHIRPS_GRID
+
+ESWATINI = {"n_lat": -25.675, "s_lat": -27.825, "w_lon": 30.675, "e_lon": 32.825}
+
+
+def test_window_on_north_to_south_grids():
+    rows, columns = MODIS_CMG_GRID.window(ESWATINI)
+    assert (rows.start, rows.stop) == (2313, 2357)
+    assert (columns.start, columns.stop) == (4213, 4257)
+
+    rows, columns = CHIRPS_GRID.window(ESWATINI)
+    assert (rows.start, rows.stop) == (1513, 1557)
+    assert (columns.start, columns.stop) == (4213, 4257)
+
+
+def test_window_on_south_to_north_grid():
+    latitudes = [round(-59.95 + 0.1 * j, 3) for j in range(0, 1500)]
+    longitudes = [round(-179.95 + 0.1 * i, 3) for i in range(0, 3600)]
+    grid = GridGeometry.from_coordinates(latitudes, longitudes)
+
+    rows, columns = grid.window({"n_lat": -25.65, "s_lat": -27.85, "w_lon": 30.65, "e_lon": 32.85})
+
+    assert latitudes[rows.start] == -27.85 and latitudes[rows.stop - 1] == -25.65
+    assert longitudes[columns.start] == 30.65 and longitudes[columns.stop - 1] == 32.85
+
+
+@pytest.mark.parametrize("bounds", [
+    {"n_lat": -25.67, "s_lat": -27.825, "w_lon": 30.675, "e_lon": 32.825},  # off-grid latitude
+    {"n_lat": -25.675, "s_lat": -27.825, "w_lon": 30.675, "e_lon": 180.025},  # outside the grid
+    {"n_lat": -27.825, "s_lat": -25.675, "w_lon": 30.675, "e_lon": 32.825},  # north below south
+])
+def test_window_rejects_invalid_bounds(bounds):
+    with pytest.raises(ValueError):
+        MODIS_CMG_GRID.window(bounds)
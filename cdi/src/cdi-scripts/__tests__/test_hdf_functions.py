@@ -0,0 +1,65 @@
+import os
+import stat
+import libs.hdf_functions as hdf
+from libs.file_operations import FileHandler
+
+PATTERNS = {'lst_hdf_regex': "MOD21C3\\.A((?:19|20)\\d\\d)(\\d\\d\\d)\\S+hdf"}
+# stand-in for h4toh5convert: copies the file, fails on "bad" content and hangs on "slow" content #
+CONVERTER = """#!/bin/sh
+grep -q bad "$1" && { echo "bad HDF4 file" >&2; exit 3; }
+grep -q slow "$1" && sleep 10
+cat "$1" > "$2"
+"""
+
+
+def write_file(file_path, content):
+    with open(file_path, 'w') as fh:
+        fh.write(content)
+
+
+def create_converter(directory, script):
+    converter = os.path.join(str(directory), "h4toh5convert")
+    write_file(converter, script)
+    os.chmod(converter, os.stat(converter).st_mode | stat.S_IEXEC)
+    return converter
+
+
+def test_convert_h4_to_h5(tmp_path, monkeypatch):
+    raw_dir = tmp_path / "raw"
+    os.makedirs(str(raw_dir))
+    monkeypatch.setattr(hdf, 'H4TOH5_CONVERTER', create_converter(tmp_path, CONVERTER))
+    names = ["MOD21C3.A2000{:03d}.061.hdf".format(day) for day in [32, 61, 92, 122]]
+    for name, content in zip(names, ["good", "bad", "slow", "good"]):
+        write_file(str(raw_dir / name), content)
+    write_file(str(raw_dir / ".h4toh5-0123.tmp"), "left by a stopped run")
+    handler = FileHandler(raw_data_dir=str(raw_dir), working_dir=str(tmp_path / "working"), file_patterns=PATTERNS)
+
+    failures = handler.convert_h4_to_h5(names, workers=3, timeout=1)
+
+    assert list(failures.keys()) == [names[1], names[2]]
+    assert "bad HDF4 file" in failures[names[1]] and "TimeoutExpired" in failures[names[2]]
+    assert sorted(os.listdir(str(raw_dir))) == sorted([
+        "MOD21C3.A2000032.061_h5.hdf", names[1], names[2], "MOD21C3.A2000122.061_h5.hdf"
+    ])
+    with open(str(raw_dir / "MOD21C3.A2000032.061_h5.hdf"), 'r') as fh:
+        assert fh.read() == "good"
+
+
+def test_converted_files_are_not_converted_again(tmp_path, monkeypatch):
+    raw_dir = tmp_path / "raw"
+    os.makedirs(str(raw_dir))
+    monkeypatch.setattr(hdf, 'H4TOH5_CONVERTER', create_converter(tmp_path, CONVERTER))
+    name = "MOD21C3.A2000032.061.hdf"
+    write_file(str(raw_dir / name), "good")
+    mtime = os.stat(str(raw_dir / name)).st_mtime_ns
+    handler = FileHandler(raw_data_dir=str(raw_dir), working_dir=str(tmp_path / "working"), file_patterns=PATTERNS)
+    assert handler.convert_h4_to_h5([name]) == {}
+
+    # the same file is downloaded again: it is removed without running the converter #
+    monkeypatch.setattr(hdf, 'H4TOH5_CONVERTER', create_converter(tmp_path / "working", "#!/bin/sh\nexit 1\n"))
+    write_file(str(raw_dir / name), "good")
+    os.utime(str(raw_dir / name), ns=(mtime, mtime))
+    handler = FileHandler(raw_data_dir=str(raw_dir), working_dir=str(tmp_path / "working"), file_patterns=PATTERNS)
+
+    assert handler.convert_h4_to_h5([name]) == {}
+    assert os.listdir(str(raw_dir)) == ["MOD21C3.A2000032.061_h5.hdf"]
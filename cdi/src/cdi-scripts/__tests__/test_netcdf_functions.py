@@ -0,0 +1,124 @@
+import os
+import numpy as np
+import pytest
+import libs.netcdf_functions as netcdf
+import libs.telemetry as telemetry
+
+
+def create_properties(times=240, rows=44, columns=80):
+    return {
+        'latitudes': [round(-25.675 - 0.05 * j, 3) for j in range(0, rows)],
+        'longitudes': [round(30.675 + 0.05 * i, 3) for i in range(0, columns)],
+        'times': list(range(0, times)),
+        'time_units': 'days since 1900-01-01 00:00:00'
+    }
+
+
+def create_data_set(file_path, times=240, rows=44, columns=80, unlimited_time=False):
+    return netcdf.initialize_dataset(str(file_path), create_properties(times, rows, columns), unlimited_time)
+
+
+@pytest.mark.parametrize("profile, chunks", [
+    ("time_step", (1, 44, 80)),
+    ("time_series", (120, 32, 32)),
+])
+def test_storage_profiles_round_trip(tmp_path, profile, chunks):
+    data = np.random.default_rng(0).uniform(-3.0, 3.0, (240, 44, 80)).astype(np.float32)
+    data[:, :4, :] = -9999.0
+    data_set = create_data_set(tmp_path / "test.nc")
+    variable = netcdf.create_variable(data_set, 'values', {"profile": profile, "complevel": 1, "shuffle": True})
+    variable.missing_value = -9999.0
+    variable[:] = data
+    data_set.close()
+
+    data_set = netcdf.open_dataset(tmp_path / "test.nc")
+    filters = data_set.variables['values'].filters()
+    assert tuple(data_set.variables['values'].chunking()) == chunks
+    assert filters['zlib'] and filters['shuffle'] and filters['complevel'] == 1
+    assert np.array_equal(netcdf.extract_data(data_set, 'values', -1), data)
+    data_set.close()
+
+
+@pytest.mark.parametrize("profile, chunks", [
+    ("time_step", (1, 44, 80)),
+    ("time_series", (120, 32, 32)),
+])
+def test_unlimited_time_chunks(tmp_path, profile, chunks):
+    data_set = create_data_set(tmp_path / "test.nc", times=0, unlimited_time=True)
+    variable = netcdf.create_variable(data_set, 'values', {"profile": profile})
+    assert tuple(variable.chunking()) == chunks
+    data_set.close()
+
+
+def test_default_storage_is_contiguous(tmp_path):
+    data_set = create_data_set(tmp_path / "test.nc", times=2)
+    variable = netcdf.create_variable(data_set, 'values', {"profile": "none", "complevel": 4, "shuffle": True})
+    unset = netcdf.create_variable(data_set, 'unset')
+    assert variable.chunking() == 'contiguous' and unset.chunking() == 'contiguous'
+    assert not variable.filters()['zlib']
+    data_set.close()
+
+
+def test_unknown_storage_profile(tmp_path):
+    data_set = create_data_set(tmp_path / "test.nc", times=2)
+    with pytest.raises(ValueError):
+        netcdf.create_variable(data_set, 'values', {"profile": "time_slab"})
+    data_set.close()
+
+
+def test_open_dataset_for_update(tmp_path):
+    file_path = str(tmp_path / "test.nc")
+    assert netcdf.open_dataset_for_update(file_path, create_properties(times=24)) is None
+    data_set = create_data_set(file_path, times=12, unlimited_time=True)
+    variable = netcdf.create_variable(data_set, 'values')
+    variable[:] = np.ones((12, 44, 80), dtype=np.float32)
+    data_set.close()
+
+    data_set = netcdf.open_dataset_for_update(file_path, create_properties(times=24))
+    assert len(data_set.dimensions['time']) == 24
+    assert np.array_equal(data_set.variables['time'][:], np.arange(0, 24))
+    data_set.variables['values'][12:] = np.zeros((12, 44, 80), dtype=np.float32)
+    data_set.close()
+    data_set = netcdf.open_dataset(file_path)
+    assert np.array_equal(data_set.variables['values'][:12], np.ones((12, 44, 80)))
+    assert np.array_equal(data_set.variables['values'][12:], np.zeros((12, 44, 80)))
+    data_set.close()
+
+
+@pytest.mark.parametrize("unlimited_time, properties", [
+    (False, create_properties(times=24)),
+    (True, create_properties(times=24, rows=40)),
+    (True, dict(create_properties(times=24), times=list(range(1, 25)))),
+])
+def test_open_dataset_for_update_incompatible(tmp_path, unlimited_time, properties):
+    file_path = str(tmp_path / "test.nc")
+    create_data_set(file_path, times=12, unlimited_time=unlimited_time).close()
+    assert netcdf.open_dataset_for_update(file_path, properties) is None
+
+
+def test_extract_window_as_float32(tmp_path):
+    data = np.random.default_rng(0).uniform(0.0, 0.5, (2, 44, 80)).astype(np.float32)
+    data_set = create_data_set(tmp_path / "test.nc", times=2)
+    netcdf.create_variable(data_set, 'values')[:] = data
+    data_set.close()
+
+    data_set = netcdf.open_dataset(tmp_path / "test.nc")
+    window = netcdf.extract_window(data_set, 'values', slice(4, 10), slice(20, 31), 1)
+    data_set.close()
+    assert window.dtype == np.float32
+    assert np.array_equal(window, data[1, 4:10, 20:31])
+
+
+def test_data_reads_are_timed(tmp_path, monkeypatch):
+    monkeypatch.delenv(telemetry.RUN_VARIABLE, raising=False)
+    monkeypatch.delenv(telemetry.FILE_VARIABLE, raising=False)
+    telemetry.start_run(str(tmp_path))
+    monkeypatch.setenv(telemetry.RUN_VARIABLE, os.environ[telemetry.RUN_VARIABLE])
+    monkeypatch.setenv(telemetry.FILE_VARIABLE, os.environ[telemetry.FILE_VARIABLE])
+    data_set = create_data_set(tmp_path / "test.nc", times=2)
+    netcdf.create_variable(data_set, 'values')[:] = np.ones((2, 44, 80), dtype=np.float32)
+    with telemetry.StepTelemetry('Step 0201'):
+        netcdf.extract_values(data_set, 'values', -1)
+        netcdf.extract_values(data_set, 'values', 0)
+    data_set.close()
+    assert telemetry.read_run(os.environ[telemetry.FILE_VARIABLE])['Step 0201']['operations']['extract_values']['calls'] == 2
@@ -0,0 +1,110 @@
+import numpy as np
+import numpy.ma as ma
+import pytest
+import libs.netcdf_functions as netcdf
+from libs.cube_store import CubeStore
+from libs.ranking_operations import MonthlyRanking
+from libs.statistics_operations import StatisticOperations
+
+LATITUDES = [round(-25.675 - 0.05 * j, 3) for j in range(0, 5)]
+LONGITUDES = [round(30.675 + 0.05 * i, 3) for i in range(0, 7)]
+
+
+def create_file(file_path, times, values=None):
+    properties = {
+        'latitudes': LATITUDES,
+        'longitudes': LONGITUDES,
+        'times': [float(t * 30) for t in range(0, times)],
+        'time_units': 'days since 1900-01-01 00:00:00'
+    }
+    data_set = netcdf.initialize_dataset(str(file_path), properties)
+    variable = netcdf.create_variable(data_set, 'values' if values is not None else 'ranks')
+    variable.missing_value = -9999.0
+    if values is not None:
+        variable[:] = values
+    data_set.close()
+
+
+def create_values(times, seed=0):
+    generator = np.random.default_rng(seed)
+    return np.round(generator.normal(0.0, 1.0, (times, len(LATITUDES), len(LONGITUDES))), 1).astype(np.float32)
+
+
+def read_ranks(file_path):
+    data_set = netcdf.open_dataset(str(file_path))
+    ranks = data_set.variables['ranks'][:]
+    data_set.close()
+    return ranks
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_monthly_ranking(tmp_path, workers):
+    values = create_values(30)
+    create_file(tmp_path / "values.nc", 30, values)
+    create_file(tmp_path / "ranks.nc", 30)
+
+    ranking = MonthlyRanking(str(tmp_path / "values.nc"), str(tmp_path / "ranks.nc"), {'values': 'ranks'}, 30)
+    assert ranking.run(workers) == {}
+
+    ranks = read_ranks(tmp_path / "ranks.nc")
+    stats = StatisticOperations()
+    for index in range(0, 12):
+        expected = stats.rank_parameter(netcdf.missing_to_nan(values[index::12]))
+        assert np.array_equal(netcdf.missing_to_nan(ranks[index::12]), expected, equal_nan=True)
+
+
+def test_monthly_ranking_first_time(tmp_path):
+    values = create_values(30)
+    create_file(tmp_path / "values.nc", 30, values)
+    create_file(tmp_path / "ranks.nc", 25)
+
+    MonthlyRanking(str(tmp_path / "values.nc"), str(tmp_path / "ranks.nc"), {'values': 'ranks'}, 25, first_time=5).run()
+
+    ranks = read_ranks(tmp_path / "ranks.nc")
+    expected = StatisticOperations().rank_parameter(netcdf.missing_to_nan(values[7:30:12]))
+    assert np.array_equal(netcdf.missing_to_nan(ranks[2::12]), expected, equal_nan=True)
+
+
+def test_monthly_ranking_skips_missing_years(tmp_path):
+    values = create_values(30)
+    values[0:5] = -9999.0
+    create_file(tmp_path / "values.nc", 30, values)
+    create_file(tmp_path / "ranks.nc", 30)
+
+    MonthlyRanking(str(tmp_path / "values.nc"), str(tmp_path / "ranks.nc"), {'values': 'ranks'}, 30,
+                   skip_missing_years=True).run()
+
+    ranks = read_ranks(tmp_path / "ranks.nc")
+    stats = StatisticOperations()
+    # the missing first year of the month is set to missing and left out of the ranks of the other years #
+    assert np.all(ma.getmaskarray(ranks[3]))
+    expected = stats.rank_parameter(netcdf.missing_to_nan(values[15::12]))
+    assert np.array_equal(netcdf.missing_to_nan(ranks[15::12]), expected, equal_nan=True)
+    expected = stats.rank_parameter(netcdf.missing_to_nan(values[6::12]))
+    assert np.array_equal(netcdf.missing_to_nan(ranks[6::12]), expected, equal_nan=True)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_monthly_ranking_of_cube_with_gap(tmp_path, workers):
+    values = create_values(36)
+    dates = ['{}{:02d}'.format(2001 + t // 12, t % 12 + 1) for t in range(0, 36)]
+    cube = CubeStore(str(tmp_path / "cube.nc"), LATITUDES, LONGITUDES, {'values': {}})
+    with cube:
+        cube.reserve(dates)
+        # the slot of 200205 is reserved but not written #
+        for t, d in enumerate(dates):
+            if d != '200205':
+                cube.write(d, {'values': values[t]})
+    written = [t for t, d in enumerate(dates) if d != '200205']
+    create_file(tmp_path / "ranks.nc", len(written))
+
+    cube = CubeStore(str(tmp_path / "cube.nc"), LATITUDES, LONGITUDES, read_only=True)
+    ranking = MonthlyRanking(str(tmp_path / "cube.nc"), str(tmp_path / "ranks.nc"), {'values': 'ranks'}, len(written), cube=cube)
+    assert ranking.run(workers) == {}
+
+    ranks = netcdf.missing_to_nan(read_ranks(tmp_path / "ranks.nc"))
+    stats = StatisticOperations()
+    for month in range(0, 12):
+        positions = [i for i, t in enumerate(written) if t % 12 == month]
+        expected = stats.rank_parameter(values[[written[i] for i in positions]])
+        assert np.array_equal(ranks[positions], expected, equal_nan=True)
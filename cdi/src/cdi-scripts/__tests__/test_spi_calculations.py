@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+import numpy.ma as ma
+from libs.spi_calculations import calculate_monthly_spi, calculate_monthly_spi_fast, calculate_period_totals
+
+
+def create_precip(years, shape, seed=0):
+    generator = np.random.default_rng(seed)
+    values = [generator.gamma(1.5, 60.0, shape) for y in range(0, years)]
+    for v in values:
+        v[generator.random(shape) < 0.15] = 0.0  # dry months
+        v[0, 0] = 0.0  # no precipitation in any year
+    values[0][1, :] = 0.0
+    return values
+
+
+@pytest.mark.parametrize("years", [1, 3, 40])
+def test_fast_spi_matches_current_spi(years):
+    values = create_precip(years, (12, 15), seed=years)
+    expected = np.asarray(calculate_monthly_spi(values))
+
+    result = calculate_monthly_spi_fast(values, dtype=np.float64)
+    result_32 = calculate_monthly_spi_fast(values)
+
+    assert result.tobytes() == expected.tobytes()
+    assert result_32.dtype == np.float32
+    assert np.array_equal(np.isfinite(result_32), np.isfinite(expected))
+    finite = np.isfinite(expected)
+    assert np.allclose(result_32[finite], expected[finite], rtol=0.0, atol=1e-6)
+
+
+def test_fast_spi_of_dry_months():
+    values = [np.array([[0.0, 0.0, 5.0]]), np.array([[0.0, 3.0, 0.0]]), np.array([[0.0, 4.0, 7.0]]), np.array([[0.0, 0.0, 1.0]])]
+
+    result = calculate_monthly_spi_fast(values, dtype=np.float64)
+
+    # no precipitation in any year #
+    assert np.all(np.isposinf(result[:, 0, 0]))
+    # dry months have the probability of no precipitation #
+    assert result[0, 0, 1] == 0.0 and result[3, 0, 1] == 0.0
+    assert result[1, 0, 2] == pytest.approx(-0.6744897501960817)
+
+
+def test_period_totals_match_window_sums():
+    generator = np.random.default_rng(3)
+    values = generator.gamma(2.0, 40.0, (30, 6, 7)).astype(np.float32)
+    values[generator.random(values.shape) < 0.2] = np.nan
+    values[:, 0, 0] = np.nan  # missing in every month
+    totals = calculate_period_totals(values, [1, 3, 6])
+
+    for period in [1, 3, 6]:
+        assert totals[period].dtype == np.float32
+        assert np.all(np.isnan(totals[period][:(period - 1)]))
+        for t in range(period - 1, len(values)):
+            window = values[(t - period + 1):(t + 1)].astype(float)
+            expected = ma.sum(ma.masked_invalid(window), axis=0).filled(np.nan).astype(np.float32)
+            assert np.array_equal(totals[period][t], expected, equal_nan=True)
+    assert np.array_equal(totals[1], values, equal_nan=True)
+
+
+def test_period_totals_of_short_series():
+    totals = calculate_period_totals(np.ones((2, 3, 3)), [3])
+    assert np.all(np.isnan(totals[3]))
@@ -0,0 +1,106 @@
+import warnings
+import numpy as np
+import pytest
+import libs.netcdf_functions as netcdf
+from libs.statistics_operations import StatisticOperations
+
+
+def create_years(years, shape, seed=0, missing_fraction=0.05):
+    generator = np.random.default_rng(seed)
+    # round the values to force ties between the years #
+    values = [np.round(generator.normal(0.0, 1.0, shape), 1).astype(np.float32) for y in range(0, years)]
+    for v in values:
+        v[generator.random(shape) < missing_fraction] = np.nan
+    return values
+
+
+@pytest.mark.parametrize("years", [1, 2, 7, 26])
+def test_rank_parameter_sort_matches_pairwise(years):
+    stats = StatisticOperations()
+    values = create_years(years, (9, 11), seed=years)
+
+    result = stats.rank_parameter(values)
+    expected = stats.rank_parameter(values, method='pairwise')
+
+    assert result.dtype == np.float32
+    assert result.tobytes() == expected.tobytes()
+
+
+def test_rank_parameter_ties_and_missing():
+    stats = StatisticOperations()
+    values = [np.array([[0.3, 0.5]]), np.array([[0.1, np.nan]]), np.array([[0.3, 0.2]]), np.array([[0.3, 0.4]])]
+
+    result = stats.rank_parameter(values)
+
+    assert np.allclose(result[:, 0, 0], [0.667, 0.0, 0.667, 0.667])
+    assert np.isnan(result[:, 0, 1]).all()
+
+
+def test_rank_parameter_unknown_method():
+    with pytest.raises(ValueError):
+        StatisticOperations().rank_parameter([np.zeros((1, 1))], method='unknown')
+
+
+def create_month_files(directory, values):
+    files = []
+    for y, v in enumerate(values):
+        file_path = str(directory / "month_{}.nc".format(1990 + y))
+        properties = {
+            'latitudes': list(range(0, v.shape[0])),
+            'longitudes': list(range(0, v.shape[1])),
+            'times': [y],
+            'time_units': 'days since 1900-01-01 00:00:00'
+        }
+        data_set = netcdf.initialize_dataset(file_path, properties)
+        variable = netcdf.create_variable(data_set, 'values', datatype='float64')
+        variable.missing_value = -9999.0
+        variable[0] = netcdf.nan_to_missing(v)
+        data_set.close()
+        files.append(file_path)
+    return files
+
+
+@pytest.mark.parametrize("years", [1, 2, 20])
+def test_write_anomalies_matches_in_memory_anomalies(tmp_path, years):
+    stats = StatisticOperations()
+    values = create_years(years, (6, 7), seed=years, missing_fraction=0.2)
+    values[0][0, 0] = 5.0  # constant grid point: standard deviation of 0 #
+    for v in values[1:]:
+        v[0, 0] = 5.0
+    files = create_month_files(tmp_path, values)
+    output = {}
+
+    written = stats.write_anomalies_from_files(files, 'values', output, 3, step=12)
+    expected = stats.compute_anomalies_from_files(files, 'values')
+
+    assert written == years and sorted(output.keys()) == [3 + 12 * y for y in range(0, years)]
+    for y in range(0, years):
+        result = output[3 + 12 * y]
+        assert np.array_equal(result == -9999.0, np.isnan(expected[y][0]))
+        assert np.array_equal(result, netcdf.nan_to_missing(expected[y][0]))
+    assert np.all(output[3][0, 0] == -9999.0)
+
+
+def test_anomalies_of_values():
+    stats = StatisticOperations()
+    values = np.array([[[1.0, 2.0, np.nan]], [[3.0, 2.0, 1.0]], [[5.0, 2.0, np.nan]]], dtype=np.float32)
+
+    anomalies = stats.compute_anomalies_from_values(values)
+
+    assert anomalies.dtype == np.float32
+    assert np.allclose(anomalies[:, 0, 0], [-1.0, 0.0, 1.0])
+    # no anomalies without a standard deviation: equal values, or a single value #
+    assert np.all(np.isnan(anomalies[:, 0, 1])) and np.all(np.isnan(anomalies[:, 0, 2]))
+
+
+def test_anomalies_of_infinite_values():
+    stats = StatisticOperations()
+    # SPI of a month without rain is -inf, and +inf is possible as well #
+    values = np.array([[[1.0, -np.inf, np.inf]], [[3.0, 2.0, 1.0]], [[5.0, 2.0, np.inf]]], dtype=np.float32)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', RuntimeWarning)
+        anomalies = stats.compute_anomalies_from_values(values)
+
+    assert np.allclose(anomalies[:, 0, 0], [-1.0, 0.0, 1.0])
+    assert np.all(np.isnan(anomalies[:, 0, 1:]))
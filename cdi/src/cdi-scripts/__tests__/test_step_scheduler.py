@@ -0,0 +1,126 @@
+import os
+import pytest
+from libs.step_scheduler import StepScheduler
+
+
+def write_step(file_path, source=None):
+    with open(file_path, 'a') as fh:
+        fh.write(os.path.basename(file_path) + "\n")
+    if source is not None and not os.path.isfile(source):
+        raise IOError("Missing input: '{}'".format(source))
+
+
+def convert_inputs(directory, file_path):
+    # replaces the input files by converted files, as the HDF4 to HDF5 conversion of steps 0101 and 0102 #
+    for name in os.listdir(directory):
+        if name.find("_h5") < 0:
+            with open(os.path.join(directory, name[:-4] + '_h5.hdf'), 'w') as fh:
+                fh.write("converted")
+            os.remove(os.path.join(directory, name))
+    write_step(file_path)
+
+
+def receive_input(directory, file_path):
+    # converts the inputs while a new input file arrives #
+    convert_inputs(directory, file_path)
+    with open(os.path.join(directory, "arrived.hdf"), 'w') as fh:
+        fh.write("raw")
+
+
+def failing_step():
+    raise RuntimeError("step failed")
+
+
+def create_scheduler(tmp_path):
+    scheduler = StepScheduler(str(tmp_path / "state" / "steps.json"))
+    raw = tmp_path / "raw"
+    if not raw.is_dir():
+        raw.mkdir()
+        (raw / "input.txt").write_text("raw")
+    first = str(tmp_path / "first.txt")
+    second = str(tmp_path / "second.txt")
+    scheduler.add_step("Step A", write_step, (first,), inputs=[str(raw)], outputs=[first])
+    scheduler.add_step("Step B", write_step, (second,), inputs=[str(raw)], outputs=[second])
+    scheduler.add_step("Step C", write_step, (str(tmp_path / "third.txt"), second), ["Step A", "Step B"], [first, second])
+    return scheduler
+
+
+def read_runs(tmp_path, name):
+    file_path = tmp_path / name
+    return len(file_path.read_text().splitlines()) if file_path.is_file() else 0
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_steps_run_once_until_inputs_change(tmp_path, jobs):
+    scheduler = create_scheduler(tmp_path)
+    assert scheduler.run(scheduler.select_steps(), jobs) == {}
+    assert [read_runs(tmp_path, n) for n in ["first.txt", "second.txt", "third.txt"]] == [1, 1, 1]
+
+    # unchanged inputs are skipped, also by a new scheduler #
+    scheduler = create_scheduler(tmp_path)
+    assert scheduler.run(scheduler.select_steps(), jobs) == {}
+    assert [read_runs(tmp_path, n) for n in ["first.txt", "second.txt", "third.txt"]] == [1, 1, 1]
+
+    # a changed raw file runs the steps that use it, and the steps that use their outputs #
+    (tmp_path / "raw" / "other.txt").write_text("new")
+    scheduler = create_scheduler(tmp_path)
+    assert scheduler.run(scheduler.select_steps(), jobs) == {}
+    assert [read_runs(tmp_path, n) for n in ["first.txt", "second.txt", "third.txt"]] == [2, 2, 2]
+
+
+def test_missing_output_is_not_skipped(tmp_path):
+    scheduler = create_scheduler(tmp_path)
+    scheduler.run(scheduler.select_steps())
+    os.remove(str(tmp_path / "first.txt"))
+    scheduler.run(scheduler.select_steps(only=["Step A"]))
+    assert read_runs(tmp_path, "first.txt") == 1
+    assert read_runs(tmp_path, "second.txt") == 1
+
+
+def test_select_steps(tmp_path):
+    scheduler = create_scheduler(tmp_path)
+    assert scheduler.select_steps(start="Step B") == ["Step B", "Step C"]
+    assert scheduler.select_steps(only=["Step C", "Step A"]) == ["Step A", "Step C"]
+    with pytest.raises(ValueError):
+        scheduler.select_steps(start="Step D")
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_failed_step_blocks_its_dependents(tmp_path, jobs):
+    scheduler = StepScheduler(str(tmp_path / "steps.json"))
+    scheduler.add_step("Step A", failing_step)
+    scheduler.add_step("Step B", write_step, (str(tmp_path / "second.txt"),))
+    scheduler.add_step("Step C", write_step, (str(tmp_path / "third.txt"),), ["Step A"])
+    failures = scheduler.run(scheduler.select_steps(), jobs)
+    assert list(failures.keys()) == ["Step A", "Step C"]
+    assert read_runs(tmp_path, "second.txt") == 1
+    assert read_runs(tmp_path, "third.txt") == 0
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_step_that_changes_its_inputs_is_skipped(tmp_path, jobs):
+    raw = tmp_path / "raw"
+    raw.mkdir()
+    (raw / "input.hdf").write_text("raw")
+    output = str(tmp_path / "converted.txt")
+    for run in range(0, 2):
+        scheduler = StepScheduler(str(tmp_path / "steps.json"))
+        scheduler.add_step("Step A", convert_inputs, (str(raw), output), inputs=[str(raw)], outputs=[output])
+        scheduler.add_step("Step B", write_step, (str(tmp_path / "second.txt"),))
+        assert scheduler.run(scheduler.select_steps(), jobs) == {}
+    assert os.listdir(str(raw)) == ["input_h5.hdf"]
+    assert read_runs(tmp_path, "converted.txt") == 1
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_input_that_arrives_during_the_step_is_processed(tmp_path, jobs):
+    raw = tmp_path / "raw"
+    raw.mkdir()
+    (raw / "input.hdf").write_text("raw")
+    output = str(tmp_path / "converted.txt")
+    for run, function in enumerate([receive_input, convert_inputs, convert_inputs]):
+        scheduler = StepScheduler(str(tmp_path / "steps.json"))
+        scheduler.add_step("Step A", function, (str(raw), output), inputs=[str(raw)], outputs=[output])
+        assert scheduler.run(scheduler.select_steps(), jobs) == {}
+    assert sorted(os.listdir(str(raw))) == ["arrived_h5.hdf", "input_h5.hdf"]
+    assert read_runs(tmp_path, "converted.txt") == 2
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from libs.subgrid_calculations import interpolate_cells, interpolate_cells_loop, CHIRPSSubGrid
+
+
+@pytest.mark.parametrize("missing_fraction", [0.0, 0.3, 0.9, 1.0])
+def test_interpolate_cells_matches_loop(missing_fraction):
+    generator = np.random.default_rng(42)
+    raw_data = generator.uniform(0.05, 0.45, (24, 31))
+    raw_data[generator.random(raw_data.shape) < missing_fraction] = -9999.0
+    rows, columns = 44, 58
+
+    result = interpolate_cells(raw_data, rows, columns, np.float32(-9999.0))
+    expected = interpolate_cells_loop(raw_data, rows, columns, np.float32(-9999.0))
+
+    assert result.shape == (rows + 4, columns + 4)
+    assert result.tobytes() == expected.tobytes()
+
+
+def test_interpolate_cells_ignores_missing_weights():
+    raw_data = np.array([[1.0, -9999.0], [-9999.0, -9999.0]])
+    result = interpolate_cells(raw_data, 2, 2)
+    # only the one valid corner contributes, so every phase keeps its value #
+    assert np.all(result[0:2, 0:2] == 1.0)
+    assert np.all(result[2:, :] == -9999.0)
+    assert np.all(result[:, 2:] == -9999.0)
+
+
+def test_chirps_file_is_closed_when_bounds_fail(tmp_path, monkeypatch):
+    rasterio = CHIRPSSubGrid.rasterio
+    file_path = str(tmp_path / "c200101.tif")
+    with rasterio.open(file_path, 'w', driver='GTiff', width=2, height=2, count=1, dtype='float32') as fh:
+        fh.write(np.zeros((1, 2, 2), dtype=np.float32))
+    opened = []
+    open_file = rasterio.open
+    monkeypatch.setattr(rasterio, 'open', lambda *args, **kwargs: opened.append(open_file(*args, **kwargs)) or opened[-1])
+    bounds = {'n_lat': -27.0, 's_lat': -26.0, 'w_lon': 31.0, 'e_lon': 32.0}
+
+    with pytest.raises(ValueError):
+        with CHIRPSSubGrid(bounds, file_path):
+            pass
+
+    assert len(opened) == 1 and opened[0].closed
@@ -0,0 +1,174 @@
+import os
+import imageio.v2 as imageio
+import numpy as np
+import pytest
+import libs.cube_cache as cube_cache
+import libs.hdf_functions as hdf
+import libs.netcdf_functions as netcdf
+from benchmarks import synthetic_inputs as synthetic
+from libs.config_reader import ConfigParser, REGION_VARIABLE
+from libs.region_batch import RegionBatch
+from libs.statistics_operations import StatisticOperations
+from libs.grid_geometry import CHIRPS_GRID
+from libs.spi_calculations import calculate_monthly_spi, calculate_monthly_spi_fast, calculate_period_totals
+from libs.subgrid_calculations import HDFSubGrid, CHIRPSSubGrid, NetCDFSubGrid
+from STEP_0101_read_hdf_create_LST_anom_netcdf import LandSurfaceTemp
+from STEP_0103_read_chirps_create_precip_netcdf_and_spi_netcdf import StandardizedPrecipitationIndex
+
+BOUNDS = synthetic.REGIONS['country']
+YEARS = 3
+
+
+@pytest.fixture(scope='module')
+def archive(tmp_path_factory):
+    root_dir = str(tmp_path_factory.mktemp("synthetic"))
+    files = synthetic.create_archive(root_dir, BOUNDS, 2001, YEARS, ['lst', 'chirps', 'fldas'])
+    return root_dir, files
+
+
+def get_path(archive, product, index=0):
+    root_dir, files = archive
+    directories = {'lst': 'lst_hdf', 'chirps': 'chirps_tif', 'fldas': 'fldas_data'}
+    return os.path.join(root_dir, synthetic.RAW_DATA_DIRS[directories[product]], files[product][index])
+
+
+def test_file_names_match_patterns(archive):
+    root_dir, files = archive
+    assert len(files['lst']) == YEARS * 12
+    assert files['lst'][2] == "MOD21C3.A2001060.061.2021001000000_h5.hdf"
+    assert files['chirps'][0] == "c200101.tif"
+    assert files['fldas'][11] == "FLDAS_NOAH01_C_GL_M.A200112.001.nc"
+
+
+@pytest.mark.parametrize("region", list(synthetic.REGIONS.keys()))
+def test_settings_grid_matches_region(tmp_path, monkeypatch, region):
+    bounds = synthetic.REGIONS[region]
+    monkeypatch.setenv('CDI_CONFIG_DIR', synthetic.write_settings(str(tmp_path), bounds))
+    config = ConfigParser()
+    rows = int(round((bounds['n_lat'] - bounds['s_lat']) * 20)) + 1
+    columns = int(round((bounds['e_lon'] - bounds['w_lon']) * 20)) + 1
+    assert len(config.get('latitudes')) == rows and len(config.get('longitudes')) == columns
+    assert config.get('raw_data_dirs', 'lst_hdf') == os.path.join(str(tmp_path), 'LST')
+
+
+def test_hdf_window_read(archive):
+    file_path = get_path(archive, 'lst')
+    with HDFSubGrid(BOUNDS, file_path, synthetic.HDF_GROUPS['lst']) as sg:
+        sub_grids = sg.create_sub_grids(['LST_Day', 'QC_Day'])
+        rows, columns = slice(sg.first_root_y, sg.last_root_y), slice(sg.first_root_x, sg.last_root_x)
+    data_set = hdf.open_dataset(file_path)
+    full_grid = hdf.extract_data(data_set, synthetic.HDF_GROUPS['lst'], 'LST_Day', -1)
+    data_set.close()
+
+    assert sub_grids['LST_Day'].shape == (44, 44)
+    assert np.array_equal(sub_grids['LST_Day'], full_grid[rows, columns])
+    # land cells hold Kelvin values, water cells 0 #
+    land = sub_grids['LST_Day'] > 0
+    assert 0.5 < np.mean(land) < 1.0
+    assert np.all(sub_grids['LST_Day'][land] * 0.02 > 270.0)
+
+
+def test_chirps_window_read_matches_full_globe(archive):
+    file_path = get_path(archive, 'chirps')
+    with CHIRPSSubGrid(BOUNDS, file_path) as sg:
+        subset = sg.create_sub_grid()
+    rows, columns = CHIRPS_GRID.window(BOUNDS)
+    full_globe = np.array(imageio.imread(file_path))
+
+    assert full_globe.shape == (CHIRPS_GRID.rows, CHIRPS_GRID.columns)
+    assert np.array_equal(subset, full_globe[rows, columns])
+
+
+def test_fldas_interpolation_matches_loop(archive):
+    file_path = get_path(archive, 'fldas')
+    results = {}
+    for vectorized in [True, False]:
+        with NetCDFSubGrid(BOUNDS, file_path, True, vectorized) as sg:
+            results[vectorized] = sg.create_sub_grid('SoilMoi10_40cm_tavg')
+            assert sg.units == 'm^3 m-3'
+
+    assert results[True].shape == (44, 44)
+    assert results[True].tobytes() == results[False].tobytes()
+    valid = results[True] != -9999.0
+    assert np.all((results[True][valid] >= 0.05) & (results[True][valid] <= 0.45))
+
+
+def test_spi_of_chirps_archive(archive):
+    values = []
+    for i in range(0, YEARS * 12):
+        with CHIRPSSubGrid(BOUNDS, get_path(archive, 'chirps', i)) as sg:
+            values.append(sg.create_sub_grid())
+    totals = calculate_period_totals(netcdf.missing_to_nan(values), [3])[3]
+    # the 3 month totals of each calendar month, with the missing totals set to 0 as in STEP_0103 #
+    for month in range(2, 12):
+        precip = [np.where(np.isnan(t), 0.0, t).astype(float) for t in totals[month::12]]
+        expected = np.asarray(calculate_monthly_spi(precip))
+        assert calculate_monthly_spi_fast(precip, dtype=np.float64).tobytes() == expected.tobytes()
+
+
+def test_spi_anomalies_follow_calendar_months(archive, monkeypatch):
+    root_dir, files = archive
+    monkeypatch.setenv('CDI_CONFIG_DIR', synthetic.write_settings(root_dir, BOUNDS, region_name="Gap"))
+    monkeypatch.delenv(REGION_VARIABLE, raising=False)
+    spi = StandardizedPrecipitationIndex()
+    # February 2002 is missing from the series #
+    assert spi.create_chirps_netcdf_files(files['chirps'][:13] + files['chirps'][14:]) == {}
+    spi.create_precip_from_chirps()
+    spi.create_spi_anomaly_file()
+
+    data_set = netcdf.open_dataset(os.path.join(root_dir, 'working_data', 'SPI', "STEP_0103_Precip_Totals_Gap.nc"))
+    totals = netcdf.missing_to_nan(netcdf.extract_values(data_set, 'precip_3_month', -1))
+    data_set.close()
+    data_set = netcdf.open_dataset(os.path.join(root_dir, 'output_data', "STEP_0103_SPI_anomaly_Gap.nc"))
+    anomalies = netcdf.missing_to_nan(netcdf.extract_values(data_set, 'spi_3_anom', -1))
+    data_set.close()
+    months = [(i % 12) + 1 for i in range(0, YEARS * 12) if i != 13]
+    assert anomalies.shape[0] == len(months) and np.all(np.isnan(anomalies[0:2]))
+    # each calendar month is fitted on its own totals only #
+    for month in range(1, 13):
+        indices = [i for i in range(2, len(months)) if months[i] == month]
+        precip = np.where(np.isnan(totals[indices]), np.float32(0.0), totals[indices])
+        expected = StatisticOperations().compute_anomalies_from_values(calculate_monthly_spi_fast(precip))
+        assert np.array_equal(anomalies[indices], expected, equal_nan=True)
+
+
+def test_region_batch_matches_single_regions(archive, monkeypatch):
+    root_dir, files = archive
+    north = {'n_lat': -25.675, 's_lat': -26.475, 'w_lon': 31.025, 'e_lon': 32.025}
+    monkeypatch.setenv('CDI_CONFIG_DIR', synthetic.write_settings(root_dir, BOUNDS, regions={'North': north}))
+    monkeypatch.delenv(REGION_VARIABLE, raising=False)
+    lst = {r: LandSurfaceTemp(r) for r in ['Synthetic', 'North']}
+    missing_file = "MOD21C3.A2009001.061.2021001000000_h5.hdf"
+    first_months = {'Synthetic': 0, 'North': 1}
+    files_to_process = {'Synthetic': files['lst'][0:3], 'North': files['lst'][1:4] + [missing_file]}
+
+    failures = RegionBatch(lst).run(files_to_process)
+
+    assert list(failures.keys()) == ["North: {}".format(missing_file)]
+    for region in lst.keys():
+        with lst[region].open_working_cube() as cube:
+            for i, f in enumerate(files_to_process[region][0:3]):
+                expected = lst[region].process_lst_file(f)['LST_Delta']
+                date = "2001{:02d}".format(first_months[region] + i + 1)
+                assert np.array_equal(cube.read_values('LST_Delta', date), expected, equal_nan=True)
+
+
+def test_lst_anomalies_are_cached(archive, monkeypatch):
+    root_dir, files = archive
+    monkeypatch.setenv('CDI_CONFIG_DIR', synthetic.write_settings(root_dir, BOUNDS, region_name="Cached"))
+    monkeypatch.delenv(REGION_VARIABLE, raising=False)
+    lst = LandSurfaceTemp()
+    assert lst.create_lst_netcdf_files(files['lst']) == {}
+    output_file = os.path.join(root_dir, 'output_data', "STEP_0101_LST_anomaly_Cached.nc")
+    cube_cache.enable()
+    try:
+        # the anomalies are computed, then taken from the file for the unchanged months of an update #
+        for incremental in [False, True]:
+            lst.update_lst_anomaly_file(incremental)
+            data_set = netcdf.open_dataset(output_file)
+            data_set.variables['lst_anom'].set_auto_mask(False)
+            expected = np.array(data_set.variables['lst_anom'][:])
+            data_set.close()
+            assert cube_cache.get(output_file, 'lst_anom').tobytes() == expected.tobytes()
+    finally:
+        cube_cache.disable()
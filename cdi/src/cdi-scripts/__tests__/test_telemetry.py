@@ -0,0 +1,105 @@
+import os
+import time
+import numpy as np
+import pytest
+import libs.parallel_operations as parallel
+import libs.telemetry as telemetry
+
+
+@telemetry.timed('helper')
+def helper(value):
+    telemetry.count_file()
+    return value * 2
+
+
+@telemetry.timed('spin')
+def spin(item):
+    # keeps the CPU busy for 0.05 seconds of the calling thread #
+    start = time.thread_time()
+    while time.thread_time() - start < 0.05:
+        pass
+    telemetry.count_file()
+
+
+def start_run(tmp_path, monkeypatch):
+    monkeypatch.delenv(telemetry.RUN_VARIABLE, raising=False)
+    monkeypatch.delenv(telemetry.FILE_VARIABLE, raising=False)
+    telemetry.start_run(str(tmp_path))
+    # start_run sets the variables directly, restore them at the end of the test #
+    monkeypatch.setenv(telemetry.RUN_VARIABLE, os.environ[telemetry.RUN_VARIABLE])
+    monkeypatch.setenv(telemetry.FILE_VARIABLE, os.environ[telemetry.FILE_VARIABLE])
+    return os.environ[telemetry.FILE_VARIABLE]
+
+
+def test_step_record(tmp_path, monkeypatch):
+    file_path = start_run(tmp_path, monkeypatch)
+    with telemetry.StepTelemetry('Step 0101'):
+        assert helper(2) == 4
+        helper(3)
+
+    records = telemetry.read_run(file_path)
+    record = records['Step 0101']
+    assert record['status'] == 'ok'
+    assert record['files_opened'] == 2
+    assert record['operations']['helper']['calls'] == 2
+    assert record['wall_seconds'] >= 0.0
+
+
+def test_peak_memory_of_each_step(tmp_path, monkeypatch):
+    if not os.access('/proc/self/clear_refs', os.W_OK):
+        pytest.skip("the peak resident memory can not be reset")
+    file_path = start_run(tmp_path, monkeypatch)
+    with telemetry.StepTelemetry('Step 0103'):
+        values = np.ones(200 * 1024 * 1024 // 8)
+        del values
+    with telemetry.StepTelemetry('Step 0203'):
+        helper(1)
+
+    records = telemetry.read_run(file_path)
+    assert records['Step 0203']['peak_rss_scope'] == 'step'
+    # the step after the heavier step does not report the earlier peak #
+    assert records['Step 0103']['peak_rss_mb'] - records['Step 0203']['peak_rss_mb'] > 150.0
+
+
+def test_operations_of_worker_threads(tmp_path, monkeypatch):
+    file_path = start_run(tmp_path, monkeypatch)
+    with telemetry.StepTelemetry('Step 0303'):
+        # as the GeoTIFF export of STEP_0303 #
+        assert parallel.run_tasks(spin, list(range(0, 40)), 4, use_threads=True) == {}
+
+    record = telemetry.read_run(file_path)['Step 0303']
+    assert record['files_opened'] == 40
+    assert record['operations']['spin']['calls'] == 40
+    # each call measures the CPU time of its own thread, not that of the other threads #
+    assert 2.0 <= record['operations']['spin']['cpu_seconds'] <= record['cpu_seconds'] + 0.1
+
+
+def test_failed_step_record(tmp_path, monkeypatch):
+    file_path = start_run(tmp_path, monkeypatch)
+    try:
+        with telemetry.StepTelemetry('Step 0102'):
+            raise ValueError("failed")
+    except ValueError:
+        pass
+    assert telemetry.read_run(file_path)['Step 0102']['status'] == 'failed'
+
+
+def test_disabled_without_run(tmp_path, monkeypatch):
+    monkeypatch.delenv(telemetry.FILE_VARIABLE, raising=False)
+    with telemetry.StepTelemetry('Step 0101'):
+        assert helper(1) == 2
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_format_comparison():
+    first = {'Step 0101': {'wall_seconds': 10.0, 'cpu_seconds': 8.0, 'peak_rss_mb': 100.0, 'read_bytes': None,
+                           'written_bytes': 0, 'operations': {'helper': {'calls': 1, 'wall_seconds': 4.0, 'cpu_seconds': 4.0}}}}
+    second = {'Step 0101': {'wall_seconds': 5.0, 'cpu_seconds': 8.0, 'peak_rss_mb': 150.0, 'read_bytes': None,
+                            'written_bytes': 0, 'operations': {}},
+              'Step 0102': {'wall_seconds': 1.0}}
+    lines = telemetry.format_comparison(first, second)
+    assert len(lines) == 4
+    assert "10.0 / 5.0 (-50%)" in lines[1]
+    assert "100.0 / 150.0 (+50%)" in lines[1]
+    assert "helper (1 / 0 calls)" in lines[2]
+    assert lines[3].startswith("Step 0102")
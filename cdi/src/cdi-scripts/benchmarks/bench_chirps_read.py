@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import time
+from argparse import ArgumentParser
+import numpy as np
+import imageio.v2 as imageio
+import rasterio
+from rasterio.transform import Affine
+from rasterio.windows import Window
+from libs.config_reader import ConfigParser
+from libs.subgrid_calculations import CHIRPSSubGrid
+
+"""
+Benchmark of the CHIRPS GeoTIFF subsetting: full-globe decode (imageio) vs. windowed read (rasterio)
+The synthetic files have the layout of the global CHIRPS monthly TIFFs: 7200x2000 float32 strips at 0.05 degree
+Run from the cdi-scripts directory:
+    python -m benchmarks.bench_chirps_read --years 40
+"""
+
+
+def create_chirps_file(file_path, seed=0):
+    """
+    This function writes a synthetic global CHIRPS monthly GeoTIFF
+    Args:
+        file_path (str): fully-qualified path/name of the TIF file to create
+        seed (int): seed of the random generator
+    """
+    generator = np.random.default_rng(seed)
+    data = generator.gamma(2.0, 40.0, (2000, 7200)).astype(np.float32)
+    data[generator.random(data.shape) < 0.3] = -9999.0  # oceans
+    transform = Affine.translation(-180.0, 50.0) * Affine.scale(0.05, -0.05)
+    with rasterio.open(file_path, 'w', driver='GTiff', width=7200, height=2000, count=1, dtype=rasterio.float32,
+                       crs='+proj=latlong', transform=transform, nodata=-9999.0) as output:
+        output.write(data, 1)
+
+
+def read_full_globe(file_path, first_y, last_y, first_x, last_x):
+    """
+    This function is the previous CHIRPSSubGrid read: decode the full globe, copy it, then slice the subset
+    """
+    data = np.array(imageio.imread(file_path))
+    return data[first_y: last_y, first_x: last_x]
+
+
+def read_window(file_path, first_y, last_y, first_x, last_x):
+    """
+    This function decodes only the window of the TIF intersecting the subset
+    """
+    with rasterio.open(file_path) as data_set:
+        return data_set.read(1, window=Window.from_slices((first_y, last_y), (first_x, last_x)))
+
+
+def read_sub_grid(file_path, bounds):
+    """
+    This function is the current CHIRPSSubGrid read: index resolution plus the windowed decode
+    """
+    with CHIRPSSubGrid(bounds, file_path) as sg:
+        return sg.create_sub_grid(), (sg.first_root_y, sg.last_root_y, sg.first_root_x, sg.last_root_x)
+
+
+def time_reads(function, files, months, *args):
+    """
+    This function times the monthly reads of a rebuild
+    Returns:
+        the elapsed time in seconds and the result of the last read
+    """
+    result = None
+    start_time = time.perf_counter()
+    for m in range(0, months):
+        result = function(files[m % len(files)], *args)
+    return time.perf_counter() - start_time, result
+
+
+def main(args):
+    """
+    This is the main entry point for the program
+    """
+    bounds = ConfigParser().get('bounds')
+    months = args.years * 12
+    scratch_dir = tempfile.mkdtemp(prefix='bench_chirps_')
+    try:
+        # create the synthetic files: the same files are reused when there are fewer files than months #
+        files = []
+        for i in range(0, args.files):
+            file_path = os.path.join(scratch_dir, 'c{}{:02d}.tif'.format(1981 + i // 12, i % 12 + 1))
+            create_chirps_file(file_path, i)
+            files.append(file_path)
+        print("Reading {} months ({} synthetic files) for bounds {}".format(months, len(files), bounds))
+
+        sub_grid_time, (sub_grid, indices) = time_reads(read_sub_grid, files, months, bounds)
+        window_time, window_subset = time_reads(read_window, files, months, *indices)
+        full_time, full_subset = time_reads(read_full_globe, files, months, *indices)
+
+        print("full globe decode:       {:.2f} seconds ({:.4f} per month)".format(full_time, full_time / months))
+        print("windowed decode:         {:.2f} seconds ({:.4f} per month)".format(window_time, window_time / months))
+        print("CHIRPSSubGrid (total):   {:.2f} seconds ({:.4f} per month)".format(sub_grid_time, sub_grid_time / months))
+        print("decode speedup: {:.1f}x, SubGrid speedup: {:.1f}x, identical subsets: {}".format(
+            full_time / window_time, full_time / sub_grid_time,
+            np.array_equal(full_subset, window_subset) and np.array_equal(full_subset, sub_grid)))
+    finally:
+        shutil.rmtree(scratch_dir)
+
+
+if __name__ == '__main__':
+    # set up the command line argument parser
+    parser = ArgumentParser()
+    parser.add_argument("-y", "--years", type=int, default=40,
+                        help="Number of years of monthly files to read (the length of a full rebuild). Default is 40")
+    parser.add_argument("-f", "--files", type=int, default=2,
+                        help="Number of distinct synthetic files to write (57 MB each). Default is 2")
+    # execute the benchmark with the supplied options
+    main(parser.parse_args())
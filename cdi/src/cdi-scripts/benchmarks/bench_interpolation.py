@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import time
+from argparse import ArgumentParser
+import numpy as np
+from libs.subgrid_calculations import interpolate_cells, interpolate_cells_loop
+
+"""
+Benchmark of the masked bilinear interpolation used by NetCDFSubGrid (0.1 degree -> 0.05 degree)
+Run from the cdi-scripts directory:
+    python -m benchmarks.bench_interpolation
+"""
+
+# bounding boxes to benchmark: name -> (latitude span, longitude span) in degrees #
+BOXES = {
+    "country": (2.15, 2.15),  # Eswatini sized area
+    "region": (15.0, 15.0),
+    "continent": (75.0, 75.0)  # Africa sized area
+}
+
+
+def create_raw_data(lat_span, lon_span, missing_fraction, seed=0):
+    """
+    This function creates a synthetic 0.1 degree grid covering the requested area
+    Args:
+        lat_span (float): latitude span of the area in degrees
+        lon_span (float): longitude span of the area in degrees
+        missing_fraction (float): fraction (0.0 - 1.0) of the cells to set as missing (-9999.0)
+        seed (int): seed of the random generator
+
+    Returns:
+        2D numpy array of floats, the number of SubGrid rows and the number of SubGrid columns
+    """
+    rows = int(round(lat_span * 20, 0)) + 1
+    columns = int(round(lon_span * 20, 0)) + 1
+    generator = np.random.default_rng(seed)
+    raw_data = generator.uniform(0.05, 0.45, (rows // 2 + 2, columns // 2 + 2))
+    raw_data[generator.random(raw_data.shape) < missing_fraction] = -9999.0
+    return raw_data, rows, columns
+
+
+def time_function(function, repeat, *args):
+    """
+    This function returns the best wall-clock time of a number of calls
+    Args:
+        function: the function to time
+        repeat (int): the number of calls
+        *args: arguments for the function
+
+    Returns:
+        the best time in seconds and the result of the last call
+    """
+    best = None
+    result = None
+    for r in range(0, repeat):
+        start_time = time.perf_counter()
+        result = function(*args)
+        elapsed_time = time.perf_counter() - start_time
+        if best is None or elapsed_time < best:
+            best = elapsed_time
+    return best, result
+
+
+def main(args):
+    """
+    This is the main entry point for the program
+    """
+    boxes = args.boxes.split(',')
+    print("{:<10} {:>12} {:>12} {:>12} {:>9} {:>10}".format("box", "raw cells", "loop (s)", "vector (s)", "speedup", "identical"))
+    for name in boxes:
+        lat_span, lon_span = BOXES[name]
+        raw_data, rows, columns = create_raw_data(lat_span, lon_span, args.missing)
+        vector_time, vector_result = time_function(interpolate_cells, args.repeat, raw_data, rows, columns)
+        if args.skip_loop:
+            print("{:<10} {:>12} {:>12} {:>12.4f} {:>9} {:>10}".format(name, raw_data.size, "-", vector_time, "-", "-"))
+            continue
+        loop_time, loop_result = time_function(interpolate_cells_loop, 1, raw_data, rows, columns)
+        identical = vector_result.tobytes() == loop_result.tobytes()
+        print("{:<10} {:>12} {:>12.4f} {:>12.4f} {:>8.1f}x {:>10}".format(
+            name, raw_data.size, loop_time, vector_time, loop_time / vector_time, str(identical)))
+
+
+if __name__ == '__main__':
+    # set up the command line argument parser
+    parser = ArgumentParser()
+    parser.add_argument("-b", "--boxes", default="country,region,continent",
+                        help="Comma separated list of the boxes to benchmark: {}".format(', '.join(BOXES.keys())))
+    parser.add_argument("-r", "--repeat", type=int, default=5,
+                        help="Number of calls of the vectorized engine; the best time is reported. Default is 5")
+    parser.add_argument("--missing", type=float, default=0.2,
+                        help="Fraction of missing cells in the synthetic data. Default is 0.2")
+    parser.add_argument("--skip-loop", action="store_true",
+                        help="Only time the vectorized engine (the loop takes minutes on continent-sized boxes)")
+    # execute the benchmark with the supplied options
+    main(parser.parse_args())
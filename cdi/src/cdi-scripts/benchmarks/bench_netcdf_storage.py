@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import time
+from argparse import ArgumentParser
+import numpy as np
+import libs.netcdf_functions as netcdf
+
+"""
+Benchmark of the NetCDF storage profiles (netcdf_storage setting) on anomaly-like and rank-like files
+    write: one time step per write, as the anomaly and ranking steps create their outputs
+    read step: one full map per read, as STEP_0301 and STEP_0303 read their inputs
+    read month: the strided series of one calendar month ([month::12]), as the ranking steps read their inputs
+Run from the cdi-scripts directory:
+    python -m benchmarks.bench_netcdf_storage --years 40 --size 200
+"""
+
+
+def create_values(kind, times, rows, columns, seed=0):
+    """
+    This function creates synthetic values for a file
+    Args:
+        kind (str): anomaly (continuous floats) or rank (percent ranks rounded to 3 decimals)
+        times (int): number of time steps
+        rows (int): number of latitudes
+        columns (int): number of longitudes
+        seed (int): seed of the random generator
+
+    Returns:
+        3D numpy array of float32 values
+    """
+    generator = np.random.default_rng(seed)
+    if kind == 'anomaly':
+        # smooth field plus noise, like a temperature anomaly #
+        field = np.cumsum(generator.normal(0.0, 0.05, (rows, columns)), axis=1)
+        values = (field + generator.normal(0.0, 1.5, (times, 1, 1)) + generator.normal(0.0, 0.3, (times, rows, columns)))
+    else:
+        values = np.round(generator.integers(1, 42, (times, rows, columns)) / 42.0, 3)
+    values = values.astype(np.float32)
+    # oceans and other missing areas #
+    values[:, : rows // 5, : columns // 3] = -9999.0
+    return values
+
+
+def write_file(file_path, values, storage):
+    """
+    This function writes the values one time step at a time
+    """
+    times, rows, columns = values.shape
+    out_properties = {
+        'latitudes': [round(-20.0 - 0.05 * j, 3) for j in range(0, rows)],
+        'longitudes': [round(20.0 + 0.05 * i, 3) for i in range(0, columns)],
+        'times': list(range(0, times)),
+        'time_units': 'days since 1900-01-01 00:00:00'
+    }
+    output_data_set = netcdf.initialize_dataset(file_path, out_properties)
+    variable = netcdf.create_variable(output_data_set, 'values', storage)
+    variable.missing_value = -9999.0
+    for t in range(0, times):
+        variable[t] = values[t]
+    output_data_set.close()
+
+
+def read_steps(file_path):
+    """
+    This function reads every time step as a full map
+    """
+    data_set = netcdf.open_dataset(file_path)
+    total = 0.0
+    for t in range(0, data_set.variables['values'].shape[0]):
+        total += float(np.array(data_set.variables['values'][t]).sum())
+    data_set.close()
+    return total
+
+
+def read_months(file_path):
+    """
+    This function reads the series of each calendar month
+    """
+    data_set = netcdf.open_dataset(file_path)
+    total = 0.0
+    for month in range(0, 12):
+        total += float(np.array(data_set.variables['values'][month::12]).sum())
+    data_set.close()
+    return total
+
+
+def timed(function, *args):
+    """
+    This function returns the wall-clock time of a call
+    """
+    start_time = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start_time
+
+
+def main(args):
+    """
+    This is the main entry point for the program
+    """
+    times = args.years * 12
+    scratch_dir = tempfile.mkdtemp(prefix='bench_netcdf_')
+    try:
+        print("{} time steps of {}x{} cells".format(times, args.size, args.size))
+        print("{:<8} {:<12} {:>10} {:>10} {:>12} {:>12} {:>12}".format(
+            "file", "profile", "size (MB)", "ratio", "write (s)", "step (s)", "month (s)"))
+        for kind in ['anomaly', 'rank']:
+            values = create_values(kind, times, args.size, args.size)
+            raw_size = values.nbytes / 1048576.0
+            for profile in args.profiles.split(','):
+                storage = {'profile': profile, 'complevel': args.complevel, 'shuffle': not args.no_shuffle}
+                file_path = os.path.join(scratch_dir, '{}_{}.nc'.format(kind, profile))
+                write_time = timed(write_file, file_path, values, storage)
+                size = os.path.getsize(file_path) / 1048576.0
+                step_time = timed(read_steps, file_path)
+                month_time = timed(read_months, file_path)
+                print("{:<8} {:<12} {:>10.1f} {:>9.2f}x {:>12.3f} {:>12.3f} {:>12.3f}".format(
+                    kind, profile, size, raw_size / size, write_time, step_time, month_time))
+                os.remove(file_path)
+    finally:
+        shutil.rmtree(scratch_dir)
+
+
+if __name__ == '__main__':
+    # set up the command line argument parser
+    parser = ArgumentParser()
+    parser.add_argument("-y", "--years", type=int, default=40,
+                        help="Number of years of monthly time steps. Default is 40")
+    parser.add_argument("-s", "--size", type=int, default=200,
+                        help="Number of latitudes and longitudes of the area. Default is 200")
+    parser.add_argument("-p", "--profiles", default=','.join(netcdf.STORAGE_PROFILES),
+                        help="Comma separated list of the storage profiles to benchmark: {}".format(', '.join(netcdf.STORAGE_PROFILES)))
+    parser.add_argument("-c", "--complevel", type=int, default=4,
+                        help="zlib compression level of the compressed profiles. Default is 4")
+    parser.add_argument("--no-shuffle", action="store_true",
+                        help="Disable the shuffle filter of the compressed profiles")
+    # execute the benchmark with the supplied options
+    main(parser.parse_args())
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+import glob
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+import benchmarks.synthetic_inputs as synthetic
+from libs.telemetry import read_run
+
+"""
+Benchmark of the processing steps on synthetic raw inputs (see benchmarks.synthetic_inputs)
+    staged: each STEP script is executed on its own, in the order of STEP_0000, as a separate process
+    STEP_0000: the full flow, with its telemetry records (see libs.telemetry) for the time spent in each step
+The wall time and the peak resident memory of every process (including its worker processes) are reported
+Run from the cdi-scripts directory:
+    python -m benchmarks.bench_pipeline --region region --years 10 --workers 4
+"""
+
+# steps of the benchmark: step -> (script, has a --mode option, has a --workers option) #
+STEPS = {
+    '0101': ('STEP_0101_read_hdf_create_LST_anom_netcdf.py', True, True),
+    '0102': ('STEP_0102_read_hdf_create_NDVI_anom_netcdf.py', True, True),
+    '0103': ('STEP_0103_read_chirps_create_precip_netcdf_and_spi_netcdf.py', True, True),
+    '0104': ('STEP_0104_create_5km_soil_moisture_netcdf.py', True, True),
+    '0201': ('STEP_0201_percent_rank_LST_anom_netcdf.py', False, True),
+    '0202': ('STEP_0202_percent_rank_NDVI_anom_netcdf.py', False, True),
+    '0203': ('STEP_0203_percent_rank_SPI_anom.py', False, True),
+    '0204': ('STEP_0204_percent_rank_soil_moisture_netcdf.py', False, True),
+    '0301': ('STEP_0301_CDI_weighted_sum.py', False, False),
+    '0302': ('STEP_0302_percent_rank_CDI_weighted_sum.py', False, True),
+    '0303': ('STEP_0303_export_ranking_data_rasters.py', True, True)
+}
+# launcher of the scripts: a process inherits the peak memory of the process it was forked from, so the scripts are
+# started from this small process, which writes their peak memory (and that of their worker processes) to a file #
+LAUNCHER = (
+    "import resource, subprocess, sys\n"
+    "code = subprocess.call([sys.executable] + sys.argv[2:])\n"
+    "with open(sys.argv[1], 'w') as fh:\n"
+    "    fh.write(str(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss))\n"
+    "sys.exit(code)\n"
+)
+
+
+def run_script(root_dir, name, arguments):
+    """
+    This function executes a script of the cdi-scripts on the settings of a synthetic run
+        The output of the script is written to <root>/logs/<name>.log
+    Args:
+        root_dir (str): directory of the synthetic run (the CDI_CONFIG_DIR of the script)
+        name (str): name of the run of the script, for the log file
+        arguments (list of str): the script and its options
+
+    Returns:
+        the wall time in seconds and the peak resident memory in MB of the process and its worker processes
+    """
+    scripts_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    environment = dict(os.environ, CDI_CONFIG_DIR=root_dir, CDI_LOG_DIR=os.path.join(root_dir, 'logs'), PYTHONPATH=scripts_dir)
+    log_path = os.path.join(root_dir, 'logs', "{}.log".format(name))
+    memory_path = os.path.join(root_dir, 'logs', "{}.maxrss".format(name))
+    with open(log_path, 'w') as log:
+        start_time = time.perf_counter()
+        code = subprocess.call([sys.executable, '-c', LAUNCHER, memory_path] + arguments, cwd=scripts_dir,
+                               env=environment, stdout=log, stderr=subprocess.STDOUT)
+        elapsed_time = time.perf_counter() - start_time
+    if code != 0:
+        with open(log_path, 'r') as log:
+            print(''.join(log.readlines()[-20:]))
+        raise RuntimeError("{} failed with exit code {}, see '{}'".format(name, code, log_path))
+    with open(memory_path, 'r') as fh:
+        return elapsed_time, int(fh.read()) / 1024.0
+
+
+def run_steps(root_dir, steps, workers):
+    """
+    This function executes the STEP scripts one after the other, in 'all' mode
+    Returns:
+        List of the results: dictionaries of step, wall_seconds and peak_rss_mb
+    """
+    results = []
+    for step in steps:
+        script, has_mode, has_workers = STEPS[step]
+        arguments = [script] + (['-m', 'all'] if has_mode else []) + (['-w', str(workers)] if has_workers else [])
+        elapsed_time, peak_rss = run_script(root_dir, "STEP_{}".format(step), arguments)
+        results.append({'step': step, 'wall_seconds': round(elapsed_time, 3), 'peak_rss_mb': round(peak_rss, 1)})
+        print("STEP_{}  {:>10.2f} {:>10.1f}".format(step, elapsed_time, peak_rss))
+    return results
+
+
+def run_all_steps(root_dir, workers, jobs, fused):
+    """
+    This function executes STEP_0000 in 'all' mode and reads the telemetry records of its steps
+    Returns:
+        dictionary of the result: wall_seconds, peak_rss_mb, and the telemetry records of the steps
+    """
+    arguments = ['STEP_0000_execute_all_steps.py', '-m', 'all', '-w', str(workers), '-j', str(jobs)] + (['--fused'] if fused else [])
+    elapsed_time, peak_rss = run_script(root_dir, "STEP_0000", arguments)
+    telemetry_files = sorted(glob.glob(os.path.join(root_dir, 'logs', "telemetry_*.jsonl")))
+    records = read_run(telemetry_files[-1]) if len(telemetry_files) > 0 else {}
+    print("{:<34} {:>10} {:>10} {:>10} {:>12}".format("STEP_0000 step", "wall s", "cpu s", "peak MB", "files opened"))
+    for name, record in records.items():
+        print("{:<34} {:>10.2f} {:>10.2f} {:>10.1f} {:>12}".format(
+            name, record['wall_seconds'], record['cpu_seconds'], record['peak_rss_mb'], record['files_opened']))
+    print("{:<34} {:>10.2f} {:>10} {:>10.1f}".format("STEP_0000 total", elapsed_time, "", peak_rss))
+    return {'wall_seconds': round(elapsed_time, 3), 'peak_rss_mb': round(peak_rss, 1), 'steps': records}
+
+
+def main(args):
+    """
+    This is the main entry point for the program
+    """
+    bounds = synthetic.get_bounds(args)
+    steps = args.steps.split(',')
+    root_dir = args.root if args.root is not None else tempfile.mkdtemp(prefix='bench_pipeline_')
+    try:
+        os.makedirs(os.path.join(root_dir, 'logs'), exist_ok=True)
+        # create the synthetic inputs #
+        start_time = time.perf_counter()
+        synthetic.create_archive(root_dir, bounds, args.first_year, args.years)
+        synthetic.write_settings(root_dir, bounds)
+        print("Synthetic inputs: {} years for bounds {}, written in {:.1f} seconds to '{}'".format(
+            args.years, bounds, time.perf_counter() - start_time, root_dir))
+
+        results = {'bounds': bounds, 'years': args.years, 'workers': args.workers}
+        if len(steps) > 0 and steps[0] != '':
+            print("{:<10} {:>10} {:>10}".format("staged", "wall s", "peak MB"))
+            results['staged'] = run_steps(root_dir, steps, args.workers)
+        if not args.skip_all:
+            results['STEP_0000'] = run_all_steps(root_dir, args.workers, args.jobs, args.fused)
+        if args.json is not None:
+            with open(args.json, 'w') as fh:
+                fh.write(json.dumps(results, indent=4))
+    finally:
+        if args.root is None:
+            shutil.rmtree(root_dir)
+
+
+if __name__ == '__main__':
+    # set up the command line argument parser
+    parser = ArgumentParser()
+    parser.add_argument("-r", "--region", default="country", choices=list(synthetic.REGIONS.keys()),
+                        help="Size of the region: {}. Default is country".format(', '.join(synthetic.REGIONS.keys())))
+    parser.add_argument("--bounds", type=float, nargs=4, metavar=("N_LAT", "S_LAT", "W_LON", "E_LON"),
+                        help="Bounds of the region on the 0.05 degree grid, instead of --region")
+    parser.add_argument("-y", "--years", type=int, default=5,
+                        help="Number of years of the synthetic archive. Default is 5")
+    parser.add_argument("--first-year", type=int, default=2001,
+                        help="First year of the synthetic archive. Default is 2001")
+    parser.add_argument("-s", "--steps", default=','.join(STEPS.keys()),
+                        help="Comma separated list of the steps to execute one by one (empty for none). Default is all: {}".format(
+                            ','.join(STEPS.keys())))
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="Number of worker processes of the steps. Default is 1")
+    parser.add_argument("-j", "--jobs", type=int, default=3,
+                        help="Number of steps STEP_0000 executes concurrently. Default is 3")
+    parser.add_argument("--fused", action="store_true",
+                        help="Execute STEP_0000 in its fused mode")
+    parser.add_argument("--skip-all", action="store_true",
+                        help="Do not execute STEP_0000 after the steps")
+    parser.add_argument("--root",
+                        help="Directory of the synthetic run, which is kept. Default is a temporary directory that is removed")
+    parser.add_argument("--json",
+                        help="File to write the results to, as JSON")
+    # execute the benchmark with the supplied options
+    main(parser.parse_args())
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+from argparse import ArgumentParser
+from datetime import date
+import h5py
+import netCDF4
+import numpy as np
+import rasterio
+from rasterio.transform import Affine
+from libs.grid_geometry import GridGeometry, MODIS_CMG_GRID, CHIRPS_GRID
+
+"""
+Synthetic raw inputs of the CDI scripts, in the layout of the downloaded files:
+    LST:    MOD21C3 CMG files (HDF5 version written by h4toh5convert), group MODIS_MONTHLY_CMG_LST
+    NDVI:   MOD13C2 CMG files (HDF5 version written by h4toh5convert), group MOD_Grid_monthly_CMG_VI
+    CHIRPS: global monthly GeoTIFFs, 7200x2000 float32 strips at 0.05 degree
+    FLDAS:  global monthly NetCDF files of the NOAH 0.1 degree model, south to north
+The files cover the full global grids, but only the area around the region holds values: the rest is the fill value
+    of the product, so the files stay small and are quick to write while the steps read them as they read the real files
+The values are a seasonal cycle plus a year/month anomaly and noise, with missing cells (water) at fixed places,
+    so the anomalies and ranks of the steps vary like those of real data
+Run from the cdi-scripts directory:
+    python -m benchmarks.synthetic_inputs --region country --years 5 --output /tmp/cdi_synthetic
+"""
+
+# regions of the benchmarks: name -> bounds on the 0.05 degree grid of the CDI #
+REGIONS = {
+    "country": {'n_lat': -25.675, 's_lat': -27.825, 'w_lon': 30.675, 'e_lon': 32.825},  # Eswatini, 44x44 cells
+    "region": {'n_lat': -15.025, 's_lat': -29.975, 'w_lon': 20.025, 'e_lon': 34.975},  # southern Africa, 300x300 cells
+    "continent": {'n_lat': 37.475, 's_lat': -34.975, 'w_lon': -17.975, 'e_lon': 51.475}  # Africa, 1450x1390 cells
+}
+PRODUCTS = ['lst', 'ndvi', 'chirps', 'fldas']
+# global 0.1 degree FLDAS NOAH grid (south to north) #
+FLDAS_GRID = GridGeometry(-59.95, -179.95, 0.1, 0.1, 1500, 3600)
+FLDAS_LAYERS = ['SoilMoi00_10cm_tavg', 'SoilMoi10_40cm_tavg', 'SoilMoi40_100cm_tavg', 'SoilMoi100_200cm_tavg']
+# settings of the synthetic runs, the raw data directories are relative to the root directory of the run #
+RAW_DATA_DIRS = {'lst_hdf': 'LST', 'ndvi_hdf': 'NDVI', 'chirps_tif': 'CHIRPS', 'fldas_data': 'SM'}
+HDF_GROUPS = {'lst': 'MODIS_MONTHLY_CMG_LST', 'ndvi': 'MOD_Grid_monthly_CMG_VI'}
+
+
+def get_month_dates(first_year, years):
+    """
+    This function lists the months of an archive
+    Args:
+        first_year (int): first year of the archive
+        years (int): number of years of the archive
+
+    Returns:
+        List of (year, month) tuples
+    """
+    return [(y, m) for y in range(first_year, first_year + years) for m in range(1, 13)]
+
+
+def get_window(grid, bounds, margin):
+    """
+    This function computes the rows and columns of a grid covering the bounds of a region plus a margin,
+        clipped to the grid
+    Args:
+        grid (GridGeometry): the grid of the product
+        bounds (dictionary): n_lat, s_lat, w_lon, e_lon of the region
+        margin (float): margin around the region in degrees
+
+    Returns:
+        a slice of the rows, a slice of the columns, and 1D arrays of the latitudes and longitudes of the window
+    """
+    def index_range(low, high, first, step, count):
+        first_index, last_index = sorted([(low - first) / step, (high - first) / step])
+        return slice(max(0, int(np.floor(first_index))), min(count, int(np.ceil(last_index)) + 1))
+
+    rows = index_range(bounds['s_lat'] - margin, bounds['n_lat'] + margin, grid.first_lat, grid.lat_step, grid.rows)
+    columns = index_range(bounds['w_lon'] - margin, bounds['e_lon'] + margin, grid.first_lon, grid.lon_step, grid.columns)
+    latitudes = grid.first_lat + np.arange(rows.start, rows.stop) * grid.lat_step
+    longitudes = grid.first_lon + np.arange(columns.start, columns.stop) * grid.lon_step
+    return rows, columns, latitudes, longitudes
+
+
+def create_values(latitudes, longitudes, year, month, seed, low, high):
+    """
+    This function computes the synthetic values of a month on a window of a grid
+        The values only depend on the coordinates, so the products on different grids describe the same landscape
+    Args:
+        latitudes (1D numpy array): latitudes of the rows
+        longitudes (1D numpy array): longitudes of the columns
+        year (int): year of the values
+        month (int): month of the values (1 - 12)
+        seed (int): seed of the product, for its year/month anomalies and noise
+        low (float): lowest value of the product
+        high (float): highest value of the product
+
+    Returns:
+        2D numpy array of the values between low and high, and 2D boolean array of the water (missing) cells
+    """
+    lat = latitudes[:, np.newaxis]
+    lon = longitudes[np.newaxis, :]
+    generator = np.random.default_rng([seed, year, month])
+    # seasonal cycle shifted by the latitude, and a spatial pattern of the anomaly #
+    season = np.sin(2.0 * np.pi * (month - 1) / 12.0 + np.radians(lat) * 4.0)
+    pattern = 0.5 + 0.5 * np.sin(lat * 0.7 + seed) * np.cos(lon * 0.9)
+    anomaly = generator.normal(0.0, 1.0) * pattern
+    noise = generator.normal(0.0, 0.3, (len(latitudes), len(longitudes)))
+    values = 0.5 + 0.2 * season + 0.15 * anomaly + 0.05 * noise
+    water = np.sin(lat * 3.1) * np.cos(lon * 2.3) > 0.9
+    return low + np.clip(values, 0.0, 1.0) * (high - low), water
+
+
+def get_day_of_year(year, month):
+    """
+    This function returns the day of the year of the first day of a month, as in the MODIS file names
+    """
+    return date(year, month, 1).timetuple().tm_yday
+
+
+def write_cmg_file(file_path, group, parameters):
+    """
+    This function writes a HDF5 CMG file: global 3600x7200 datasets in <group>/Data Fields
+        The datasets are chunked and compressed, and only the chunks of the window are written
+    Args:
+        file_path (str): fully-qualified path/name of the HDF file to create
+        group (str): name of the HDF group of the product
+        parameters (dictionary): parameter name -> (dtype, fill value, rows slice, columns slice, 2D numpy array)
+    """
+    with h5py.File(file_path, 'w') as data_set:
+        fields = data_set.create_group(group).create_group('Data Fields')
+        for name, (dtype, fill_value, rows, columns, values) in parameters.items():
+            variable = fields.create_dataset(name, (MODIS_CMG_GRID.rows, MODIS_CMG_GRID.columns), dtype=dtype,
+                                             chunks=(120, 240), compression='gzip', fillvalue=fill_value)
+            variable[rows, columns] = values
+
+
+def create_lst_file(directory, year, month, bounds, margin=0.5):
+    """
+    This function writes a synthetic MOD21C3 file: LST_Day/LST_Night (K / 0.02) and QC_Day/QC_Night
+        Water cells have no LST (0), about 5% of the land cells fail the QC filter of STEP_0101 (QC < 16)
+    Returns:
+        String of the name of the file
+    """
+    rows, columns, latitudes, longitudes = get_window(MODIS_CMG_GRID, bounds, margin)
+    night, water = create_values(latitudes, longitudes, year, month, 1, 270.0, 295.0)
+    delta, water = create_values(latitudes, longitudes, year, month, 2, 2.0, 25.0)
+    day = night + delta
+    qc = np.where(np.random.default_rng([3, year, month]).random(night.shape) < 0.05, 1, 17).astype(np.uint8)
+    file_name = "MOD21C3.A{}{:03d}.061.2021001000000_h5.hdf".format(year, get_day_of_year(year, month))
+    write_cmg_file(os.path.join(directory, file_name), HDF_GROUPS['lst'], {
+        'LST_Day': ('u2', 0, rows, columns, np.where(water, 0, np.round(day / 0.02)).astype(np.uint16)),
+        'LST_Night': ('u2', 0, rows, columns, np.where(water, 0, np.round(night / 0.02)).astype(np.uint16)),
+        'QC_Day': ('u1', 0, rows, columns, qc),
+        'QC_Night': ('u1', 0, rows, columns, qc)
+    })
+    return file_name
+
+
+def create_ndvi_file(directory, year, month, bounds, margin=0.5):
+    """
+    This function writes a synthetic MOD13C2 file: NDVI (/ 0.0001) and the VI quality
+        Water cells have the NDVI fill value (-3000), about 5% of the land cells fail the quality filter of STEP_0102
+    Returns:
+        String of the name of the file
+    """
+    rows, columns, latitudes, longitudes = get_window(MODIS_CMG_GRID, bounds, margin)
+    ndvi, water = create_values(latitudes, longitudes, year, month, 4, 0.05, 0.85)
+    quality = np.where(np.random.default_rng([5, year, month]).random(ndvi.shape) < 0.05, 18000, 12000).astype(np.uint16)
+    file_name = "MOD13C2.A{}{:03d}.061.2021001000000_h5.hdf".format(year, get_day_of_year(year, month))
+    write_cmg_file(os.path.join(directory, file_name), HDF_GROUPS['ndvi'], {
+        'CMG 0.05 Deg Monthly NDVI': ('i2', -3000, rows, columns, np.where(water, -3000, np.round(ndvi / 0.0001)).astype(np.int16)),
+        'CMG 0.05 Deg Monthly VI Quality': ('u2', 0, rows, columns, quality)
+    })
+    return file_name
+
+
+def create_chirps_file(directory, year, month, bounds, margin=0.5):
+    """
+    This function writes a synthetic global CHIRPS GeoTIFF (mm of precipitation, -9999 outside the window and over water)
+        The file has the strip layout of the downloaded files, compressed so the constant fill stays small
+    Returns:
+        String of the name of the file
+    """
+    rows, columns, latitudes, longitudes = get_window(CHIRPS_GRID, bounds, margin)
+    precipitation, water = create_values(latitudes, longitudes, year, month, 6, 0.0, 250.0)
+    data = np.full((CHIRPS_GRID.rows, CHIRPS_GRID.columns), -9999.0, dtype=np.float32)
+    data[rows, columns] = np.where(water, -9999.0, np.round(precipitation, 2))
+    file_name = "c{}{:02d}.tif".format(year, month)
+    transform = Affine.translation(-180.0, 50.0) * Affine.scale(0.05, -0.05)
+    with rasterio.open(os.path.join(directory, file_name), 'w', driver='GTiff', width=CHIRPS_GRID.columns,
+                       height=CHIRPS_GRID.rows, count=1, dtype=rasterio.float32, crs='+proj=latlong',
+                       transform=transform, nodata=-9999.0, compress='deflate') as output:
+        output.write(data, 1)
+    return file_name
+
+
+def create_fldas_file(directory, year, month, bounds, margin=1.0):
+    """
+    This function writes a synthetic FLDAS NOAH file: the soil moisture of 4 layers (m^3 m-3) on the global 0.1 degree
+        grid, south to north, with a time dimension of 1
+    Returns:
+        String of the name of the file
+    """
+    rows, columns, latitudes, longitudes = get_window(FLDAS_GRID, bounds, margin)
+    file_name = "FLDAS_NOAH01_C_GL_M.A{}{:02d}.001.nc".format(year, month)
+    data_set = netCDF4.Dataset(os.path.join(directory, file_name), 'w', format='NETCDF4')
+    try:
+        data_set.createDimension('time', 1)
+        data_set.createDimension('Y', FLDAS_GRID.rows)
+        data_set.createDimension('X', FLDAS_GRID.columns)
+        time_variable = data_set.createVariable('time', 'f8', ('time',))
+        time_variable.units = 'days since {}-{:02d}-01 00:00:00'.format(year, month)
+        time_variable[:] = [0.0]
+        data_set.createVariable('Y', 'f4', ('Y',))[:] = np.round(FLDAS_GRID.first_lat + np.arange(FLDAS_GRID.rows) * FLDAS_GRID.lat_step, 3)
+        data_set.createVariable('X', 'f4', ('X',))[:] = np.round(FLDAS_GRID.first_lon + np.arange(FLDAS_GRID.columns) * FLDAS_GRID.lon_step, 3)
+        for i, name in enumerate(FLDAS_LAYERS):
+            values, water = create_values(latitudes, longitudes, year, month, 7 + i, 0.05, 0.45)
+            variable = data_set.createVariable(name, 'f4', ('time', 'Y', 'X'), zlib=True, complevel=1,
+                                               chunksizes=(1, 150, 360), fill_value=-9999.0)
+            variable.units = 'm^3 m-3'
+            variable[0, rows, columns] = np.where(water, -9999.0, values).astype(np.float32)
+    finally:
+        data_set.close()
+    return file_name
+
+
+def create_archive(root_dir, bounds, first_year, years, products=None):
+    """
+    This function writes the raw files of the products for every month of an archive
+    Args:
+        root_dir (str): directory of the synthetic run; the files are written to its raw data directories
+        bounds (dictionary): n_lat, s_lat, w_lon, e_lon of the region
+        first_year (int): first year of the archive
+        years (int): number of years of the archive
+        products (list of str): optional products to write (default is all: lst, ndvi, chirps, fldas)
+
+    Returns:
+        dictionary of product -> list of the file names
+    """
+    functions = {'lst': create_lst_file, 'ndvi': create_ndvi_file, 'chirps': create_chirps_file, 'fldas': create_fldas_file}
+    directories = {'lst': 'lst_hdf', 'ndvi': 'ndvi_hdf', 'chirps': 'chirps_tif', 'fldas': 'fldas_data'}
+    files = {}
+    for product in (products if products is not None else PRODUCTS):
+        directory = os.path.join(root_dir, RAW_DATA_DIRS[directories[product]])
+        os.makedirs(directory, exist_ok=True)
+        files[product] = [functions[product](directory, y, m, bounds) for y, m in get_month_dates(first_year, years)]
+    return files
+
+
+def write_settings(root_dir, bounds, region_name="Synthetic", spi_periods=None, regions=None):
+    """
+    This function writes the settings files of a synthetic run to its root directory, for the CDI_CONFIG_DIR variable
+        The directories of the run are below the root directory; the file patterns are the ones of the cdi-scripts
+    Args:
+        root_dir (str): directory of the synthetic run
+        bounds (dictionary): n_lat, s_lat, w_lon, e_lon of the region
+        region_name (str): optional name of the region
+        spi_periods (list of int): optional SPI periods in months (default is [3])
+        regions (dictionary): optional name -> bounds of the other regions of the regions setting (default is none)
+
+    Returns:
+        String of the directory of the settings files
+    """
+    scripts_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with open(os.path.join(scripts_dir, 'cdi_project_settings.conf'), 'r') as fh:
+        project = json.loads(fh.read())
+    project['region_name'] = region_name
+    project['bounds'] = dict(bounds)
+    project['spi_periods'] = list(spi_periods) if spi_periods is not None else [3]
+    project['regions'] = [{'region_name': k, 'bounds': dict(v)} for k, v in (regions or {}).items()]
+    directories = {
+        'raw_data_dirs': {k: os.path.join(root_dir, v) for k, v in RAW_DATA_DIRS.items()},
+        'hdf_groups': dict(HDF_GROUPS),
+        'scratch_dir': os.path.join(root_dir, 'working_data'),
+        'geotiff_dir': os.path.join(root_dir, 'output_data', 'GeoTiffs'),
+        'output_dir': os.path.join(root_dir, 'output_data'),
+        'map_sources_dir': os.path.join(root_dir, 'mapping', 'data'),
+        'map_export_dir': os.path.join(root_dir, 'mapping', 'output', 'maps')
+    }
+    for directory in [directories['scratch_dir'], directories['geotiff_dir']]:
+        os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(root_dir, 'cdi_project_settings.conf'), 'w') as fh:
+        fh.write(json.dumps(project, indent=4))
+    with open(os.path.join(root_dir, 'cdi_directory_settings.conf'), 'w') as fh:
+        fh.write(json.dumps(directories, indent=4))
+    with open(os.path.join(scripts_dir, 'cdi_pattern_settings.conf'), 'r') as source:
+        with open(os.path.join(root_dir, 'cdi_pattern_settings.conf'), 'w') as fh:
+            fh.write(source.read())
+    return root_dir
+
+
+def get_bounds(args):
+    """
+    This function returns the bounds of the region of the command line: --bounds, or the named --region
+    """
+    if args.bounds is not None:
+        return dict(zip(['n_lat', 's_lat', 'w_lon', 'e_lon'], args.bounds))
+    return dict(REGIONS[args.region])
+
+
+def main(args):
+    """
+    This is the main entry point for the program
+    """
+    bounds = get_bounds(args)
+    products = args.products.split(',')
+    files = create_archive(args.output, bounds, args.first_year, args.years, products)
+    write_settings(args.output, bounds)
+    for product in products:
+        print("{}: {} files".format(product, len(files[product])))
+    print("Settings written to '{}': set CDI_CONFIG_DIR to this directory to run the steps on the synthetic inputs".format(args.output))
+
+
+if __name__ == '__main__':
+    # set up the command line argument parser
+    parser = ArgumentParser()
+    parser.add_argument("-o", "--output", required=True,
+                        help="Directory of the synthetic run: raw data, settings, working and output data")
+    parser.add_argument("-r", "--region", default="country", choices=list(REGIONS.keys()),
+                        help="Size of the region: {}. Default is country".format(', '.join(REGIONS.keys())))
+    parser.add_argument("--bounds", type=float, nargs=4, metavar=("N_LAT", "S_LAT", "W_LON", "E_LON"),
+                        help="Bounds of the region on the 0.05 degree grid (e.g. -25.675 -27.825 30.675 32.825), instead of --region")
+    parser.add_argument("-y", "--years", type=int, default=5,
+                        help="Number of years of monthly files. Default is 5")
+    parser.add_argument("--first-year", type=int, default=2001,
+                        help="First year of the files. Default is 2001")
+    parser.add_argument("-p", "--products", default=','.join(PRODUCTS),
+                        help="Comma separated list of the products to write: {}".format(', '.join(PRODUCTS)))
+    # execute the program with the supplied options
+    main(parser.parse_args())
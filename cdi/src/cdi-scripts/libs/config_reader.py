@@ -1,36 +1,187 @@
+import copy
 import json
 import os
+import threading
+import numpy as np
+
+# optional settings that older project settings files may not define, with their default values #
+DEFAULT_SETTINGS = {
+    'netcdf_storage': {
+        'profile': 'none',
+        'complevel': 4,
+        'shuffle': True
+    },
+    'export_working_files': False,
+    'geotiff_export': {
+        'profile': 'plain',
+        'compress': 'deflate',
+        'blocksize': 256
+    },
+    'regions': []
+}
+# the settings files, read in order: later files override the items of earlier files #
+SETTINGS_FILES = ['cdi_project_settings.conf', 'cdi_directory_settings.conf', 'cdi_pattern_settings.conf']
+
+# environment variable that selects the region of the settings (see ConfigParser) #
+REGION_VARIABLE = 'CDI_REGION'
+
+# process-wide cache of the parsed settings: shared by every ConfigParser instance #
+_cache = {
+    'signature': None,
+    'config': None,
+    'latitudes': None,
+    'longitudes': None,
+    'regions': {}
+}
+_cache_lock = threading.Lock()
+
+
+def _get_signature(file_paths):
+    """
+    This function returns the modification time and size of the settings files, to detect changes
+    """
+    signature = []
+    for file_path in file_paths:
+        stat = os.stat(file_path)
+        signature.append((file_path, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+def _create_read_only_array(values):
+    """
+    This function creates a numpy array that can not be changed in place
+    """
+    array = np.array(values, dtype=float)
+    array.flags.writeable = False
+    return array
+
+
+def _compute_grid(bounds):
+    """
+    This function computes the 0.05 degree grid of a region: north to south, west to east
+    Args:
+        bounds (dictionary): n_lat, s_lat, w_lon, e_lon of the region
+
+    Returns:
+        the latitudes and longitudes as read-only numpy arrays
+    """
+    n_lat = int(bounds['n_lat'] * 1000.0)
+    s_lat = int(bounds['s_lat'] * 1000.0)
+    latitudes = [round(lat * 0.001, 3) for lat in range(n_lat, s_lat, -50)]
+    latitudes.append(round(bounds['s_lat'], 3))
+    w_lon = int(bounds['w_lon'] * 1000.0)
+    e_lon = int(bounds['e_lon'] * 1000.0)
+    longitudes = [round(lon * 0.001, 3) for lon in range(w_lon, e_lon, 50)]
+    longitudes.append(round(bounds['e_lon'], 3))
+    return _create_read_only_array(latitudes), _create_read_only_array(longitudes)
+
+
+def _load_settings(file_paths):
+    """
+    This function reads the settings files and computes the grid coordinates of the region
+    Args:
+        file_paths (list of str): fully-qualified paths/names of the settings files
+
+    Returns:
+        dictionary of the settings, and the latitudes and longitudes as read-only numpy arrays
+    """
+    config = {}
+    for file_path in file_paths:
+        with open(file_path, 'r') as fh:
+            file_config = json.loads(fh.read())
+            for item in file_config.keys():
+                config[item] = file_config[item]
+    # fill in the optional settings #
+    for item in DEFAULT_SETTINGS.keys():
+        if item not in config:
+            config[item] = copy.deepcopy(DEFAULT_SETTINGS[item])
+    latitudes, longitudes = _compute_grid(config['bounds'])
+    return config, latitudes, longitudes
+
+
+def _load_region(config, region):
+    """
+    This function derives the settings of one of the additional regions (regions setting) from the settings
+        The region replaces region_name and bounds, and has its own working directory below the scratch directory,
+        so the working cubes and file catalogs of the regions are kept apart
+    Args:
+        config (dictionary): the settings
+        region (str): name of the region
+
+    Returns:
+        dictionary of the settings of the region, and its latitudes and longitudes as read-only numpy arrays
+    """
+    entries = [r for r in config['regions'] if r['region_name'] == region]
+    if len(entries) == 0:
+        raise ValueError("Unknown region: {} (regions: {})".format(region, ', '.join(get_region_names(config))))
+    region_config = dict(config)
+    region_config['region_name'] = region
+    region_config['bounds'] = copy.deepcopy(entries[0]['bounds'])
+    region_config['scratch_dir'] = "{}/{}".format(config['scratch_dir'].rstrip("/\\"), region)
+    latitudes, longitudes = _compute_grid(region_config['bounds'])
+    return region_config, latitudes, longitudes
+
+
+def get_region_names(config):
+    """
+    This function lists the regions of the settings: the region of region_name/bounds, then the additional regions
+    Args:
+        config (dictionary): the settings
+
+    Returns:
+        List of the region names
+    """
+    names = [config['region_name']] + [r['region_name'] for r in config['regions']]
+    duplicates = sorted(set(n for n in names if names.count(n) > 1))
+    if len(duplicates) > 0:
+        raise ValueError("Duplicate region names in the settings: {}".format(', '.join(duplicates)))
+    return names
 
 
 class ConfigParser:
     """
     This class handles the parsing and
     "get" calls for the configuration settings
+        The settings files are parsed once per process, and again only when one of them changes
+        (e.g. after change-cdi-bounds.sh or change-cdi-weight.sh), which is detected from their modification time and size
+        The settings files are read from the cdi-scripts directory, or from the directory in the CDI_CONFIG_DIR environment variable
+        The settings describe the region of region_name/bounds; a region of the optional regions setting (a list of
+        {"region_name": <name>, "bounds": {...}} entries) is selected with the region argument or the CDI_REGION
+        environment variable, e.g. by the multi-region mode of STEP_0000
     """
-    def __init__(self):
-        self.config = {}
-        # get the base path of the project #
-        base_path = os.path.dirname(
+    def __init__(self, region=None):
+        # get the base path of the project, or the settings directory set in the environment #
+        base_path = os.environ.get('CDI_CONFIG_DIR', os.path.dirname(
             os.path.dirname(os.path.abspath(__file__))
-        )
+        ))
+        file_paths = [os.path.join(base_path, f) for f in SETTINGS_FILES]
+        signature = _get_signature(file_paths)
+        region = region if region is not None else os.environ.get(REGION_VARIABLE)
+        with _cache_lock:
+            if _cache['signature'] != signature:
+                _cache['config'], _cache['latitudes'], _cache['longitudes'] = _load_settings(file_paths)
+                _cache['regions'] = {}
+                _cache['signature'] = signature
+            self.__settings = _cache['config']
+            if region is None or region == _cache['config']['region_name']:
+                self.config = _cache['config']
+                self.__latitudes = _cache['latitudes']
+                self.__longitudes = _cache['longitudes']
+            else:
+                if region not in _cache['regions']:
+                    _cache['regions'][region] = _load_region(_cache['config'], region)
+                self.config, self.__latitudes, self.__longitudes = _cache['regions'][region]
 
-        # read the project config settings from the JSON #
-        with open(base_path + '/cdi_project_settings.conf', 'r') as fh:
-            self.config = json.loads(fh.read())
-        # read the directory settings from the JSON #
-        with open(base_path + '/cdi_directory_settings.conf', 'r') as fh:
-            file_config = json.loads(fh.read())
-            for item in file_config.keys():
-                self.config[item] = file_config[item]
-        # read the file patterns settings from the JSON #
-        with open(base_path + '/cdi_pattern_settings.conf', 'r') as fh:
-            file_config = json.loads(fh.read())
-            for item in file_config.keys():
-                self.config[item] = file_config[item]
+    def get_region_names(self):
+        """
+        This function lists the regions of the settings: the region of region_name/bounds, then the additional regions
+        """
+        return get_region_names(self.__settings)
 
     def get(self, parameter, option=None):
         """
         This function returns the requested configuration item
+            Dictionary and list items are returned as copies, so callers can modify them without affecting other callers
 
         Args:
             parameter (str): The name of the config item to return
@@ -38,24 +189,13 @@ class ConfigParser:
 
         Returns:
             The requested configuration setting
+            (latitudes and longitudes of the region are read-only numpy arrays)
         """
         if option is not None:
-            return self.config[parameter][option]
+            return copy.deepcopy(self.config[parameter][option])
         elif parameter == 'latitudes':
-            n_lat = int(self.config['bounds']['n_lat'] * 1000.0)
-            s_lat = int(self.config['bounds']['s_lat'] * 1000.0)
-            latitudes = []
-            for lat in range(n_lat, s_lat, -50):
-                latitudes.append(round(lat * 0.001, 3))
-            latitudes.append(round(self.config['bounds']['s_lat'], 3))
-            return latitudes
+            return self.__latitudes
         elif parameter == 'longitudes':
-            w_lon = int(self.config['bounds']['w_lon'] * 1000.0)
-            e_lon = int(self.config['bounds']['e_lon'] * 1000.0)
-            longitudes = []
-            for lon in range(w_lon, e_lon, 50):
-                longitudes.append(round(lon * 0.001, 3))
-            longitudes.append(round(self.config['bounds']['e_lon'], 3))
-            return longitudes
+            return self.__longitudes
         else:
-            return self.config[parameter]
+            return copy.deepcopy(self.config[parameter])
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+import os
+import numpy as np
+import numpy.ma as ma
+
+# process-wide cache of the data cubes written by the steps, for the fused mode of STEP_0000 #
+_cache = {
+    'enabled': False,
+    'cubes': {}
+}
+
+
+def _get_key(file_path, variable):
+    """
+    This function returns the cache key of a variable of a NetCDF file
+    """
+    return os.path.abspath(file_path), variable
+
+
+def enable():
+    """
+    This function enables the cache: the steps executed in this process then keep the cubes they write in memory,
+        and the following steps use them instead of reading the NetCDF files back
+    """
+    _cache['enabled'] = True
+
+
+def disable():
+    """
+    This function disables the cache and releases the cubes
+    """
+    _cache['enabled'] = False
+    _cache['cubes'] = {}
+
+
+def is_enabled():
+    """
+    This function checks if the cache is enabled
+    """
+    return _cache['enabled']
+
+
+def put(file_path, variable, values, missing=-9999.0):
+    """
+    This function keeps the values written to a variable of a NetCDF file, if the cache is enabled
+        The values are stored as they are read back from the file: float32, with the masked values set to the missing value,
+        so the following steps get the same values from the cache as from the file
+    Args:
+        file_path (str): fully-qualified path/name of the NetCDF file
+        variable (str): name of the variable
+        values: 3D numpy (masked) array of all time steps of the variable
+        missing (float): optional missing value of the variable (default is -9999.0)
+    """
+    if not _cache['enabled']:
+        return
+    cube = np.asarray(ma.filled(values, missing), dtype=np.float32)
+    cube.flags.writeable = False
+    _cache['cubes'][_get_key(file_path, variable)] = cube
+
+
+def get(file_path, variable):
+    """
+    This function returns the cached values of a variable of a NetCDF file
+    Args:
+        file_path (str): fully-qualified path/name of the NetCDF file
+        variable (str): name of the variable
+
+    Returns:
+        read-only 3D numpy float32 array of all time steps, or None if the variable is not cached
+    """
+    return _cache['cubes'].get(_get_key(file_path, variable))
+
+
+def discard(file_path):
+    """
+    This function removes the cached values of a NetCDF file, when the file is created or opened for writing
+    """
+    if len(_cache['cubes']) == 0:
+        return
+    path = os.path.abspath(file_path)
+    for key in [k for k in _cache['cubes'].keys() if k[0] == path]:
+        del _cache['cubes'][key]
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+import time
+from datetime import date
+import numpy as np
+import libs.netcdf_functions as netcdf
+
+TIME_UNITS = 'days since 1900-01-01 00:00:00.0 UTC'
+
+
+def get_calendar_value(date_string):
+    """
+    This function calculates the number of days since Jan 1, 1900 for a year/month
+    Args:
+        date_string (str): year/month in 'YYYYMM' format
+
+    Returns:
+        Float value of the number of days since Jan 1, 1900
+    """
+    test_date = date(int(date_string[0:4]), int(date_string[4:6]), 1)
+    return float((test_date - date(1900, 1, 1)).days)
+
+
+class CubeStore:
+    """
+    This class stores the monthly values of a parameter in a single NetCDF file: a time x latitude x longitude cube
+        with an unlimited time dimension, which replaces the NetCDF file per month of the working directories
+        The time slots are kept in chronological order and are indexed by their 'YYYYMM' date, so the slot of a date
+        is a dictionary lookup and a series of dates (e.g. one calendar month of every year) is read as a single slab
+        The 'updated' variable holds the time each slot was last written (ns since the epoch); it is 0 for slots that
+        have been reserved but not written yet, which are ignored by get_dates and get_fingerprint
+    """
+    def __init__(self, file_path, latitudes, longitudes, variables=None, storage=None, read_only=False):
+        """
+        Args:
+            file_path (str): fully-qualified path/name of the cube file
+            latitudes (list of float): latitudes of the grid
+            longitudes (list of float): longitudes of the grid
+            variables (dictionary): name -> dictionary of the attributes of the variables, to create a new cube
+            storage (dictionary): optional storage options of the variables (see netcdf_functions.get_storage_options)
+            read_only (boolean): optional flag to open an existing cube for reading only (default is False)
+        """
+        self.__file_path = file_path
+        self.__latitudes = np.asarray(latitudes, dtype=float)
+        self.__longitudes = np.asarray(longitudes, dtype=float)
+        self.__variables = variables if variables is not None else {}
+        self.__storage = storage
+        self.__read_only = read_only
+        self.__missing = -9999.0
+        self.__data_set = None
+        self.__dates = []
+        self.__slots = {}
+        self.__updated = []
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __is_compatible(self, data_set):
+        """
+        This function checks if an existing cube file has the grid and the variables of this cube
+        """
+        if 'updated' not in data_set.variables or not data_set.dimensions['time'].isunlimited():
+            return False
+        if not np.array_equal(np.array(data_set.variables['latitude'][:]), self.__latitudes):
+            return False
+        if not np.array_equal(np.array(data_set.variables['longitude'][:]), self.__longitudes):
+            return False
+        return all(name in data_set.variables for name in self.__variables.keys())
+
+    def __create(self, file_path, dates):
+        """
+        This function creates a cube file with the given time slots
+        """
+        out_properties = {
+            'latitudes': self.__latitudes,
+            'longitudes': self.__longitudes,
+            'times': [get_calendar_value(d) for d in dates],
+            'time_units': TIME_UNITS
+        }
+        data_set = netcdf.initialize_dataset(file_path, out_properties, unlimited_time=True)
+        try:
+            for name in self.__variables.keys():
+                variable = netcdf.create_variable(data_set, name, self.__storage)
+                variable.missing_value = self.__missing
+                for attribute, value in self.__variables[name].items():
+                    variable.setncattr(attribute, value)
+            updated = data_set.createVariable('updated', 'i8', ('time',))
+            updated.units = 'ns since 1970-01-01 00:00:00 UTC'
+            updated.long_name = "Time the slot was last written, 0 if it has not been written"
+            updated[:] = np.zeros(len(dates), dtype=np.int64)
+            return data_set
+        except Exception:
+            data_set.close()
+            raise
+
+    def __load_index(self):
+        """
+        This function builds the date -> time slot index of the open cube
+        """
+        origin_date = date(1900, 1, 1)
+        times = np.array(self.__data_set.variables['time'][:], dtype=float)
+        self.__dates = [date.fromordinal(origin_date.toordinal() + int(t)).strftime('%Y%m') for t in times]
+        self.__slots = {d: i for i, d in enumerate(self.__dates)}
+        self.__updated = [int(u) for u in np.array(self.__data_set.variables['updated'][:])]
+
+    def open(self):
+        """
+        This function opens the cube file, creating it if it does not exist
+            A cube of a different grid (e.g. after the bounds of the region changed) or without the variables of this cube
+            is replaced by an empty cube
+        """
+        if os.path.isfile(self.__file_path):
+            self.__data_set = netcdf.open_dataset(self.__file_path, 'r' if self.__read_only else 'a')
+            if self.__read_only or self.__is_compatible(self.__data_set):
+                self.__load_index()
+                return
+            print("Replacing incompatible working cube: '{}'".format(self.__file_path))
+            self.__data_set.close()
+        elif self.__read_only:
+            raise IOError("Working cube does not exist: '{}'".format(self.__file_path))
+        self.__data_set = self.__create(self.__file_path, [])
+        self.__load_index()
+
+    def close(self):
+        """
+        This function closes the cube file
+        """
+        if self.__data_set is not None:
+            self.__data_set.close()
+            self.__data_set = None
+
+    def get_dates(self):
+        """
+        This function returns the dates of the written time slots
+        Returns:
+            List of 'YYYYMM' strings, in chronological order
+        """
+        return [d for d, u in zip(self.__dates, self.__updated) if u > 0]
+
+    def get_slot(self, date_string):
+        """
+        This function returns the index of the time slot of a date in the cube file
+        Args:
+            date_string (str): 'YYYYMM' date
+
+        Returns:
+            Integer index of the time slot
+        """
+        return self.__slots[date_string]
+
+    def get_fingerprint(self, dates):
+        """
+        This function computes a fingerprint of the time slots of a list of dates from the times they were written
+            The fingerprint changes when one of the slots is written again, or when a date is added or removed
+        Args:
+            dates (list of str): 'YYYYMM' dates
+
+        Returns:
+            String of the hexadecimal fingerprint
+        """
+        digest = hashlib.sha1()
+        for d in sorted(dates):
+            digest.update("{}:{};".format(d, self.__updated[self.__slots[d]]).encode())
+        return digest.hexdigest()
+
+    def reserve(self, dates):
+        """
+        This function adds the time slots of dates that are not in the cube yet
+            Dates after the last slot are appended; an earlier date rewrites the cube to keep the slots in chronological order
+        Args:
+            dates (list of str): 'YYYYMM' dates
+        """
+        new_dates = sorted(set(dates).difference(self.__slots.keys()))
+        if len(new_dates) == 0:
+            return
+        if len(self.__dates) == 0 or new_dates[0] > self.__dates[-1]:
+            # extend the time dimension #
+            start = len(self.__dates)
+            self.__data_set.variables['time'][start:] = [get_calendar_value(d) for d in new_dates]
+            self.__data_set.variables['updated'][start:] = np.zeros(len(new_dates), dtype=np.int64)
+            self.__load_index()
+        else:
+            self.__rebuild(sorted(self.__dates + new_dates))
+
+    def __rebuild(self, dates):
+        """
+        This function rewrites the cube with the given time slots, copying the values of the existing slots
+            The new cube is written to a temporary file first, so an interrupted rebuild never leaves a partial cube
+        """
+        temp_path = self.__file_path + '.tmp'
+        new_data_set = self.__create(temp_path, dates)
+        try:
+            slots = {d: i for i, d in enumerate(dates)}
+            for d, u in zip(self.__dates, self.__updated):
+                if u == 0:
+                    continue
+                for name in self.__data_set.variables.keys():
+                    if name not in ('time', 'latitude', 'longitude', 'updated'):
+                        new_data_set.variables[name][slots[d]] = self.__data_set.variables[name][self.__slots[d]]
+                new_data_set.variables['updated'][slots[d]] = u
+        finally:
+            new_data_set.close()
+        self.__data_set.close()
+        os.replace(temp_path, self.__file_path)
+        self.__data_set = netcdf.open_dataset(self.__file_path, 'a')
+        self.__load_index()
+
+    def write(self, date_string, values):
+        """
+        This function writes the values of a date to its time slot, which must have been reserved
+        Args:
+            date_string (str): 'YYYYMM' date
+            values (dictionary): variable name -> 2D numpy array of the values, with NaN (or -9999.0) for the missing values
+        """
+        slot = self.__slots[date_string]
+        for name in values.keys():
+            self.__data_set.variables[name][slot] = netcdf.nan_to_missing(values[name], self.__missing)
+        self.__updated[slot] = time.time_ns()
+        self.__data_set.variables['updated'][slot] = self.__updated[slot]
+
+    def set_attribute(self, variable, attribute, value):
+        """
+        This function sets an attribute of a variable, e.g. units only known after reading the raw data
+        """
+        self.__data_set.variables[variable].setncattr(attribute, value)
+
+    def get_attribute(self, variable, attribute):
+        """
+        This function returns an attribute of a variable
+        """
+        return self.__data_set.variables[variable].getncattr(attribute)
+
+    def read(self, variable, dates):
+        """
+        This function reads the values of a list of dates
+            Dates whose slots are evenly spaced (e.g. consecutive months, or one calendar month of consecutive years)
+            are read as a single slab
+        Args:
+            variable (str): name of the variable
+            dates (list of str): 'YYYYMM' dates, in chronological order
+
+        Returns:
+            3D numpy float32 array of the values, with NaN for the missing values
+        """
+        slots = [self.__slots[d] for d in dates]
+        if len(slots) == 0:
+            return np.empty((0, len(self.__latitudes), len(self.__longitudes)), dtype=np.float32)
+        steps = np.diff(slots)
+        if len(steps) == 0 or (steps[0] > 0 and np.all(steps == steps[0])):
+            step = int(steps[0]) if len(steps) > 0 else 1
+            return netcdf.missing_to_nan(self.__data_set.variables[variable][slots[0]:slots[-1] + 1:step], self.__missing)
+        values = np.empty((len(slots), len(self.__latitudes), len(self.__longitudes)), dtype=np.float32)
+        for i, s in enumerate(slots):
+            values[i] = netcdf.missing_to_nan(self.__data_set.variables[variable][s], self.__missing)
+        return values
+
+    def read_values(self, variable, date_string):
+        """
+        This function reads the values of a single date
+        Args:
+            variable (str): name of the variable
+            date_string (str): 'YYYYMM' date
+
+        Returns:
+            2D numpy float32 array of the values, with NaN for the missing values
+        """
+        return netcdf.missing_to_nan(self.__data_set.variables[variable][self.__slots[date_string]], self.__missing)
+
+    def import_files(self, files, variables):
+        """
+        This function loads the values of single time step NetCDF files (e.g. the per-month files of earlier versions)
+            for the dates that have not been written to the cube
+        Args:
+            files (dictionary): 'YYYYMM' date -> fully-qualified path/name of the NetCDF file
+            variables (list of str): names of the variables to load
+
+        Returns:
+            List of the imported dates
+        """
+        written = set(self.get_dates())
+        dates = sorted(d for d in files.keys() if d not in written)
+        self.reserve(dates)
+        for d in dates:
+            data_set = netcdf.open_dataset(files[d])
+            try:
+                self.write(d, {name: netcdf.extract_values(data_set, name, 0) for name in variables})
+            finally:
+                data_set.close()
+        return dates
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+
+
+class FileCatalog:
+    """
+    This class keeps a persistent record of the raw files that have been processed into a working directory
+        For each raw file it stores the modification time and size at the time of processing, and the name of the file it produced
+        New or changed raw files are then found with dictionary/set lookups instead of comparing file name lists
+        The catalog is stored as a JSON file:
+            {"version": 1, "groups": {<file pattern name>: {<raw file name>: {"mtime": ns, "size": bytes, "output": <file name>}}}}
+    """
+    VERSION = 1
+
+    def __init__(self, file_path):
+        self.__file_path = file_path
+        self.__groups = {}
+        self.__modified = False
+        self.__load()
+
+    def __load(self):
+        """
+        This function reads the catalog file, if it exists
+            An unreadable catalog is discarded: the raw files are then compared against the produced files only
+        """
+        if not os.path.isfile(self.__file_path):
+            return
+        try:
+            with open(self.__file_path, 'r') as fh:
+                catalog = json.loads(fh.read())
+            if catalog.get('version') == self.VERSION:
+                self.__groups = catalog['groups']
+        except (ValueError, KeyError, AttributeError):
+            print("Ignoring unreadable file catalog: '{}'".format(self.__file_path))
+            self.__groups = {}
+
+    def get_changed_files(self, group, signatures, outputs, output_name):
+        """
+        This function determines which raw files are new or have changed since they were processed
+            A raw file needs processing if it is not in the catalog, its modification time or size differ from the catalog,
+            or the file it produced no longer exists
+            Raw files that are not in the catalog but whose produced file exists (e.g. processed before the catalog existed)
+            are added to the catalog as processed
+            Catalog entries of raw files that no longer exist are removed
+        Args:
+            group (str): name of the group of raw files (the name of the file pattern)
+            signatures (dictionary): raw file name -> (modification time in ns, size in bytes)
+            outputs (set of str): names of the files in the working directory
+            output_name (function): returns the name of the produced file for a raw file name
+
+        Returns:
+            List of the names of the raw files to process
+        """
+        entries = self.__groups.setdefault(group, {})
+        results = []
+        for name, (mtime, size) in signatures.items():
+            entry = entries.get(name)
+            if entry is None:
+                output = output_name(name)
+                if output in outputs:
+                    entries[name] = {'mtime': mtime, 'size': size, 'output': output}
+                    self.__modified = True
+                else:
+                    results.append(name)
+            elif entry['mtime'] != mtime or entry['size'] != size or entry['output'] not in outputs:
+                results.append(name)
+        # remove the entries of deleted raw files #
+        for name in set(entries.keys()).difference(signatures.keys()):
+            del entries[name]
+            self.__modified = True
+        return results
+
+    def contains(self, group, name, signature):
+        """
+        This function checks if a raw file is recorded with the same modification time and size
+        Args:
+            group (str): name of the group of raw files
+            name (str): name of the raw file
+            signature (tuple): modification time in ns and size in bytes of the raw file
+
+        Returns:
+            True if the raw file is recorded as processed, False otherwise
+        """
+        entry = self.__groups.get(group, {}).get(name)
+        return entry is not None and (entry['mtime'], entry['size']) == tuple(signature)
+
+    def record(self, group, name, signature, output):
+        """
+        This function records a processed raw file
+        Args:
+            group (str): name of the group of raw files (the name of the file pattern)
+            name (str): name of the raw file
+            signature (tuple): modification time in ns and size in bytes of the raw file when it was processed
+            output (str): name of the produced file
+        """
+        mtime, size = signature
+        self.__groups.setdefault(group, {})[name] = {'mtime': mtime, 'size': size, 'output': output}
+        self.__modified = True
+
+    def save(self):
+        """
+        This function writes the catalog file if it has changed
+            The file is written to a temporary name first, so an interrupted write never leaves a partial catalog
+        """
+        if not self.__modified:
+            return
+        temp_path = self.__file_path + '.tmp'
+        try:
+            with open(temp_path, 'w') as fh:
+                fh.write(json.dumps({'version': self.VERSION, 'groups': self.__groups}))
+            os.replace(temp_path, self.__file_path)
+            self.__modified = False
+        except IOError:
+            raise
+        except Exception:
+            raise
@@ -1,5 +1,27 @@
+import hashlib
 import os
 import re
+from collections import Counter
+from libs.file_catalog import FileCatalog
+import libs.hdf_functions as hdf
+import libs.parallel_operations as parallel
+
+
+def get_files_fingerprint(file_paths):
+    """
+    This function computes a fingerprint of a set of files from their names, modification times and sizes
+        The fingerprint changes when a file is added, removed, replaced or modified
+    Args:
+        file_paths (list of str): fully-qualified paths/names of the files
+
+    Returns:
+        String of the hexadecimal fingerprint
+    """
+    digest = hashlib.sha1()
+    for file_path in sorted(file_paths):
+        stat = os.stat(file_path)
+        digest.update("{}:{}:{};".format(os.path.basename(file_path), stat.st_mtime_ns, stat.st_size).encode())
+    return digest.hexdigest()
 
 
 class FileHandler:
@@ -7,6 +29,8 @@ class FileHandler:
         self.__raw_data_dir = kwargs['raw_data_dir']
         self.__working_dir = kwargs['working_dir']
         self.__patterns = kwargs['file_patterns']
+        self.__catalog = None
+        self.__signatures = {}
         self.__validate_directories()
 
     def __validate_directories(self):
@@ -21,7 +45,7 @@ class FileHandler:
         if not os.path.isdir(self.__working_dir):
             try:
                 print("Creating working data directory.")
-                os.mkdir(self.__working_dir)
+                os.makedirs(self.__working_dir)
             except IOError:
                 print("Error creating working directory; check permissions on parent directory.")
 
@@ -83,3 +107,182 @@ class FileHandler:
             raise
         finally:
             return results
+
+    def __get_catalog(self):
+        """
+        This function returns the file catalog of the working directory, loading it on first use
+        """
+        if self.__catalog is None:
+            self.__catalog = FileCatalog(os.path.join(self.__working_dir, 'file_catalog.json'))
+        return self.__catalog
+
+    def scan_raw_files(self, pattern, root=None, subdir=None):
+        """
+        This function reads the raw data directory to find available files to process, with their modification time and size
+            Files are named as in get_raw_file_names
+
+        Args:
+            pattern (str): name of the file pattern (from the config) to use in the search
+            root (str): root directory to scan
+            subdir (str): name of the sub-directory if being used
+        Returns:
+            Dictionary of file name -> (modification time in ns, size in bytes)
+        """
+        results = {}
+        if root is None:
+            root = self.__raw_data_dir
+        file_match = re.compile(r'{}'.format(self.__patterns[pattern]))
+        try:
+            with os.scandir(root) as entries:
+                for entry in entries:
+                    # check if we have a sub-directory #
+                    if entry.is_dir():
+                        results.update(self.scan_raw_files(pattern, entry.path, entry.name))
+                    # test the file name against the pattern #
+                    elif file_match.search(entry.name):
+                        stat = entry.stat()
+                        name = '{}/{}'.format(subdir, entry.name) if root != self.__raw_data_dir else entry.name
+                        results[name] = (stat.st_mtime_ns, stat.st_size)
+        except IOError:
+            raise
+        except Exception:
+            raise
+        return results
+
+    def get_new_or_changed_files(self, pattern, output_name, outputs=None):
+        """
+        This function finds the raw files that are new or have changed since they were processed, using the file catalog
+            of the working directory (see FileCatalog.get_changed_files)
+
+        Args:
+            pattern (str): name of the file pattern (from the config) of the raw files
+            output_name (function): returns the name of the file produced in the working directory for a raw file name
+            outputs (set of str): optional names of the produced outputs, for outputs that are not files of their own
+                (default is the names of the files in the working directory)
+        Returns:
+            List of file names
+        """
+        try:
+            self.__signatures[pattern] = self.scan_raw_files(pattern)
+            if outputs is None:
+                outputs = set(os.listdir(self.__working_dir))
+            return self.__get_catalog().get_changed_files(pattern, self.__signatures[pattern], outputs, output_name)
+        except IOError:
+            raise
+        except Exception:
+            raise
+
+    def record_processed_file(self, pattern, file_name, output_file):
+        """
+        This function records a processed raw file in the file catalog
+            The modification time and size are those of the last scan, so a file changed during processing is processed again
+
+        Args:
+            pattern (str): name of the file pattern (from the config) of the raw file
+            file_name (str): name of the raw file, as returned by get_raw_file_names or get_new_or_changed_files
+            output_file (str): path/name of the file produced in the working directory
+        """
+        signature = self.__signatures.get(pattern, {}).get(file_name)
+        if signature is None:
+            stat = os.stat(os.path.join(self.__raw_data_dir, file_name))
+            signature = (stat.st_mtime_ns, stat.st_size)
+        self.__get_catalog().record(pattern, file_name, signature, os.path.basename(output_file))
+
+    def process_raw_files(self, pattern, files, task, output_name, workers=1, store=None):
+        """
+        This function runs the conversion of raw files into the working directory, in parallel worker processes if requested
+            Converted files are recorded in the file catalog, and the partial output of failed files is removed,
+            so that they are converted again on the next run
+            With a store function the results of the task are written by the current process (e.g. to the working cube),
+            so the workers never write the same file
+
+        Args:
+            pattern (str): name of the file pattern (from the config) of the raw files
+            files (list of str): names of the raw files to convert
+            task (function): converts a raw file, given its name; with workers > 1 it must be picklable
+            output_name (function): returns the name of the file produced in the working directory for a raw file name
+            workers (int): optional number of worker processes (default is 1: convert in the current process)
+            store (function): optional function called with each raw file name and the result of its task
+        Returns:
+            Dictionary of raw file name -> error description for the files that failed
+        """
+        # every raw file must produce its own file, so that parallel conversions never write the same file #
+        output_names = [output_name(f) for f in files]
+        duplicates = sorted(name for name, count in Counter(output_names).items() if count > 1)
+        if len(duplicates) > 0:
+            raise ValueError("Several raw files produce the same file(s): {}".format(', '.join(duplicates)))
+        try:
+            failures = parallel.run_tasks(task, files, workers, callback=store)
+            self.record_processed_files(pattern, files, failures, output_name)
+            return failures
+        finally:
+            self.save_catalog()
+
+    def record_processed_files(self, pattern, files, failures, output_name):
+        """
+        This function records the converted raw files in the file catalog, and removes the partial output of the failed files
+            The catalog is written by save_catalog
+
+        Args:
+            pattern (str): name of the file pattern (from the config) of the raw files
+            files (list of str): names of the raw files that were converted
+            failures (dictionary): raw file name -> error description for the files that failed
+            output_name (function): returns the name of the file produced in the working directory for a raw file name
+        """
+        for f in files:
+            output_file = os.path.join(self.__working_dir, output_name(f))
+            if f in failures:
+                if os.path.isfile(output_file):
+                    os.remove(output_file)
+            else:
+                self.record_processed_file(pattern, f, output_file)
+
+    def convert_h4_to_h5(self, files, workers=1, timeout=None):
+        """
+        This function converts raw HDF4 files to HDF5 in place (see hdf_functions.convert_h4_to_h5), running up to
+            'workers' converters at a time
+            Conversions are recorded in the file catalog: a HDF4 file that has been converted before (e.g. downloaded again)
+            is removed instead of being converted twice
+
+        Args:
+            files (list of str): names of the HDF4 files, as returned by get_raw_file_names
+            workers (int): optional number of simultaneous conversions (default is 1)
+            timeout (float): optional number of seconds allowed per conversion (default is no limit)
+        Returns:
+            Dictionary of file name -> error description for the files that failed
+        """
+        catalog = self.__get_catalog()
+        # remove the temporary files of interrupted runs #
+        directories = set(os.path.dirname(os.path.join(self.__raw_data_dir, f)) for f in files)
+        directories.add(self.__raw_data_dir)
+        for directory in directories:
+            hdf.remove_conversion_leftovers(directory)
+        signatures = {}
+        files_to_convert = []
+        for f in files:
+            file_path = os.path.join(self.__raw_data_dir, f)
+            stat = os.stat(file_path)
+            signatures[f] = (stat.st_mtime_ns, stat.st_size)
+            if catalog.contains('h4toh5', f, signatures[f]) and os.path.isfile(hdf.get_h5_path(file_path)):
+                print("-- {} has already been converted to HDF5, removing it".format(f))
+                os.remove(file_path)
+            else:
+                files_to_convert.append(f)
+        try:
+            failures = parallel.run_tasks(
+                lambda f: hdf.convert_h4_to_h5(os.path.join(self.__raw_data_dir, f), timeout),
+                files_to_convert, workers, use_threads=True
+            )
+            for f in files_to_convert:
+                if f not in failures:
+                    catalog.record('h4toh5', f, signatures[f], os.path.basename(hdf.get_h5_path(f)))
+            return failures
+        finally:
+            self.save_catalog()
+
+    def save_catalog(self):
+        """
+        This function writes the file catalog of the working directory, if it was used
+        """
+        if self.__catalog is not None:
+            self.__catalog.save()
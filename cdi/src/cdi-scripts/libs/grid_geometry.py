@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+from functools import lru_cache
+
+
+class GridGeometry:
+    """
+    This class describes a regular latitude/longitude grid by the center of its first cell, its spacing and its size
+        It resolves the bounds of an Area of Interest to the row/column ranges of the grid arithmetically,
+        without scanning the coordinate arrays
+    Example:
+        Given a global grid at 0.5 degree spacing that starts at -179.75, -89.75 (note the 0.25 degree offset for the
+            center of the grid "boxes"), there are 720 longitude values and 360 latitude values
+        If we are interested in an area that covers -49.75, -29.75 to 49.75, 29.75:
+            -49.75 is 130 degrees to the east of -179.75, so the first column is 130 / 0.5 = 260
+            49.75 is 229.5 degrees to the east of -179.75, so the last column is 459 (column range 260 - 460)
+            -29.75 is 60 degrees to the north of -89.75, so the first row is 120
+            29.75 is 119.5 degrees to the north of -89.75, so the last row is 239 (row range 120 - 240)
+    """
+    def __init__(self, first_lat, first_lon, lat_step, lon_step, rows, columns):
+        self.first_lat = round(float(first_lat), 6)
+        self.first_lon = round(float(first_lon), 6)
+        self.lat_step = round(float(lat_step), 6)
+        self.lon_step = round(float(lon_step), 6)
+        self.rows = int(rows)
+        self.columns = int(columns)
+        if self.lat_step == 0 or self.lon_step == 0:
+            raise ValueError("Grid spacing can not be 0: {}".format(self))
+
+    def __key(self):
+        return self.first_lat, self.first_lon, self.lat_step, self.lon_step, self.rows, self.columns
+
+    def __eq__(self, other):
+        return isinstance(other, GridGeometry) and self.__key() == other.__key()
+
+    def __hash__(self):
+        return hash(self.__key())
+
+    def __repr__(self):
+        return "GridGeometry(first_lat={}, first_lon={}, lat_step={}, lon_step={}, rows={}, columns={})".format(*self.__key())
+
+    @classmethod
+    def from_coordinates(cls, latitudes, longitudes):
+        """
+        This function creates the geometry of a grid from its latitude and longitude values
+        Args:
+            latitudes (list of floats): latitude values of the grid
+            longitudes (list of floats): longitude values of the grid
+
+        Returns:
+            GridGeometry object
+        """
+        if len(latitudes) < 2 or len(longitudes) < 2:
+            raise ValueError("At least 2 latitudes and 2 longitudes are required to determine the grid spacing")
+        return cls(
+            latitudes[0],
+            longitudes[0],
+            (latitudes[-1] - latitudes[0]) / (len(latitudes) - 1),
+            (longitudes[-1] - longitudes[0]) / (len(longitudes) - 1),
+            len(latitudes),
+            len(longitudes)
+        )
+
+    @staticmethod
+    def __index(value, first, step, count, name):
+        """
+        This function computes the index of a coordinate value on one axis of the grid
+        Args:
+            value (float): the coordinate value
+            first (float): the coordinate of the first cell on the axis
+            step (float): the spacing of the axis
+            count (int): the number of cells on the axis
+            name (str): name of the axis for error messages
+
+        Returns:
+            integer index of the cell
+        """
+        index = int(round((float(value) - first) / step))
+        # the value must be on the grid: within 2% of the cell spacing from a cell center #
+        if index < 0 or index >= count or abs(first + index * step - float(value)) > abs(step) * 0.02:
+            raise ValueError(
+                "{} {} is not on the grid: cells are centered at {} + n * {} for n in 0 - {}".format(
+                    name, value, first, step, count - 1
+                )
+            )
+        return index
+
+    def row_index(self, latitude):
+        """
+        This function returns the row index of a latitude value
+        """
+        return self.__index(latitude, self.first_lat, self.lat_step, self.rows, 'Latitude')
+
+    def column_index(self, longitude):
+        """
+        This function returns the column index of a longitude value
+        """
+        return self.__index(longitude, self.first_lon, self.lon_step, self.columns, 'Longitude')
+
+    def window(self, bounds):
+        """
+        This function determines the index range of the rows and columns that fits the Area of Interest
+            Results are cached per (grid, bounds) pair
+        Args:
+            bounds (dictionary): object containing the coordinates of the Area of Interest: n_lat, s_lat, w_lon, e_lon
+
+        Returns:
+            a slice of the rows and a slice of the columns of the grid
+        """
+        return _resolve_window(self, float(bounds['n_lat']), float(bounds['s_lat']), float(bounds['w_lon']), float(bounds['e_lon']))
+
+
+@lru_cache(maxsize=256)
+def _resolve_window(grid, n_lat, s_lat, w_lon, e_lon):
+    """
+    This function resolves the bounds of an Area of Interest to the row/column slices of a grid
+    Args:
+        grid (GridGeometry): the geometry of the grid
+        n_lat (float): north latitude of the Area of Interest
+        s_lat (float): south latitude of the Area of Interest
+        w_lon (float): west longitude of the Area of Interest
+        e_lon (float): east longitude of the Area of Interest
+
+    Returns:
+        a slice of the rows and a slice of the columns of the grid
+    """
+    if n_lat < s_lat:
+        raise ValueError("North latitude ({}) must not be lower than south latitude ({})".format(n_lat, s_lat))
+    if e_lon < w_lon:
+        raise ValueError("East longitude ({}) must not be lower than west longitude ({})".format(e_lon, w_lon))
+    # the rows start at the north edge for north-to-south grids, and at the south edge for south-to-north grids #
+    if grid.lat_step < 0:
+        first_row, last_row = grid.row_index(n_lat), grid.row_index(s_lat)
+    else:
+        first_row, last_row = grid.row_index(s_lat), grid.row_index(n_lat)
+    first_column, last_column = grid.column_index(w_lon), grid.column_index(e_lon)
+    return slice(first_row, last_row + 1), slice(first_column, last_column + 1)
+
+
+# global 0.05 degree MODIS Climate Modeling Grid (north to south) #
+MODIS_CMG_GRID = GridGeometry(89.975, -179.975, -0.05, 0.05, 3600, 7200)
+# quasi-global 0.05 degree CHIRPS grid, 50N to 50S (north to south) #
+CHIRPS_GRID = GridGeometry(49.975, -179.975, -0.05, 0.05, 2000, 7200)
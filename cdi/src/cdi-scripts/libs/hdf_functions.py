@@ -1,7 +1,16 @@
 # -*- coding: utf-8 -*-
+import glob
+import os
+import subprocess
+import uuid
 import h5py
 import numpy as np
 
+# HDF4 to HDF5 converter (h4toh5convert of the HDF Group) #
+H4TOH5_CONVERTER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'h4toh5convert')
+# name pattern of the temporary files of the converter: these never match the raw file patterns #
+H4TOH5_TEMP_PATTERN = '.h4toh5-*.tmp'
+
 
 def open_dataset(file_path):
     """
@@ -45,3 +54,79 @@ def extract_data(data_set, group, parameter, time=0):
         raise
     except Exception:
         raise
+
+
+def extract_window(data_set, group, parameter, rows, columns):
+    """
+    This function extracts a window of a HDF variable as a numpy array
+        Only the requested hyperslab is read from the file, not the full global grid
+    Args:
+        data_set (SD): class object of a read HDF file
+        group (str): name of the HDF group holding the parameter
+        parameter (str): name of the parameter to extract data for
+        rows (slice): range of the rows to read
+        columns (slice): range of the columns to read
+
+    Returns:
+        2D numpy array of the values in the window
+    """
+    try:
+        # read the hyperslab of the parameter values #
+        data = data_set[group]['Data Fields'][parameter]
+        return data[rows, columns]
+    except IOError:
+        raise
+    except Exception:
+        raise
+
+
+def get_h5_path(file_path):
+    """
+    This function returns the path/name of the HDF5 version of a HDF4 file
+    Args:
+        file_path (str): fully-qualified path/name of the HDF4 file
+
+    Returns:
+        String of the fully-qualified path/name of the HDF5 file
+    """
+    return file_path.split('.hdf')[0] + '_h5.hdf'
+
+
+def convert_h4_to_h5(file_path, timeout=None):
+    """
+    This function converts a HDF4 file to HDF5 and removes the HDF4 file
+        The converter writes to a temporary file that is renamed when complete,
+        so an interrupted conversion never leaves a partial HDF5 file
+    Args:
+        file_path (str): fully-qualified path/name of the HDF4 file
+        timeout (float): optional number of seconds after which the converter is stopped (default is no limit)
+
+    Returns:
+        String of the fully-qualified path/name of the HDF5 file
+    """
+    h5_path = get_h5_path(file_path)
+    temp_path = os.path.join(os.path.dirname(h5_path), H4TOH5_TEMP_PATTERN.replace('*', uuid.uuid4().hex))
+    try:
+        subprocess.run([H4TOH5_CONVERTER, file_path, temp_path], check=True, timeout=timeout,
+                       stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        os.replace(temp_path, h5_path)
+        os.remove(file_path)
+        return h5_path
+    except subprocess.CalledProcessError as cpe:
+        raise IOError("{} failed for {} (exit code {}): {}".format(
+            os.path.basename(H4TOH5_CONVERTER), file_path, cpe.returncode, cpe.output.decode(errors='replace').strip()))
+    except Exception:
+        raise
+    finally:
+        if os.path.isfile(temp_path):
+            os.remove(temp_path)
+
+
+def remove_conversion_leftovers(directory):
+    """
+    This function removes the temporary files of conversions that were stopped before they could clean up
+    Args:
+        directory (str): fully-qualified path of the directory to clean up
+    """
+    for temp_path in glob.glob(os.path.join(glob.escape(directory), H4TOH5_TEMP_PATTERN)):
+        os.remove(temp_path)
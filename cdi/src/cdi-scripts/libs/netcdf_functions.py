@@ -1,13 +1,30 @@
 # -*- coding: utf-8 -*-
+import os
 from netCDF4 import Dataset
 import numpy as np
+import numpy.ma as ma
 from datetime import datetime
+import libs.cube_cache as cube_cache
+import libs.telemetry as telemetry
+
+# storage profiles of the data variables, named for the access pattern the chunks are tuned for: #
+#   none: contiguous and uncompressed (the original layout) #
+#   time_step: one chunk per time step, for steps that read or write a full map at a time #
+#   time_series: small spatial tiles holding many time steps, for steps that read the series of a pixel #
+STORAGE_PROFILES = ('none', 'time_step', 'time_series')
+# number of time steps and the tile size (cells per side) of the time_series chunks #
+SERIES_CHUNK_TIMES = 120
+SERIES_CHUNK_CELLS = 32
+# missing value of the data variables in the files: the compute steps use float32 values with NaN for the missing #
+# values, and convert them at the file boundary (see missing_to_nan and nan_to_missing) #
+MISSING_VALUE = -9999.0
 
 
 def open_dataset(file_path, action='r'):
     """
     This function open a NetCDF file and returns a Dataset object with the appropriate operation:
         read, write, or append
+        Opening a file for writing or appending discards its cached values (see cube_cache)
     Args:
         file_path (str): fully-qualified path/name of the NetCDF file
         action (str): optional action flag for the dataset operation: r (default), w, a
@@ -16,6 +33,9 @@ def open_dataset(file_path, action='r'):
         NetCDF4 Dataset object
     """
     try:
+        if action != 'r':
+            cube_cache.discard(file_path)
+        telemetry.count_file()
         return Dataset(r'{}'.format(file_path), action)
     except IOError:
         raise
@@ -87,6 +107,89 @@ def extract_data(data_set, parameter, time=0):
         raise
 
 
+def missing_to_nan(values, missing=MISSING_VALUE):
+    """
+    This function converts values read from a file to the representation of the compute steps:
+        a new float32 array, with NaN for the missing values (and for the masked values of a masked array)
+    Args:
+        values: numpy array or masked array of the values
+        missing (float): optional missing value of the file (default is -9999.0)
+
+    Returns:
+        numpy float32 array of the values
+    """
+    data = np.array(ma.getdata(values), dtype=np.float32)
+    data[data == np.float32(missing)] = np.nan
+    if ma.is_masked(values):
+        data[ma.getmaskarray(values)] = np.nan
+    return data
+
+
+def nan_to_missing(values, missing=MISSING_VALUE):
+    """
+    This function converts the values of the compute steps to the representation of the files: NaN is replaced
+        by the missing value
+    Args:
+        values: numpy array of the values, with NaN for the missing values
+        missing (float): optional missing value of the file (default is -9999.0)
+
+    Returns:
+        numpy float32 array of the values
+    """
+    data = np.array(values, dtype=np.float32)
+    data[np.isnan(data)] = missing
+    return data
+
+
+@telemetry.timed('extract_values')
+def extract_values(data_set, parameter, time=0):
+    """
+    This function extracts the data values of a NetCDF variable for the compute steps (see missing_to_nan)
+    Args:
+        data_set (NetCDF4): class object of a read NetCDF file
+        parameter (str): name of the parameter to extract data for
+        time (int): optional index of the time array (default is 0), or -1 for all times
+
+    Returns:
+        2D/3D numpy float32 array of the values, with NaN for the missing values
+    """
+    try:
+        variable = data_set.variables[parameter]
+        return missing_to_nan(variable[time] if time >= 0 else variable[:])
+    except IOError:
+        raise
+    except Exception:
+        raise
+
+
+@telemetry.timed('extract_window')
+def extract_window(data_set, parameter, rows, columns, time=0):
+    """
+    This function extracts a window of a NetCDF variable as a numpy array
+        Only the requested hyperslab is read from the file, not the full global grid
+        The values are read as float32, the type of the raw data (e.g. FLDAS); the interpolation of the ingestion
+        computes in float64 (see subgrid_calculations.interpolate_cells) to match its reference implementation
+    Args:
+        data_set (NetCDF4): class object of a read NetCDF file
+        parameter (str): name of the parameter to extract data for
+        rows (slice): range of the rows to read
+        columns (slice): range of the columns to read
+        time (int): optional index of the time array, for variables with a time dimension (default is 0)
+
+    Returns:
+        2D numpy float32 array of the values
+    """
+    try:
+        variable = data_set.variables[parameter]
+        if variable.ndim == 3:
+            return np.array(variable[time, rows, columns], dtype=np.float32)
+        return np.array(variable[rows, columns], dtype=np.float32)
+    except IOError:
+        raise
+    except Exception:
+        raise
+
+
 def extract_data_range(data_set, parameter, start, stop):
     """
     This function extracts the data from a NetCDF variable across a given time range as a numpy array
@@ -137,9 +240,21 @@ def get_parameter_units(data_set, parameter):
         raise
 
 
-def initialize_dataset(file_path, properties):
+def initialize_dataset(file_path, properties, unlimited_time=False):
+    """
+    This function creates a NetCDF file with the latitude, longitude and time dimensions of the properties
+    Args:
+        file_path (str): fully-qualified path/name of the NetCDF file
+        properties (dictionary): latitudes, longitudes, times and time_units of the file
+        unlimited_time (boolean): optional flag to create an extendable time dimension (default is False)
+
+    Returns:
+        NetCDF4 Dataset object, opened for writing
+    """
     data_set = None
     try:
+        cube_cache.discard(file_path)
+        telemetry.count_file()
         data_set = Dataset(file_path, 'w', 'NETCDF4')
 
         today = datetime.today()
@@ -154,7 +269,7 @@ def initialize_dataset(file_path, properties):
         # create dimensions #
         data_set.createDimension('latitude', len(latitudes))
         data_set.createDimension('longitude', len(longitudes))
-        data_set.createDimension('time', len(times))
+        data_set.createDimension('time', None if unlimited_time else len(times))
 
         # populate dimension variables #
         # latitude #
@@ -192,3 +307,97 @@ def initialize_dataset(file_path, properties):
         if data_set is not None:
             data_set.close()
         raise
+
+
+def open_dataset_for_update(file_path, properties):
+    """
+    This function opens an existing NetCDF file in append mode if it can be updated to the given properties:
+        the same latitudes, longitudes and time units, an extendable time dimension, and times that start with its own times
+    Args:
+        file_path (str): fully-qualified path/name of the NetCDF file
+        properties (dictionary): latitudes, longitudes, times and time_units the file should have
+
+    Returns:
+        NetCDF4 Dataset object opened in append mode, or None if the file does not exist or can not be updated
+    """
+    if not os.path.isfile(file_path):
+        return None
+    data_set = open_dataset(file_path, 'a')
+    try:
+        times = np.asarray(properties['times'], dtype=float)
+        current_times = np.array(data_set.variables['time'][:], dtype=float)
+        if (
+            data_set.dimensions['time'].isunlimited()
+            and data_set.variables['time'].units == properties['time_units']
+            and np.array_equal(np.array(data_set.variables['latitude'][:]), np.asarray(properties['latitudes'], dtype=float))
+            and np.array_equal(np.array(data_set.variables['longitude'][:]), np.asarray(properties['longitudes'], dtype=float))
+            and len(current_times) <= len(times)
+            and np.array_equal(current_times, times[:len(current_times)])
+        ):
+            # extend the time dimension #
+            data_set.variables['time'][len(current_times):] = times[len(current_times):]
+            return data_set
+        data_set.close()
+        return None
+    except IOError:
+        data_set.close()
+        raise
+    except Exception:
+        data_set.close()
+        raise
+
+
+def get_storage_options(data_set, dimensions, storage=None):
+    """
+    This function returns the compression and chunking options of a storage profile for a new variable
+    Args:
+        data_set (NetCDF4): class object of a NetCDF file opened for writing
+        dimensions (tuple of str): names of the dimensions of the variable
+        storage (dictionary): optional storage settings: profile, complevel, shuffle (default is the original layout)
+
+    Returns:
+        dictionary of keyword arguments for createVariable
+    """
+    profile = 'none' if storage is None else storage.get('profile', 'none')
+    if profile not in STORAGE_PROFILES:
+        raise ValueError("Unknown NetCDF storage profile: {} (expected one of {})".format(profile, ', '.join(STORAGE_PROFILES)))
+    if profile == 'none':
+        return {}
+    chunks = []
+    for name in dimensions:
+        size = max(len(data_set.dimensions[name]), 1)
+        if data_set.dimensions[name].isunlimited():
+            # an unlimited dimension grows after the variable is created (e.g. the working cubes start empty), #
+            # so its chunk size does not follow its current length #
+            size = SERIES_CHUNK_TIMES
+        if name == 'time':
+            chunks.append(1 if profile == 'time_step' else min(size, SERIES_CHUNK_TIMES))
+        else:
+            chunks.append(size if profile == 'time_step' else min(size, SERIES_CHUNK_CELLS))
+    return {
+        'compression': 'zlib',
+        'complevel': int(storage.get('complevel', 4)),
+        'shuffle': bool(storage.get('shuffle', True)),
+        'chunksizes': tuple(chunks)
+    }
+
+
+def create_variable(data_set, name, storage=None, datatype='float32', dimensions=('time', 'latitude', 'longitude')):
+    """
+    This function creates a data variable in a NetCDF file with the layout of a storage profile
+    Args:
+        data_set (NetCDF4): class object of a NetCDF file opened for writing
+        name (str): name of the variable
+        storage (dictionary): optional storage settings (the netcdf_storage configuration item)
+        datatype (str): optional data type of the variable (default is float32)
+        dimensions (tuple of str): optional dimensions of the variable (default is time, latitude, longitude)
+
+    Returns:
+        NetCDF4 Variable object
+    """
+    try:
+        return data_set.createVariable(name, datatype, dimensions, **get_storage_options(data_set, dimensions, storage))
+    except IOError:
+        raise
+    except Exception:
+        raise
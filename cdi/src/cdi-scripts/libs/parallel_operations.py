@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import traceback
+
+
+def _describe_error(error):
+    """
+    This function formats an exception for the failure report
+    """
+    return "{}: {}".format(type(error).__name__, error)
+
+
+def run_tasks(task, items, workers=1, use_threads=False, callback=None):
+    """
+    This function runs a task for each item, in a pool of worker processes if more than 1 worker is requested
+        A failing item does not stop the other items: the failures are collected and returned
+    Args:
+        task (function): function to call with each item; with worker processes it must be picklable
+            (a module-level function or a method of a picklable object)
+        items (list): the items to process
+        workers (int): optional number of workers (default is 1: run in the current process)
+        use_threads (boolean): optional flag to use worker threads instead of processes,
+            for tasks that wait on external programs (default is False)
+        callback (function): optional function called in the current process with each item and the result of its task,
+            e.g. to write the results of all items to a single file; an error in the callback is a failure of the item
+
+    Returns:
+        dictionary of item -> error description for the items that failed, in the order of the items
+    """
+    failures = {}
+    if workers is None or workers <= 1 or len(items) <= 1:
+        for item in items:
+            try:
+                result = task(item)
+                if callback is not None:
+                    callback(item, result)
+            except Exception as ex:
+                traceback.print_exc()
+                failures[item] = _describe_error(ex)
+    else:
+        pool = ThreadPoolExecutor if use_threads else ProcessPoolExecutor
+        with pool(max_workers=min(workers, len(items))) as executor:
+            futures = {executor.submit(task, item): item for item in items}
+            for future in as_completed(futures):
+                error = future.exception()
+                if error is None and callback is not None:
+                    try:
+                        callback(futures[future], future.result())
+                    except Exception as ex:
+                        traceback.print_exc()
+                        error = ex
+                if error is not None:
+                    failures[futures[future]] = _describe_error(error)
+    return {item: failures[item] for item in items if item in failures}
+
+
+def report_failures(failures, total, description, unit='files'):
+    """
+    This function prints the failed items of run_tasks and raises an error if there are any
+    Args:
+        failures (dictionary): item -> error description, as returned by run_tasks
+        total (int): the number of items that were processed (None if unknown)
+        description (str): description of the processing, for the messages (e.g. 'LST HDF to NetCDF conversion')
+        unit (str): optional name of the processed items, for the messages (default is 'files')
+    """
+    if len(failures) == 0:
+        return
+    for item in failures.keys():
+        print("-- {} failed for {}: {}".format(description, item, failures[item]))
+    if total is None:
+        raise RuntimeError("{} failed for {} {}".format(description, len(failures), unit))
+    raise RuntimeError("{} failed for {} of {} {}".format(description, len(failures), total, unit))
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import libs.cube_cache as cube_cache
+import libs.netcdf_functions as netcdf
+import libs.parallel_operations as parallel
+from libs.statistics_operations import StatisticOperations
+
+
+class MonthlyRanking:
+    """
+    This class percent-ranks monthly series: the values of each calendar month are ranked over the years, per variable
+        The series of a month is read from the input file with a single strided read (time steps index, index + 12, ...)
+        and its ranks are written to the output file with a single strided write
+        The months of all variables can be ranked in a pool of worker processes; the ranks are always written by the
+        current process, so the output file has a single writer
+        When the cube cache is enabled (the fused mode of STEP_0000), the values are taken from the cache if the input
+        file was written by an earlier step of the process, and the ranks are added to the cache
+        The input can also be a working cube (see CubeStore), whose dates do not need to be consecutive months: the time
+        steps are then grouped by the calendar month of their dates and read through the cube
+    """
+    def __init__(self, input_file, output_file, variables, number_of_months, first_time=0, skip_missing_years=False, cube=None):
+        """
+        Args:
+            input_file (str): fully-qualified path/name of the NetCDF file of the values
+            output_file (str): fully-qualified path/name of the NetCDF file of the ranks, with the output variables created
+            variables (dictionary): input variable name -> output variable name
+            number_of_months (int): number of time steps to rank
+            first_time (int): optional index of the first time step to rank in the input file (default is 0),
+                the ranks are written from the first time step of the output file
+            skip_missing_years (boolean): optional flag to leave the years where all values of the month are missing
+                out of the ranking, their ranks are set to missing (default is False)
+            cube (CubeStore): optional read-only working cube of the input file, not open; the ranks of its dates are written to
+                the time steps of the output file in the same order (default is None: the input file is read by index)
+        """
+        self.__stats = StatisticOperations()
+        self.__input_file = input_file
+        self.__output_file = output_file
+        self.__variables = variables
+        self.__number_of_months = number_of_months
+        self.__first_time = first_time
+        self.__skip_missing_years = skip_missing_years
+        self.__missing = -9999.0
+        self.__cube = cube
+        self.__month_dates = None
+        if cube is None:
+            self.__month_times = [slice(index, number_of_months, 12) for index in range(0, min(12, number_of_months))]
+        else:
+            # group the time steps by the calendar month of their dates #
+            with cube:
+                dates = cube.get_dates()[:number_of_months]
+            months = {}
+            for t, d in enumerate(dates):
+                months.setdefault(d[4:6], []).append(t)
+            self.__month_times = list(months.values())
+            self.__month_dates = [[dates[t] for t in times] for times in self.__month_times]
+
+    def get_items(self):
+        """
+        This function returns the items to rank
+        Returns:
+            List of (input variable name, 0-11 index of the month) tuples
+        """
+        return [(v, index) for v in self.__variables.keys() for index in range(0, len(self.__month_times))]
+
+    def rank_month(self, item):
+        """
+        This function ranks the series of a variable for a month
+        Args:
+            item (tuple): input variable name and the 0-11 index of the month
+
+        Returns:
+            3D numpy float32 array of the ranked values, one time step per year, with NaN for the missing values
+        """
+        variable, index = item
+        # read the time steps of the month #
+        if self.__cube is not None:
+            with self.__cube:
+                values = self.__cube.read(variable, self.__month_dates[index])
+            return self.__rank_values(values)
+        start = self.__first_time + index
+        stop = self.__first_time + self.__number_of_months
+        cached_values = cube_cache.get(self.__input_file, variable)
+        if cached_values is not None:
+            values = netcdf.missing_to_nan(cached_values[start:stop:12], self.__missing)
+        else:
+            data_set = netcdf.open_dataset(self.__input_file)
+            try:
+                values = netcdf.missing_to_nan(data_set.variables[variable][start:stop:12], self.__missing)
+            finally:
+                data_set.close()
+        return self.__rank_values(values)
+
+    def __rank_values(self, values):
+        """
+        This function ranks the values of a month over the years, with NaN for the missing values
+        """
+        if not self.__skip_missing_years:
+            return self.__stats.rank_parameter(values)
+        # rank the years that have values, and set the other years to missing #
+        valid_years = ~np.all(np.isnan(values), axis=(1, 2))
+        ranked_data = np.full(values.shape, np.nan, dtype=np.float32)
+        if np.any(valid_years):
+            ranked_data[valid_years] = self.__stats.rank_parameter(values[valid_years])
+        return ranked_data
+
+    def __write_month(self, data_set, item, ranked_data, cubes):
+        """
+        This function writes the ranks of a variable for a month to the output file, and to its cube for the cache
+        """
+        variable, index = item
+        ranked_data = netcdf.nan_to_missing(ranked_data, self.__missing)
+        times = self.__month_times[index]
+        data_set.variables[self.__variables[variable]][times] = ranked_data
+        if cubes is not None:
+            if variable not in cubes:
+                cubes[variable] = np.full((self.__number_of_months,) + ranked_data.shape[1:], self.__missing, dtype=np.float32)
+            cubes[variable][times] = ranked_data
+
+    def run(self, workers=1):
+        """
+        This function ranks all months of all variables and writes the ranks to the output file
+        Args:
+            workers (int): optional number of worker processes (default is 1: rank in the current process)
+
+        Returns:
+            dictionary of item -> error description for the items that failed (see parallel_operations.run_tasks)
+        """
+        cubes = {} if cube_cache.is_enabled() else None
+        output_data_set = netcdf.open_dataset(self.__output_file, 'a')
+        try:
+            failures = parallel.run_tasks(self.rank_month, self.get_items(), workers,
+                                          callback=lambda item, ranked_data: self.__write_month(output_data_set, item, ranked_data, cubes))
+        finally:
+            output_data_set.close()
+        # keep the ranks of the variables that have been written for all months #
+        for variable in (cubes or {}).keys():
+            if not any(v == variable for v, index in failures.keys()):
+                cube_cache.put(self.__output_file, self.__variables[variable], cubes[variable], self.__missing)
+        return failures
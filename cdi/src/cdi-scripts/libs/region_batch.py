@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+from contextlib import ExitStack
+import traceback
+from libs.config_reader import ConfigParser
+import libs.parallel_operations as parallel
+
+
+def select_regions(names):
+    """
+    This function resolves the regions of the --regions option of the steps
+    Args:
+        names (list of str): the region names of the option, an empty list for all the regions of the settings,
+            or None if the option was not given
+
+    Returns:
+        List of the region names, or None for the region of region_name/bounds only
+    """
+    if names is None:
+        return None
+    if len(names) == 0:
+        return ConfigParser().get_region_names()
+    for name in names:
+        ConfigParser(name)  # raises a ValueError for unknown regions #
+    return list(names)
+
+
+class RegionBatch:
+    """
+    This class converts the raw files of several regions with one read of each raw file: every raw file is opened once,
+        and the SubGrids of all the regions that need the file are cut from the open file in one pass
+        Each region is converted by its own ingestion object (e.g. the LandSurfaceTemp of the region), which provides:
+            open_raw_file(file_name): opens a raw file and returns the open data set
+            process_raw_file(file_name, data_set): returns the values of the region from the open raw file
+            open_working_cube(): returns the working cube of the region (see CubeStore)
+            reserve_raw_files(cube, files): reserves the time slots of raw files in the working cube
+            store_raw_result(cube, file_name, result): writes the values of a raw file to the working cube
+            record_raw_files(files, failures): records the converted raw files in the file catalog of the region
+        The raw files are converted in parallel worker processes if requested; the values are written to the working
+        cubes by the current process, so the workers never write the same file
+    """
+    def __init__(self, ingestions):
+        """
+        Args:
+            ingestions (dictionary): region name -> ingestion object of the region
+        """
+        self.__ingestions = ingestions
+        self.__file_regions = {}
+
+    def process_file(self, file_name):
+        """
+        This function cuts the values of all the regions that need a raw file from the file, opened once
+            A region that fails does not stop the other regions
+        Args:
+            file_name (str): name of the raw file
+
+        Returns:
+            dictionary of region name -> (result, None) or (None, error description)
+        """
+        regions = self.__file_regions[file_name]
+        data_set = self.__ingestions[regions[0]].open_raw_file(file_name)
+        try:
+            results = {}
+            for region in regions:
+                try:
+                    results[region] = (self.__ingestions[region].process_raw_file(file_name, data_set), None)
+                except Exception as ex:
+                    traceback.print_exc()
+                    results[region] = (None, "{}: {}".format(type(ex).__name__, ex))
+            return results
+        finally:
+            data_set.close()
+
+    def run(self, files, workers=1):
+        """
+        This function converts the raw files of the regions
+        Args:
+            files (dictionary): region name -> list of the names of the raw files to convert for the region
+            workers (int): optional number of worker processes (default is 1: convert in the current process)
+
+        Returns:
+            dictionary of '<region>: <raw file name>' -> error description for the files that failed
+        """
+        self.__file_regions = {}
+        for region in self.__ingestions.keys():
+            for f in files.get(region, []):
+                self.__file_regions.setdefault(f, []).append(region)
+        failures = {region: {} for region in self.__ingestions.keys()}
+        with ExitStack() as stack:
+            cubes = {}
+            for region, ingestion in self.__ingestions.items():
+                cubes[region] = stack.enter_context(ingestion.open_working_cube())
+                ingestion.reserve_raw_files(cubes[region], files.get(region, []))
+
+            def store(file_name, results):
+                for region, (result, error) in results.items():
+                    if error is None:
+                        try:
+                            self.__ingestions[region].store_raw_result(cubes[region], file_name, result)
+                        except Exception as ex:
+                            traceback.print_exc()
+                            error = "{}: {}".format(type(ex).__name__, ex)
+                    if error is not None:
+                        failures[region][file_name] = error
+
+            # a raw file that can not be opened fails for all its regions #
+            for f, error in parallel.run_tasks(self.process_file, sorted(self.__file_regions.keys()), workers, callback=store).items():
+                for region in self.__file_regions[f]:
+                    failures[region].setdefault(f, error)
+            for region, ingestion in self.__ingestions.items():
+                ingestion.record_raw_files(files.get(region, []), failures[region])
+        return {"{}: {}".format(region, f): failures[region][f]
+                for region in self.__ingestions.keys() for f in files.get(region, []) if f in failures[region]}
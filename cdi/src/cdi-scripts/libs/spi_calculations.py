@@ -1,10 +1,13 @@
 # -*- coding: utf-8 -*-
 import numpy as np
 import numpy.ma as ma
+import scipy.special as special
 import scipy.stats as stats
 import warnings
+import libs.telemetry as telemetry
 
 
+@telemetry.timed('calculate_monthly_spi')
 def calculate_monthly_spi(values):
     """
     This function calculates the Standardized Precipitation Index according to
@@ -44,3 +47,105 @@ def calculate_monthly_spi(values):
         raise
     except Exception:
         raise
+
+
+@telemetry.timed('calculate_monthly_spi_fast')
+def calculate_monthly_spi_fast(values, dtype=np.float32):
+    """
+    This function calculates the Standardized Precipitation Index with the same method and estimator limits as
+        calculate_monthly_spi, evaluating the gamma and normal distributions with the scipy.special functions
+        The fitting statistics are accumulated one year at a time in float64,
+        and the SPI is written one year at a time into a preallocated output array
+        Results match calculate_monthly_spi, as called by STEP_0103 with a list of 2D arrays, to the precision of the output type:
+            months without precipitation have the probability of no precipitation (H(0) = q),
+            and grid points without precipitation in any year are infinite
+    Args:
+        values: numpy 3D array (or list of 2D arrays) of monthly precipitation values per year in mm/month
+        dtype: optional numpy type of the output array (default is float32)
+
+    Returns:
+        numpy 3D array of monthly SPI values
+    """
+    try:
+        period_length = len(values)
+        # accumulate the count, sum and sum of logarithms of the precipitation values #
+        precip_count = None
+        precip_total = None
+        period_log_total = None
+        for v in values:
+            v = np.asarray(v, dtype=float)
+            if precip_count is None:
+                precip_count = np.zeros(v.shape)
+                precip_total = np.zeros(v.shape)
+                period_log_total = np.zeros(v.shape)
+            precip_count += (v != 0.0)
+            precip_total += v
+            np.add(period_log_total, np.log(v, out=np.zeros(v.shape), where=(v > 0.0)), out=period_log_total)
+        # placeholders for the grid points without precipitation, to keep the fitting finite #
+        has_precip = precip_count > 0
+        count = np.where(has_precip, precip_count, 1.0)
+        # calculate the â value #
+        mean_precip = np.where(has_precip, precip_total / count, 1.0)
+        alpha = np.maximum(0.01, np.log(mean_precip) - (period_log_total / period_length))  # limit to prevent errors
+        alpha_hat = np.reciprocal(alpha * 4.0) * (1.0 + np.sqrt(1.0 + (1.333334 * alpha)))
+        # calculate the ß value #
+        beta_hat = np.maximum(0.0001, mean_precip / alpha_hat)  # limit to prevent errors
+        # calculate the q value (m/n where m is the sum of zero values and n is the number of years) #
+        q_factor = np.clip((period_length - precip_count) / period_length, 0.0, 1.0)  # q should be between 0.0 and 1.0
+        # compute the SPI per year #
+        spi_values = np.empty((period_length,) + precip_count.shape, dtype=dtype)
+        buffer = np.empty(precip_count.shape)
+        for y, v in enumerate(values):
+            v = np.asarray(v, dtype=float)
+            # calculate the Gamma Cumulative Distribution #
+            np.divide(v, beta_hat, out=buffer)
+            special.gammainc(alpha_hat, buffer, out=buffer)
+            # calculate the cumulative probability H(x) #
+            np.multiply(buffer, 1.0 - q_factor, out=buffer)
+            np.add(buffer, q_factor, out=buffer)
+            # convert to a standard distribution #
+            special.ndtri(buffer, out=buffer)
+            spi_values[y] = buffer
+        return spi_values
+    except ValueError:
+        raise
+    except Exception:
+        raise
+
+
+def calculate_period_totals(values, periods):
+    """
+    This function calculates the precipitation totals of several periods (1-month, 3-month, etc.) in a single pass
+        The totals of all periods are differences of shared cumulative sums along the time axis,
+        which are accumulated in float64 so the differences keep the precision of the monthly values
+        The total of a month is the sum of the values that are not missing in the period ending with that month,
+        and is missing if all the values of the period are missing
+        The first (period - 1) months have no total for the period
+    Args:
+        values: numpy 3D array of consecutive monthly precipitation values in mm/month, with NaN for the missing values
+        periods (list of int): the numbers of months to total
+
+    Returns:
+        dictionary of period -> numpy 3D float32 array of the totals, with NaN for the missing totals
+    """
+    try:
+        data = np.asarray(values, dtype=np.float32)
+        valid = ~np.isnan(data)
+        # cumulative sums of the values and of the number of values, starting with 0 #
+        precip_sums = np.zeros((data.shape[0] + 1,) + data.shape[1:])
+        np.cumsum(np.where(valid, data, np.float32(0.0)), axis=0, out=precip_sums[1:])
+        precip_counts = np.zeros((data.shape[0] + 1,) + data.shape[1:], dtype=np.int32)
+        np.cumsum(valid, axis=0, out=precip_counts[1:])
+        totals = {}
+        for period in periods:
+            period_totals = np.full(data.shape, np.nan, dtype=np.float32)
+            if period <= data.shape[0]:
+                period_sums = precip_sums[period:] - precip_sums[:-period]
+                period_counts = precip_counts[period:] - precip_counts[:-period]
+                period_totals[(period - 1):] = np.where(period_counts > 0, period_sums, np.nan)
+            totals[period] = period_totals
+        return totals
+    except ValueError:
+        raise
+    except Exception:
+        raise
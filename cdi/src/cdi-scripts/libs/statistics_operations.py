@@ -1,14 +1,13 @@
 import libs.netcdf_functions as netcdf
+import libs.telemetry as telemetry
 import numpy as np
-import numpy.ma as ma
 
 
 class StatisticOperations:
     """
     This is the class for computing anomalies and rankings
+        The values are float32 arrays with NaN for the missing values (see netcdf_functions.missing_to_nan)
     """
-    def __init__(self):
-        self.__missing = -9999.0
 
     def compute_anomalies_from_files(self, files, parameter):
         """
@@ -21,30 +20,151 @@ class StatisticOperations:
             parameter (str): the name of the NetCDF parameter to load
 
         Returns:
-            List of 2D numpy arrays containing the anomaly values
+            3D numpy float32 array of the anomaly values, one per file
         """
         try:
             month_values = []
             # load the data #
             for f in files:
                 data_set = netcdf.open_dataset(f)
-                month_values.append(netcdf.extract_data(data_set, parameter, -1))
+                month_values.append(netcdf.extract_values(data_set, parameter, -1))
                 data_set.close()
-            masked_values = ma.masked_equal(month_values, self.__missing)  # mask out missing data
-            mask = np.where(np.mean(month_values, axis=0) == self.__missing, 1, 0)
-            # compute the mean delta value #
-            month_mean = ma.mean(masked_values, axis=0)
-            # masked_mean = ma.masked_equal(month_mean, self.__missing)
-            # compute the standard deviation #
-            month_std = ma.std(masked_values, axis=0, ddof=1)
-            # masked_std = ma.masked_equal(month_std, self.__missing)
-            # compute the anomaly for each month #
-            anomalies = []
-            for values in masked_values:
-                month_anomaly = np.ma.true_divide(np.ma.subtract(values, month_mean), month_std)
-                masked_anomaly = np.ma.masked_where(mask, month_anomaly.filled(0.0))
-                anomalies.append(month_anomaly.filled(self.__missing))
-            return anomalies
+            return self.compute_anomalies_from_values(month_values)
+        except ValueError:
+            raise
+        except Exception:
+            raise
+
+    def __read_month_values(self, file_path, parameter):
+        """
+        This function reads the values of a parameter from a single time step NetCDF file
+        Args:
+            file_path (str): fully-qualified path/name of the NetCDF file
+            parameter (str): the name of the NetCDF parameter to load
+
+        Returns:
+            2D numpy float32 array of the values
+        """
+        data_set = None
+        try:
+            data_set = netcdf.open_dataset(file_path)
+            return netcdf.extract_values(data_set, parameter, 0)
+        except IOError:
+            raise
+        except Exception:
+            raise
+        finally:
+            if data_set is not None:
+                data_set.close()
+
+    def compute_month_statistics(self, files, parameter):
+        """
+        This function computes the mean and standard deviation per grid point of a month across its yearly files
+            (see compute_statistics)
+        Args:
+            files (List[str]): The month to process per year
+            parameter (str): the name of the NetCDF parameter to load
+
+        Returns:
+            2D numpy float64 arrays of the mean and the standard deviation
+        """
+        if len(files) == 0:
+            raise ValueError("No files to compute the {} statistics from".format(parameter))
+        return self.compute_statistics(files, lambda f: self.__read_month_values(f, parameter))
+
+    def compute_statistics(self, items, read_values):
+        """
+        This function computes the mean and standard deviation per grid point of a month across its years
+            The statistics are accumulated in a single pass with Welford's online algorithm,
+            so only one year of data is held in memory at a time; the sums are accumulated in float64
+            Missing values are skipped and the standard deviation uses ddof=1
+        Args:
+            items (List): the years of the month to process (e.g. file names, or dates of a working cube)
+            read_values (function): returns the numpy array of the values of an item, with NaN for the missing values
+
+        Returns:
+            numpy float64 arrays of the mean and the standard deviation:
+                the mean is NaN where no year has a value,
+                the standard deviation where fewer than 2 years have a value or all values are equal
+        """
+        try:
+            if len(items) == 0:
+                raise ValueError("No values to compute the statistics from")
+            count = None
+            month_mean = None
+            sum_squares = None
+            for item in items:
+                values = read_values(item)
+                if count is None:
+                    count = np.zeros(values.shape)
+                    month_mean = np.zeros(values.shape)
+                    sum_squares = np.zeros(values.shape)
+                valid = ~np.isnan(values)
+                # update the count, the mean and the sum of squared differences from the mean #
+                # infinite values (e.g. SPI of a month without rain) give NaN statistics, as with the masked arrays #
+                with np.errstate(invalid='ignore'):
+                    count += valid
+                    delta = np.where(valid, values - month_mean, 0.0)
+                    month_mean += np.divide(delta, count, out=np.zeros(values.shape), where=valid)
+                    sum_squares += delta * np.where(valid, values - month_mean, 0.0)
+            month_std = np.sqrt(np.divide(sum_squares, count - 1, out=np.zeros(count.shape), where=count > 1))
+            month_mean[count == 0] = np.nan
+            month_std[np.logical_or(count < 2, month_std == 0.0)] = np.nan
+            return month_mean, month_std
+        except ValueError:
+            raise
+        except Exception:
+            raise
+
+    def write_anomalies_from_files(self, files, parameter, variable, start_index, step=12):
+        """
+        This function computes the anomaly per grid point per year for a particular month from its yearly files,
+            and writes each year straight into the output variable (see write_anomalies)
+            The anomalies are the same as those of compute_anomalies_from_files
+            The missing values are written as -9999.0 (see netcdf_functions.nan_to_missing)
+        Args:
+            files (List[str]): The month to process per year
+            parameter (str): the name of the NetCDF parameter to load
+            variable (NetCDF4 Variable): the output variable
+            start_index (int): time index of the first year in the output variable
+            step (int): optional number of time steps between years in the output variable (default is 12)
+
+        Returns:
+            the number of years written
+        """
+        return self.write_anomalies(files, lambda f: self.__read_month_values(f, parameter), variable, start_index, step)
+
+    def write_anomalies(self, items, read_values, variable, start_index, step=12, cube=None):
+        """
+        This function computes the anomaly per grid point per year for a particular month, and writes each year straight
+            into the output variable
+            The first pass over the years computes the statistics (compute_statistics),
+            the second pass reads one year at a time, so the memory used does not grow with the number of years
+        Args:
+            items (List): the years of the month to process (e.g. file names, or dates of a working cube)
+            read_values (function): returns the 2D numpy array of the values of an item, with NaN for the missing values
+            variable (NetCDF4 Variable): the output variable, the missing values are written as -9999.0
+            start_index (int): time index of the first year in the output variable
+            step (int): optional number of time steps between years in the output variable (default is 12)
+            cube (numpy array): optional 3D float32 array that receives the written values at the same time indices
+                (e.g. for the cube cache, see cube_cache)
+
+        Returns:
+            the number of years written
+        """
+        try:
+            if len(items) == 0:
+                return 0
+            month_mean, month_std = self.compute_statistics(items, read_values)
+            index = start_index
+            for item in items:
+                with np.errstate(invalid='ignore'):
+                    month_anomaly = netcdf.nan_to_missing((read_values(item) - month_mean) / month_std)
+                variable[index] = month_anomaly
+                if cube is not None:
+                    cube[index] = month_anomaly
+                index += step  # increment 1 year
+            return len(items)
         except ValueError:
             raise
         except Exception:
@@ -52,70 +172,123 @@ class StatisticOperations:
 
     def compute_anomalies_from_values(self, values):
         """
-        This function loads yearly for a particular month, and computes the anomaly per grid point per year
+        This function computes the anomaly per grid point per year for a particular month
             Anomalies are computed using the delta from the mean, vs. the standard deviation
             For each grid point:
                 Anomaly = (monthly value for that year - mean of monthly value for all years) / standard deviation of yearly values
+            The anomalies are NaN where the value is missing, or where the standard deviation is missing (see compute_statistics)
         Args:
-            values (List[]): list of numpy 2D arrays
+            values: list of numpy arrays (or numpy array) of the values per year, with NaN for the missing values
 
         Returns:
-            List of 2D numpy arrays containing the anomaly values
+            numpy float32 array of the anomaly values, with the shape of the values
         """
         try:
-            month_values = ma.masked_equal(values, self.__missing)  # mask out missing data
-            # compute the mean delta value #
-            month_mean = ma.average(month_values, axis=0)
-            masked_mean = ma.masked_equal(month_mean, self.__missing)
-            # compute the standard deviation #
-            month_std = ma.std(month_values, axis=0, ddof=1)
-            masked_std = ma.masked_equal(month_std, self.__missing)
-            # compute the anomaly for each month #
-            anomalies = []
-            for values in month_values:
-                month_anomaly = (values-masked_mean)/masked_std
-                masked_anomaly = month_anomaly.filled(self.__missing)
-                anomalies.append(masked_anomaly)
+            month_mean, month_std = self.compute_statistics(range(0, len(values)), lambda y: values[y])
+            # compute the anomaly for each year #
+            anomalies = np.empty((len(values),) + month_mean.shape, dtype=np.float32)
+            with np.errstate(invalid='ignore'):
+                for y in range(0, len(values)):
+                    np.divide(np.subtract(values[y], month_mean), month_std, out=anomalies[y])
             return anomalies
         except ValueError:
             raise
         except Exception:
             raise
 
-    def rank_parameter(self, values):
+    @telemetry.timed('rank_parameter')
+    def rank_parameter(self, values, method='sort'):
+        """
+        This function ranks values over a time period on a 0.0 to 1.0 scale
+            The rank of a value is the mean of its strict and weak rank (the SciPy Stats "mean" rank),
+            divided by the highest rank of the grid point + 1
+            A grid point with a missing value in any of the time steps is missing for all time steps
+        Args:
+            values: 3D numpy array of the values over time for an area, with NaN for the missing values
+            method (str): ranking kernel to use:
+                'sort' (default) sorts the values along the time axis once - O(n log n) per grid point
+                'pairwise' compares every time step against all others - O(n^2) per grid point, kept for verification
+
+        Returns:
+            3D numpy float32 array of the ranked values for the area, with NaN for the missing values
+        """
+        if method == 'sort':
+            return self.__rank_sorted(values)
+        elif method == 'pairwise':
+            return self.__rank_pairwise(values)
+        else:
+            raise ValueError("Unknown ranking method: '{}'".format(method))
+
+    def __rank_sorted(self, values):
+        """
+        This function ranks values over a time period on a 0.0 to 1.0 scale by sorting along the time axis
+            For a value at sorted position k, the strict rank (number of smaller values) is the first position of its tie group
+            and the weak rank (number of smaller or equal values, excluding itself) is the last position of its tie group
+        Args:
+            values: 3D numpy array of the values over time for an area, with NaN for the missing values
+
+        Returns:
+            3D numpy float32 array of the ranked values for the area
+        """
+        try:
+            data = np.asarray(values, dtype=np.float32)
+            # grid points with any missing value are missing for all time steps #
+            missing_points = np.any(np.isnan(data), axis=0)
+            # sort the values along the time axis #
+            order = np.argsort(data, axis=0, kind='stable')
+            sorted_data = np.take_along_axis(data, order, axis=0)
+            count = data.shape[0]
+            positions = np.arange(count, dtype=np.float32).reshape((count,) + (1,) * (data.ndim - 1))
+            # first position of each tie group: the strict rank #
+            group_start = np.ones(data.shape, dtype=bool)
+            group_start[1:] = sorted_data[1:] != sorted_data[:-1]
+            strict_ranks = np.maximum.accumulate(np.where(group_start, positions, np.float32(0.0)), axis=0)
+            # last position of each tie group: the weak rank #
+            group_end = np.ones(data.shape, dtype=bool)
+            group_end[:-1] = sorted_data[:-1] != sorted_data[1:]
+            weak_ranks = np.flip(np.minimum.accumulate(np.flip(np.where(group_end, positions, np.float32(count - 1)), axis=0), axis=0), axis=0)
+            # compute the mean rank and return it to the original time order #
+            ranked_data = np.empty_like(data)
+            np.put_along_axis(ranked_data, order, (strict_ranks + weak_ranks) * 0.5, axis=0)
+            # divide by the highest rank + 1 #
+            pct_data = np.round(np.true_divide(ranked_data, np.amax(ranked_data, axis=0) + 1), 3)
+            pct_data[:, missing_points] = np.nan
+            return pct_data
+        except ValueError:
+            raise
+        except Exception:
+            raise
+
+    def __rank_pairwise(self, values):
         """
         This function ranks values over a time period on a 0.0 to 1.0 scale
             This uses a matrix-based version of the mean rank found in the SciPy Stats module
         Args:
-            values: 3D numpy array of the values over time for an area
+            values: 3D numpy array of the values over time for an area, with NaN for the missing values
 
         Returns:
-            3D numpy array of the ranked values for the area
+            3D numpy float32 array of the ranked values for the area
         """
         try:
-            # mask out missing values #
-            masked_values = ma.masked_equal(values, self.__missing)
+            data = np.asarray(values, dtype=np.float32)
             # create place-holder for the year grids #
-            ranked_data = []
-            # loop thru the sets and add the compare counts to the masks #
-            for j, base_data in enumerate(masked_values):
-                strict_ranks = np.zeros_like(base_data)
-                weak_ranks = np.zeros_like(base_data)
+            ranked_data = np.zeros(data.shape, dtype=np.float32)
+            # loop thru the sets and add the compare counts #
+            for j, base_data in enumerate(data):
+                strict_ranks = np.zeros(base_data.shape, dtype=np.float32)
+                weak_ranks = np.zeros(base_data.shape, dtype=np.float32)
                 # loop thru again and compare the remaining sets against the base #
-                for i, compare_data in enumerate(masked_values):
+                for i, compare_data in enumerate(data):
                     if i != j:  # skip if the same index as the base #
                         # increment the cells based on rank comparison #
-                        np.add(strict_ranks, ma.where(base_data > compare_data, 1, 0), out=strict_ranks)
-                        np.add(weak_ranks, ma.where(base_data >= compare_data, 1, 0), out=weak_ranks)
+                        strict_ranks += base_data > compare_data
+                        weak_ranks += base_data >= compare_data
                 # compute the mean rank #
-                ranks = (strict_ranks + weak_ranks) * 0.5
-                # append the year to the output #
-                ranked_data.append(ranks)
+                ranked_data[j] = (strict_ranks + weak_ranks) * 0.5
             # divide sum by total years #
-            count = np.ma.masked_equal(ma.amax(ranked_data, axis=0) + 1, 0)
-            pct_data = np.round(np.ma.true_divide(np.ma.asarray(ranked_data), count), 3)
-            final_ranks = np.ma.masked_equal(pct_data, self.__missing)
-            return final_ranks
+            pct_data = np.round(np.true_divide(ranked_data, np.amax(ranked_data, axis=0) + 1), 3)
+            pct_data[:, np.any(np.isnan(data), axis=0)] = np.nan
+            return pct_data
         except ValueError:
             raise
         except Exception:
@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import json
+import os
+import time
+import traceback
+from libs.file_operations import get_files_fingerprint
+from libs.hdf_functions import get_h5_path
+from libs.telemetry import StepTelemetry
+
+
+def _get_input_files(paths):
+    """
+    This function lists the files of a list of input paths: a file, or all files below a directory
+        Paths that do not exist are skipped
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                files.extend(os.path.join(root, n) for n in names)
+        elif os.path.isfile(path):
+            files.append(path)
+    return files
+
+
+def _get_signatures(files):
+    """
+    This function returns the modification times and sizes of files, by path
+    """
+    signatures = {}
+    for f in files:
+        stat = os.stat(f)
+        signatures[f] = (stat.st_mtime_ns, stat.st_size)
+    return signatures
+
+
+def _run_step(name, function, args):
+    """
+    This function executes a step and logs the time taken, and its telemetry record if a telemetry run has been started
+        It runs in a worker process of the scheduler, so it is a module-level function
+    """
+    start_time = time.time()
+    try:
+        print("Executing {}...".format(name))
+        with StepTelemetry(name):
+            function(*args)
+    finally:
+        elapsed_time = time.time() - start_time
+        print("{} completed in {:.2f} seconds.\n".format(name, elapsed_time))
+
+
+class StepScheduler:
+    """
+    This class executes the processing steps in the order of their dependencies
+        Steps whose dependencies have completed are started as soon as a worker process is free, so independent steps
+        (e.g. the LST, NDVI and CHIRPS ingestion) run concurrently
+        A step is skipped if the fingerprint of its input files (see file_operations.get_files_fingerprint) is the same as
+        at its last successful run and its output files exist; the fingerprint is taken before the step is started, so
+        files that arrive while it runs are processed by the next run; steps 0101 and 0102 convert their HDF4 inputs to
+        HDF5, so if the only changes to the inputs during the run are such conversions, the fingerprint is taken again
+        when the step has completed; the fingerprints are stored in a JSON file:
+            {"version": 1, "steps": {<step name>: <fingerprint>}}
+        A failed step does not stop the steps that do not depend on it
+    """
+    VERSION = 1
+
+    def __init__(self, state_file):
+        self.__state_file = state_file
+        self.__steps = {}
+        self.__order = []
+        self.__fingerprints = {}
+        self.__load()
+
+    def __load(self):
+        """
+        This function reads the fingerprints of the last successful runs, if the state file exists
+            An unreadable state file is discarded: all steps are then executed
+        """
+        if not os.path.isfile(self.__state_file):
+            return
+        try:
+            with open(self.__state_file, 'r') as fh:
+                state = json.loads(fh.read())
+            if state.get('version') == self.VERSION:
+                self.__fingerprints = state['steps']
+        except (ValueError, KeyError, AttributeError):
+            print("Ignoring unreadable step state file: '{}'".format(self.__state_file))
+            self.__fingerprints = {}
+
+    def __save(self):
+        """
+        This function writes the fingerprints of the successful runs
+            The file is written to a temporary name first, so an interrupted write never leaves a partial state file
+        """
+        temp_path = self.__state_file + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(self.__state_file), exist_ok=True)
+            with open(temp_path, 'w') as fh:
+                fh.write(json.dumps({'version': self.VERSION, 'steps': self.__fingerprints}))
+            os.replace(temp_path, self.__state_file)
+        except IOError:
+            raise
+        except Exception:
+            raise
+
+    def add_step(self, name, function, args=(), depends_on=None, inputs=None, outputs=None):
+        """
+        This function adds a step to the schedule; steps are selected with --from in the order they are added
+        Args:
+            name (str): name of the step (e.g. 'Step 0101')
+            function (function): function that executes the step; it must be picklable (a module-level function)
+            args (tuple): optional arguments of the function
+            depends_on (list of str): optional names of the steps that must complete before this step
+            inputs (list of str): optional fully-qualified paths of the input files and directories of the step
+            outputs (list of str): optional fully-qualified paths of the output files of the step,
+                the step is not skipped if one of them does not exist
+        """
+        for d in depends_on or []:
+            if d not in self.__steps:
+                raise ValueError("{} depends on unknown step: {}".format(name, d))
+        self.__steps[name] = {
+            'function': function,
+            'args': tuple(args),
+            'depends_on': list(depends_on or []),
+            'inputs': list(inputs or []),
+            'outputs': list(outputs or [])
+        }
+        self.__order.append(name)
+
+    def get_step_names(self):
+        """
+        This function returns the names of the steps, in the order they were added
+        """
+        return list(self.__order)
+
+    def select_steps(self, only=None, start=None):
+        """
+        This function selects the steps to execute
+        Args:
+            only (list of str): optional names of the only steps to execute
+            start (str): optional name of the first step to execute: the steps added before it are not executed
+
+        Returns:
+            List of the names of the selected steps, in the order they were added
+        """
+        selected = list(self.__order)
+        if start is not None:
+            if start not in self.__steps:
+                raise ValueError("Unknown step: {}".format(start))
+            selected = selected[self.__order.index(start):]
+        if only is not None:
+            for name in only:
+                if name not in self.__steps:
+                    raise ValueError("Unknown step: {}".format(name))
+            selected = [name for name in selected if name in only]
+        return selected
+
+    def get_fingerprint(self, name, shared_inputs=None):
+        """
+        This function computes the fingerprint of the input files of a step
+        Args:
+            name (str): name of the step
+            shared_inputs (list of str): optional paths of inputs of every step (e.g. the settings files)
+
+        Returns:
+            String of the hexadecimal fingerprint
+        """
+        return get_files_fingerprint(self.__get_input_files(name, shared_inputs))
+
+    def __get_input_files(self, name, shared_inputs):
+        """
+        This function lists the input files of a step
+        """
+        return _get_input_files(list(shared_inputs or []) + self.__steps[name]['inputs'])
+
+    def run(self, steps, jobs=1, force=False, shared_inputs=None):
+        """
+        This function executes the selected steps
+            Dependencies on steps that are not selected are considered complete
+        Args:
+            steps (list of str): names of the steps to execute, as returned by select_steps
+            jobs (int): optional number of steps to execute concurrently in worker processes
+                (default is 1: execute the steps one at a time in the current process)
+            force (boolean): optional flag to execute the steps even if their inputs are unchanged (default is False)
+            shared_inputs (list of str): optional paths of inputs of every step (e.g. the settings files)
+
+        Returns:
+            dictionary of step name -> error description for the steps that failed or were not executed
+        """
+        pending = list(steps)
+        completed = set()
+        failures = {}
+        running = {}
+        executor = ProcessPoolExecutor(max_workers=jobs) if jobs is not None and jobs > 1 else None
+        try:
+            while len(pending) > 0 or len(running) > 0:
+                started = False
+                for name in list(pending):
+                    depends_on = [d for d in self.__steps[name]['depends_on'] if d in steps]
+                    blocked = [d for d in depends_on if d in failures]
+                    if len(blocked) > 0:
+                        pending.remove(name)
+                        failures[name] = "not executed: {} failed".format(', '.join(blocked))
+                        print("{} not executed: {} failed".format(name, ', '.join(blocked)))
+                        started = True
+                        continue
+                    if not all(d in completed for d in depends_on):
+                        continue
+                    if executor is not None and len(running) >= jobs:
+                        break
+                    pending.remove(name)
+                    started = True
+                    files = self.__get_input_files(name, shared_inputs)
+                    fingerprint = get_files_fingerprint(files)
+                    if not force and self.__fingerprints.get(name) == fingerprint and self.__has_outputs(name):
+                        print("{} skipped: inputs unchanged since the last run.\n".format(name))
+                        completed.add(name)
+                        continue
+                    step = self.__steps[name]
+                    inputs = (fingerprint, _get_signatures(files))
+                    if executor is None:
+                        try:
+                            _run_step(name, step['function'], step['args'])
+                            self.__complete(name, completed, shared_inputs, inputs)
+                        except (Exception, SystemExit) as ex:
+                            traceback.print_exc()
+                            failures[name] = "{}: {}".format(type(ex).__name__, ex)
+                            print("Error in {}: {}".format(name, ex))
+                    else:
+                        future = executor.submit(_run_step, name, step['function'], step['args'])
+                        running[future] = (name, inputs)
+                if len(running) > 0:
+                    done, not_done = wait(running.keys(), return_when=FIRST_COMPLETED)
+                    for future in done:
+                        name, inputs = running.pop(future)
+                        error = future.exception()
+                        if error is None:
+                            self.__complete(name, completed, shared_inputs, inputs)
+                        else:
+                            failures[name] = "{}: {}".format(type(error).__name__, error)
+                            print("Error in {}: {}".format(name, error))
+                elif not started:
+                    raise RuntimeError("Steps with unresolved dependencies: {}".format(', '.join(pending)))
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        return {name: failures[name] for name in steps if name in failures}
+
+    def __has_outputs(self, name):
+        """
+        This function checks if the output files of a step exist
+        """
+        return all(os.path.exists(path) for path in self.__steps[name]['outputs'])
+
+    def __complete(self, name, completed, shared_inputs, inputs):
+        """
+        This function records a successful run of a step with the fingerprint of its inputs
+        Args:
+            name (str): name of the step
+            completed (set of str): names of the completed steps
+            shared_inputs (list of str): optional paths of inputs of every step
+            inputs (tuple): fingerprint and signatures (see _get_signatures) of the input files before the run
+        """
+        completed.add(name)
+        fingerprint, signatures = inputs
+        # the HDF5 files the step may have converted its HDF4 inputs to #
+        converted = set(get_h5_path(f) for f in signatures if f.endswith('.hdf') and f.find("_h5") < 0)
+        files = self.__get_input_files(name, shared_inputs)
+        if all(signatures.get(f) == s or f in converted for f, s in _get_signatures(files).items()):
+            fingerprint = get_files_fingerprint(files)
+        self.__fingerprints[name] = fingerprint
+        self.__save()
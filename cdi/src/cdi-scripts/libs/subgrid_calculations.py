@@ -1,14 +1,145 @@
 import numpy as np
+from libs.grid_geometry import GridGeometry, MODIS_CMG_GRID, CHIRPS_GRID
+
+# pre-defined weight patterns for the 2x2 interpolation blocks: 16ths of the raw values to use #
+# order of the raw values: [jj][ii], [jj][ip], [jp][ii], [jp][ip] #
+INTERPOLATION_WEIGHTS = (
+    ((0, 0), (0.5625, 0.1875, 0.1875, 0.0625)),  # 9, 3, 3, 1
+    ((0, 1), (0.1875, 0.5625, 0.0625, 0.1875)),  # 3, 9, 1, 3
+    ((1, 0), (0.1875, 0.0625, 0.5625, 0.1875)),  # 3, 1, 9, 3
+    ((1, 1), (0.0625, 0.1875, 0.1875, 0.5625))   # 1, 3, 3, 9
+)
+
+
+def interpolate_cells(raw_data, rows, columns, missing=-9999.0):
+    """
+    This function takes values from the original data that cover the supplied bounds,
+        and then interpolates the data to 0.05 degree spacing
+    The new data values are created using a special form of bilinear-interpolation where the empty cells
+        (represented by the missing value) are not included in the weighting
+    All 2x2 blocks of the original data are processed at once: each of the four output phases
+        (even/odd row, even/odd column) is computed with whole-array operations.
+        The operations are applied in the same order as interpolate_cells_loop, so the results are bit-identical.
+    Args:
+        raw_data (2D numpy array of floats): the original data to process
+        rows (int): number of rows of the Area of Interest
+        columns (int): number of columns of the Area of Interest
+        missing (float): the value representing empty cells
+
+    Returns:
+        2D numpy array (floats) of the interpolated data with a 4 cell buffer
+    """
+    raw_data = np.asarray(raw_data, dtype='float')
+    # initialize output array with a 4 cell buffer #
+    output_data = np.full((rows + 4, columns + 4), missing, dtype='float')
+    last_root_j = raw_data.shape[0] - 1  # number of 2x2 blocks per column
+    last_root_i = raw_data.shape[1] - 1  # number of 2x2 blocks per row
+    if last_root_j < 1 or last_root_i < 1:
+        return output_data
+    # corner values of every 2x2 block: [jj][ii], [jj][ip], [jp][ii], [jp][ip] #
+    corners = (
+        raw_data[:-1, :-1],
+        raw_data[:-1, 1:],
+        raw_data[1:, :-1],
+        raw_data[1:, 1:]
+    )
+    # 1 where the original cell holds data, 0 where it is empty #
+    masks = [np.where(c == missing, 0, 1) for c in corners]
+    valid = (masks[0] + masks[1] + masks[2] + masks[3]) > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for (j_offset, i_offset), weights in INTERPOLATION_WEIGHTS:
+            masked_weights = [w * m for w, m in zip(weights, masks)]
+            # determine the scale factor for the weights which accounts for empty cells #
+            weight_total = np.zeros(valid.shape)
+            for mw in masked_weights:
+                weight_total += mw
+            scale = np.true_divide(1.0, weight_total)
+            # sum of the raw values multiplied by their weights #
+            values = np.zeros(valid.shape)
+            for c, mw in zip(corners, masked_weights):
+                values += c * mw * scale
+            # place the phase in the output grid, leaving blocks without data as missing #
+            phase = output_data[j_offset: 2 * last_root_j: 2, i_offset: 2 * last_root_i: 2]
+            phase[valid] = values[valid]
+    return output_data
+
+
+def interpolate_cells_loop(raw_data, rows, columns, missing=-9999.0):
+    """
+    This function is the original cell-by-cell version of interpolate_cells
+        It is kept as the reference implementation for verification and benchmarks
+    Args:
+        raw_data (2D numpy array of floats): the original data to process
+        rows (int): number of rows of the Area of Interest
+        columns (int): number of columns of the Area of Interest
+        missing (float): the value representing empty cells
+
+    Returns:
+        2D numpy array (floats) of the interpolated data with a 4 cell buffer
+    """
+    # initialize output array with a 4 cell buffer #
+    output_data = np.full((rows + 4, columns + 4), missing, dtype='float')
+    # pre-define the weight patterns: 16ths of the raw values to use #
+    w_jj_ii = np.array([[0.5625, 0.1875], [0.1875, 0.0625]])  # 9, 3, 3, 1
+    w_jj_ip = np.array([[0.1875, 0.5625], [0.0625, 0.1875]])  # 3, 9, 1, 3
+    w_jp_ii = np.array([[0.1875, 0.0625], [0.5625, 0.1875]])  # 3, 1, 9, 3
+    w_jp_ip = np.array([[0.0625, 0.1875], [0.1875, 0.5625]])  # 1, 3, 3, 9
+
+    def __interpolate_cell(values, weights, mask):
+        """
+        Private function that interpolates a cell based on the distance to the original cells,
+            and if the original cells contain non-missing values
+        Args:
+            values (2D numpy array of floats): subset of the original data that affects the new cell
+            weights (2D numpy array of floats): predetermined weighting of the original data
+            mask (2D numpy array of floats): array of zeros and ones representing False/True if an original data
+                cell should be used in the interpolation
+
+        Returns:
+            float value of the interpolated data for the target cell
+        """
+        # determine the scale factor for the weights which accounts for empty cells
+        scale = np.true_divide(1.0, np.sum(mask * weights))
+        # return the interpolated value: sum of the raw values multiplied by their weights
+        return np.sum(values * (weights * mask) * scale)
+
+    # start to process the bilinear interpolation #
+    last_root_j = len(raw_data) - 1  # last row in original data (minus 1 offset for zero-based array)
+    last_root_i = len(raw_data[0]) - 1  # last column in original data (minus 1 offset for zero-based array)
+    # iterate by row #
+    for jj in range(0, last_root_j):
+        # set row indices for new grid points #
+        j1 = jj * 2
+        j2 = jj * 2 + 1
+        jp = jj + 1
+        # iterate by column #
+        for ii in range(0, last_root_i):
+            # set column indices for new grid points #
+            i1 = ii * 2
+            i2 = ii * 2 + 1
+            ip = ii + 1
+            # bilinear interpolation of the interior #
+            data_subset = np.array([[raw_data[jj][ii], raw_data[jj][ip]], [raw_data[jp][ii], raw_data[jp][ip]]])
+            weight_mask = np.where(data_subset == missing, 0, 1)
+            if np.sum(weight_mask) > 0:
+                output_data[j1][i1] = __interpolate_cell(data_subset, w_jj_ii, weight_mask)
+                output_data[j1][i2] = __interpolate_cell(data_subset, w_jj_ip, weight_mask)
+                output_data[j2][i1] = __interpolate_cell(data_subset, w_jp_ii, weight_mask)
+                output_data[j2][i2] = __interpolate_cell(data_subset, w_jp_ip, weight_mask)
+    return output_data
 
 
 class NetCDFSubGrid:
     import libs.netcdf_functions as NetCDF
 
-    def __init__(self, aoi, file_path, interpolate=False):
+    def __init__(self, aoi, file_path, interpolate=False, vectorized=True, data_set=None):
         self.__aoi = aoi
         self.__file_path = file_path
         self.interpolate = interpolate
-        self.__dataset = None
+        self.vectorized = vectorized
+        # an open data set is shared with other SubGrids of the file (e.g. of other regions), and is not closed #
+        self.__dataset = data_set
+        self.__shared = data_set is not None
         # initialize class properties #
         self.__missing = np.float32(-9999.0)
         self.units = ""
@@ -21,7 +152,8 @@ class NetCDFSubGrid:
         
     def __enter__(self):
         try:
-            self.__dataset = self.NetCDF.open_dataset(self.__file_path)
+            if not self.__shared:
+                self.__dataset = self.NetCDF.open_dataset(self.__file_path)
             # get the dimensions of the source data #
             self.__root_dimensions = self.NetCDF.get_dimensions(self.__dataset)
             # determine the bounding box that covers the Area of Interest (aoi)
@@ -30,15 +162,16 @@ class NetCDFSubGrid:
             else:
                 self.__bounds = self.__aoi
             # determine the properties of the SubGrid area #
-            self.__compute_indices(self.__bounds, self.__root_dimensions['latitudes'], self.__root_dimensions['longitudes'])
+            grid = GridGeometry.from_coordinates(self.__root_dimensions['latitudes'], self.__root_dimensions['longitudes'])
+            self.__set_indices(grid.window(self.__bounds))
             return self
-        except IOError:
-            raise
         except Exception:
+            # __exit__ is not called when __enter__ raises, so the file opened here is closed before re-raising #
+            self.__exit__(None, None, None)
             raise
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.__dataset is not None:
+        if self.__dataset is not None and not self.__shared:
             self.__dataset.close()
 
     def __compute_bounding_box(self):
@@ -67,42 +200,18 @@ class NetCDFSubGrid:
         self.start_x = int((self.__aoi['w_lon'] - start_x) * 20)
         self.end_x = int(self.start_x + self.columns)
 
-    def __compute_indices(self, bounds, latitudes, longitudes):
+    def __set_indices(self, window):
         """
-        This function determines the index range of the latitude and longitude arrays
-            that fits the area of interest (SubGrid)
-        Example:
-            Given a global grid at 0.5 degree spacing that starts at -179.75, -89.75
-                There are 720 longitude values and 360 latitude values
-                Note the 0.25 degree offset for the center of the grid "boxes"
-            If we are interested in an area that covers -50.0, -30.0 to 50.0, 30.0, then our bounds are:
-                -49.75, -29.75 to 49.75 to 29.75
-                For the longitudes:
-                    -49.75 is 130 degrees to the east of -179.75 (array position 0), so our starting index is 260
-                    49.75 is 229.5 degrees to the east of -179.75, so our ending index is 459
-                For the latitudes:
-                    -29.75 is 60 degrees to the north of -89.75, so the starting index is 120
-                    29.75 is 119.5 degrees north of -89.75, so the ending index is 239
+        This function sets the index range of the latitude and longitude arrays that fits the area of interest (SubGrid)
         Args:
-            bounds (dictionary): object containing the coordinates of the Area of Interest
-            latitudes (list of floats): latitude values of the original grid
-            longitudes (list of floats): longitude values of the original grid
+            window (tuple of slices): the row and column slices of the original grid
 
         Returns:
             None: adds values to class properties
         """
-        # find the range for the latitudes of the subset #
-        for j, y in enumerate(latitudes):
-            if y == bounds['s_lat']:
-                self.first_root_y = j
-            elif y == bounds['n_lat']:
-                self.last_root_y = j + 1  # ensure we have coverage if the subset is offset by 1 cell
-        # find the range for the longitudes of the subset #
-        for i, x in enumerate(longitudes):
-            if x == bounds['w_lon']:
-                self.first_root_x = i
-            elif x == bounds['e_lon']:
-                self.last_root_x = i + 1  # ensure we have coverage if the subset is offset by 1 cell
+        rows, columns = window
+        self.first_root_y, self.last_root_y = rows.start, rows.stop
+        self.first_root_x, self.last_root_x = columns.start, columns.stop
         # set span of the raw data subset #
         self.root_rows = int(self.last_root_y - self.first_root_y)
         self.root_columns = int(self.last_root_x - self.first_root_x)
@@ -116,74 +225,26 @@ class NetCDFSubGrid:
         Returns:
             2D numpy array of floats for the subset area
         """
-        if 'times' in self.__root_dimensions:
-            full_data = self.NetCDF.extract_data(self.__dataset, parameter)
-        else:
-            full_data = self.NetCDF.extract_data(self.__dataset, parameter, -1)
-        return full_data[self.first_root_y: self.last_root_y, self.first_root_x: self.last_root_x]
+        return self.NetCDF.extract_window(
+            self.__dataset,
+            parameter,
+            slice(self.first_root_y, self.last_root_y),
+            slice(self.first_root_x, self.last_root_x)
+        )
 
     def __interpolate_cells(self, raw_data):
         """
         This function takes values from the original data that cover the supplied bounds,
             and then interpolates the data to 0.05 degree spacing
-        The new data values are created using a special form of bilinear-interpolation where the empty cells
-            (represented by the value -9999.0) are not included in the weighting
         Args:
             raw_data (2D numpy array of floats): the original data to process
 
         Returns:
             2D numpy array (floats) of the interpolated data covering the Area of Interest (bounds)
         """
-        # initialize output array with a 4 cell buffer #
-        output_data = np.full((self.rows + 4, self.columns + 4), self.__missing, dtype='float')
-        # pre-define the weight patterns: 16ths of the raw values to use #
-        w_jj_ii = np.array([[0.5625, 0.1875], [0.1875, 0.0625]])  # 9, 3, 3, 1
-        w_jj_ip = np.array([[0.1875, 0.5625], [0.0625, 0.1875]])  # 3, 9, 1, 3
-        w_jp_ii = np.array([[0.1875, 0.0625], [0.5625, 0.1875]])  # 3, 1, 9, 3
-        w_jp_ip = np.array([[0.0625, 0.1875], [0.1875, 0.5625]])  # 1, 3, 3, 9
-
-        def __interpolate_cell(values, weights, mask):
-            """
-            Private function that interpolates a cell based on the distance to the original cells,
-                and if the original cells contain non-missing values
-            Args:
-                values (2D numpy array of floats): subset of the original data that affects the new cell
-                weights (2D numpy array of floats): predetermined weighting of the original data
-                mask (2D numpy array of floats): array of zeros and ones representing False/True if an original data
-                    cell should be used in the interpolation
-
-            Returns:
-                float value of the interpolated data for the target cell
-            """
-            # determine the scale factor for the weights which accounts for empty cells
-            scale = np.true_divide(1.0, np.sum(mask * weights))
-            # return the interpolated value: sum of the raw values multiplied by their weights
-            return np.sum(values * (weights * mask) * scale)
-
-        # start to process the bilinear interpolation #
-        last_root_j = self.root_rows - 1  # last column in original data (minus 1 offset for zero-based array)
-        last_root_i = self.root_columns - 1  # last column in original data (minus 1 offset for zero-based array)
-        # iterate by row #
-        for jj in range(0, last_root_j):
-            # set row indices for new grid points #
-            j1 = jj * 2
-            j2 = jj * 2 + 1
-            jp = jj + 1
-            # iterate by column #
-            for ii in range(0, last_root_i):
-                # set column indices for new grid points #
-                i1 = ii * 2
-                i2 = ii * 2 + 1
-                ip = ii + 1
-                # bilinear interpolation of the interior #
-                data_subset = np.array([[raw_data[jj][ii], raw_data[jj][ip]], [raw_data[jp][ii], raw_data[jp][ip]]])
-                weight_mask = np.where(data_subset == self.__missing, 0, 1)
-                if np.sum(weight_mask) > 0:
-                    output_data[j1][i1] = __interpolate_cell(data_subset, w_jj_ii, weight_mask)
-                    output_data[j1][i2] = __interpolate_cell(data_subset, w_jj_ip, weight_mask)
-                    output_data[j2][i1] = __interpolate_cell(data_subset, w_jp_ii, weight_mask)
-                    output_data[j2][i2] = __interpolate_cell(data_subset, w_jp_ip, weight_mask)
-        return output_data
+        if self.vectorized:
+            return interpolate_cells(raw_data, self.rows, self.columns, self.__missing)
+        return interpolate_cells_loop(raw_data, self.rows, self.columns, self.__missing)
 
     def create_sub_grid(self, parameter):
         """
@@ -211,10 +272,12 @@ class NetCDFSubGrid:
 class HDFSubGrid:
     import libs.hdf_functions as HDF
 
-    def __init__(self, aoi, file_path, group):
+    def __init__(self, aoi, file_path, group, data_set=None):
         self.__bounds = aoi
         self.__file_path = file_path
-        self.__dataset = None
+        # an open data set is shared with other SubGrids of the file (e.g. of other regions), and is not closed #
+        self.__dataset = data_set
+        self.__shared = data_set is not None
         self.__group = group
         # initialize class properties #
         self.__missing = np.float32(-9999.0)
@@ -228,61 +291,22 @@ class HDFSubGrid:
 
     def __enter__(self):
         try:
-            self.__dataset = self.HDF.open_dataset(self.__file_path)
-            # set the dimensions of the source data #
-            self.__root_latitudes = np.arange(89.975, -90.05, -0.05)
-            self.__root_longitudes = np.arange(-179.975, 180.05, 0.05)
-            # determine the properties of the SubGrid area #
-            self.__compute_indices(self.__bounds, self.__root_latitudes, self.__root_longitudes)
+            if not self.__shared:
+                self.__dataset = self.HDF.open_dataset(self.__file_path)
+            # determine the properties of the SubGrid area on the global CMG grid #
+            rows, columns = MODIS_CMG_GRID.window(self.__bounds)
+            self.first_root_y, self.last_root_y = rows.start, rows.stop
+            self.first_root_x, self.last_root_x = columns.start, columns.stop
             return self
-        except IOError:
-            raise
         except Exception:
+            # __exit__ is not called when __enter__ raises, so the file opened here is closed before re-raising #
+            self.__exit__(None, None, None)
             raise
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.__dataset is not None:
+        if self.__dataset is not None and not self.__shared:
             self.__dataset.close()
 
-    def __compute_indices(self, bounds, latitudes, longitudes):
-        """
-        This function determines the index range of the latitude and longitude arrays
-            that fits the area of interest (SubGrid)
-        Example:
-            Given a global grid at 0.5 degree spacing that starts at -179.75, -89.75
-                There are 720 longitude values and 360 latitude values
-                Note the 0.25 degree offset for the center of the grid "boxes"
-            If we are interested in an area that covers -50.0, -30.0 to 50.0, 30.0, then our bounds are:
-                -49.75, -29.75 to 49.75 to 29.75
-                For the longitudes:
-                    -49.75 is 130 degrees to the east of -179.75 (array position 0), so our starting index is 260
-                    49.75 is 229.5 degrees to the east of -179.75, so our ending index is 459
-                For the latitudes:
-                    -29.75 is 60 degrees to the north of -89.75, so the starting index is 120
-                    29.75 is 119.5 degrees north of -89.75, so the ending index is 239
-        Args:
-            bounds (dictionary): object containing the coordinates of the Area of Interest
-            latitudes (numpy array of floats): latitude values of the original grid
-            longitudes (numpy array of floats): longitude values of the original grid
-
-        Returns:
-            None: adds values to class properties
-        """
-        # find the range for the latitudes of the subset #
-        # Use small tolerance to handle floating-point precision issues
-        tolerance = 0.001
-        for j, y in enumerate(latitudes):
-            if abs(y - float(bounds['n_lat'])) < tolerance:
-                self.first_root_y = j
-            elif abs(y - float(bounds['s_lat'])) < tolerance:
-                self.last_root_y = j + 1  # ensure we have coverage
-        # find the range for the longitudes of the subset #
-        for i, x in enumerate(longitudes):
-            if abs(x - float(bounds['w_lon'])) < tolerance:
-                self.first_root_x = i
-            elif abs(x - float(bounds['e_lon'])) < tolerance:
-                self.last_root_x = i + 1  # ensure we have coverage
-
     def __extract_raw_subset(self, parameter):
         """
         This function extracts a subset of data from the requested parameter using the computed cells required to cover the current Area of Interest
@@ -292,8 +316,13 @@ class HDFSubGrid:
         Returns:
             2D numpy array of floats for the subset area
         """
-        full_data = self.HDF.extract_data(self.__dataset, self.__group, parameter, -1)
-        return full_data[self.first_root_y: self.last_root_y, self.first_root_x: self.last_root_x]
+        return self.HDF.extract_window(
+            self.__dataset,
+            self.__group,
+            parameter,
+            slice(self.first_root_y, self.last_root_y),
+            slice(self.first_root_x, self.last_root_x)
+        )
 
     def create_sub_grid(self, parameter):
         """
@@ -309,14 +338,28 @@ class HDFSubGrid:
         subset = self.__extract_raw_subset(parameter)
         return subset
 
+    def create_sub_grids(self, parameters):
+        """
+        This function creates the SubGrids of several parameters with one pass over the open HDF file
+        Args:
+            parameters (list of str): the HDF parameter names
+
+        Returns:
+            dictionary of 2D numpy arrays keyed by the parameter names
+        """
+        return {parameter: self.__extract_raw_subset(parameter) for parameter in parameters}
+
 
 class CHIRPSSubGrid:
-    import imageio
+    import rasterio
+    from rasterio.windows import Window
 
-    def __init__(self, aoi, file_path):
+    def __init__(self, aoi, file_path, data_set=None):
         self.__bounds = aoi
         self.__file_path = file_path
-        self.__dataset = None
+        # an open data set is shared with other SubGrids of the file (e.g. of other regions), and is not closed #
+        self.__dataset = data_set
+        self.__shared = data_set is not None
         # initialize class properties #
         self.__missing = np.float32(-9999.0)
         self.units = ""
@@ -329,67 +372,35 @@ class CHIRPSSubGrid:
 
     def __enter__(self):
         try:
-            self.__dataset = self.imageio.imread(self.__file_path)
-            # set the dimensions of the source data #
-            self.__root_latitudes = np.arange(49.975, -50.05, -0.05)
-            self.__root_longitudes = np.arange(-179.975, 180.05, 0.05)
-            # determine the properties of the SubGrid area #
-            self.__compute_indices(self.__bounds, self.__root_latitudes, self.__root_longitudes)
+            if not self.__shared:
+                self.__dataset = self.rasterio.open(self.__file_path)
+            # determine the properties of the SubGrid area on the global CHIRPS grid #
+            rows, columns = CHIRPS_GRID.window(self.__bounds)
+            self.first_root_y, self.last_root_y = rows.start, rows.stop
+            self.first_root_x, self.last_root_x = columns.start, columns.stop
             return self
-        except IOError:
-            raise
         except Exception:
+            # __exit__ is not called when __enter__ raises, so the file opened here is closed before re-raising #
+            self.__exit__(None, None, None)
             raise
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.__dataset is not None:
+        if self.__dataset is not None and not self.__shared:
+            self.__dataset.close()
             self.__dataset = None
 
-    def __compute_indices(self, bounds, latitudes, longitudes):
-        """
-        This function determines the index range of the latitude and longitude arrays
-            that fits the area of interest (SubGrid)
-        Example:
-            Given a global grid at 0.5 degree spacing that starts at -179.75, -89.75
-                There are 720 longitude values and 360 latitude values
-                Note the 0.25 degree offset for the center of the grid "boxes"
-            If we are interested in an area that covers -50.0, -30.0 to 50.0, 30.0, then our bounds are:
-                -49.75, -29.75 to 49.75 to 29.75
-                For the longitudes:
-                    -49.75 is 130 degrees to the east of -179.75 (array position 0), so our starting index is 260
-                    49.75 is 229.5 degrees to the east of -179.75, so our ending index is 459
-                For the latitudes:
-                    -29.75 is 60 degrees to the north of -89.75, so the starting index is 120
-                    29.75 is 119.5 degrees north of -89.75, so the ending index is 239
-        Args:
-            bounds (dictionary): object containing the coordinates of the Area of Interest
-            latitudes (numpy array of floats): latitude values of the original grid
-            longitudes (numpy array of floats): longitude values of the original grid
-
-        Returns:
-            None: adds values to class properties
-        """
-        # find the range for the latitudes of the subset #
-        for j, y in enumerate(latitudes):
-            if round(y, 3) == float(bounds['n_lat']):
-                self.first_root_y = j
-            elif round(y, 3) == float(bounds['s_lat']):
-                self.last_root_y = j + 1  # ensure we have coverage
-        # find the range for the longitudes of the subset #
-        for i, x in enumerate(longitudes):
-            if round(x, 3) == float(bounds['w_lon']):
-                self.first_root_x = i
-            elif round(x, 3) == float(bounds['e_lon']):
-                self.last_root_x = i + 1  # ensure we have coverage
-
     def create_sub_grid(self):
         """
         This function creates a new numpy array for the current Area of Interest
+            Only the strips/tiles of the TIF intersecting the Area of Interest are decoded
             Note: This function can be expanded in the future if we need to interpolate the TIF data to a finer resolution
         Returns:
             2D numpy array of floats
         """
-        # load the subset of the raw data #
-        data = np.array(self.__dataset)
-        subset = data[self.first_root_y: self.last_root_y, self.first_root_x: self.last_root_x]
+        # load the window of the raw data #
+        window = self.Window.from_slices(
+            (self.first_root_y, self.last_root_y),
+            (self.first_root_x, self.last_root_x)
+        )
+        subset = self.__dataset.read(1, window=window)
         return subset
@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+from argparse import ArgumentParser
+from datetime import datetime
+import functools
+import glob
+import json
+import os
+import resource
+import threading
+import time
+
+# environment variables that pass the telemetry run to the step processes #
+RUN_VARIABLE = 'CDI_TELEMETRY_RUN'
+FILE_VARIABLE = 'CDI_TELEMETRY_FILE'
+
+# measurements of the step executing in this process #
+_state = {
+    'step': None,
+    'files_opened': 0,
+    'operations': {}
+}
+# guards the measurements updated by the worker threads of a step (e.g. the GeoTIFF export of STEP_0303) #
+_lock = threading.Lock()
+
+
+def get_log_dir():
+    """
+    This function returns the directory of the telemetry files: the CDI_LOG_DIR environment variable,
+        or the logs directory of the cdi-scripts (mounted from cdi/logs in the container)
+    """
+    return os.environ.get('CDI_LOG_DIR', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'logs'))
+
+
+def start_run(log_dir=None):
+    """
+    This function starts a telemetry run: the steps measured by this process and its child processes
+        are written to the JSON lines file of the run
+    Args:
+        log_dir (str): optional directory of the telemetry files (default is get_log_dir())
+
+    Returns:
+        String of the run id
+    """
+    log_dir = log_dir if log_dir is not None else get_log_dir()
+    os.makedirs(log_dir, exist_ok=True)
+    run_id = datetime.now().strftime('%Y%m%dT%H%M%S')
+    os.environ[RUN_VARIABLE] = run_id
+    os.environ[FILE_VARIABLE] = os.path.join(log_dir, "telemetry_{}.jsonl".format(run_id))
+    return run_id
+
+
+def is_enabled():
+    """
+    This function checks if a telemetry run has been started
+    """
+    return FILE_VARIABLE in os.environ
+
+
+def _read_io_counters():
+    """
+    This function reads the bytes read and written by this process (Linux only)
+    Returns:
+        tuple of the bytes read and written, or (None, None) if they are not available
+    """
+    try:
+        with open('/proc/self/io', 'r') as fh:
+            counters = dict(line.split(':') for line in fh.read().splitlines())
+        return int(counters['rchar']), int(counters['wchar'])
+    except (IOError, KeyError, ValueError):
+        return None, None
+
+
+def _get_cpu_seconds():
+    """
+    This function returns the CPU time of this process and its finished child processes (e.g. worker pools)
+    """
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def _reset_peak_rss():
+    """
+    This function resets the peak resident memory of this process to its current resident memory (Linux only)
+    Returns:
+        True if the peak has been reset, False if it is not available
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as fh:
+            fh.write('5')
+        return True
+    except (IOError, OSError):
+        return False
+
+
+def _read_peak_rss_kb():
+    """
+    This function reads the peak resident memory of this process since its last reset, in KB (Linux only)
+    Returns:
+        the peak in KB, or None if it is not available
+    """
+    try:
+        with open('/proc/self/status', 'r') as fh:
+            for line in fh:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except (IOError, ValueError):
+        pass
+    return None
+
+
+def _write_record(record):
+    """
+    This function appends a record to the JSON lines file of the run
+        Each record is written with a single write to a file opened for appending, so concurrent steps do not mix their lines
+    """
+    with open(os.environ[FILE_VARIABLE], 'a') as fh:
+        fh.write(json.dumps(record) + "\n")
+
+
+def count_file():
+    """
+    This function counts a file opened by the step executing in this process
+    """
+    if _state['step'] is not None:
+        with _lock:
+            _state['files_opened'] += 1
+
+
+def timed(name):
+    """
+    This function returns a decorator that adds the calls of a helper function to the operations of the executing step:
+        the number of calls, and their wall and CPU time
+        The CPU time is that of the calling thread; the wall time is the sum of the calls, so for calls made concurrently
+        by worker threads it can exceed the wall time of the step
+        Without an executing step the function is called directly
+    Args:
+        name (str): name of the operation in the telemetry records
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _state['step'] is None:
+                return function(*args, **kwargs)
+            wall_start = time.perf_counter()
+            cpu_start = time.thread_time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                wall_seconds = time.perf_counter() - wall_start
+                cpu_seconds = time.thread_time() - cpu_start
+                with _lock:
+                    operation = _state['operations'].setdefault(name, {'calls': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0})
+                    operation['calls'] += 1
+                    operation['wall_seconds'] += wall_seconds
+                    operation['cpu_seconds'] += cpu_seconds
+        return wrapper
+    return decorator
+
+
+class StepTelemetry:
+    """
+    This class measures the execution of a step and writes its record to the telemetry file of the run:
+        wall time, CPU time, peak resident memory, bytes read and written, NetCDF/GeoTIFF files opened,
+        and the calls of the instrumented helper functions
+        The measurements cover the process executing the step; the CPU time and peak memory include its finished worker
+        processes, the other measurements do not
+        The peak memory of the process is reset when the step starts, so a step executed after a heavier one in the same
+        process (e.g. in the fused mode of STEP_0000) reports its own peak (peak_rss_scope 'step'); where the reset is
+        not available, the peak covers the life of the process (peak_rss_scope 'process'). The peak of the worker
+        processes can not be reset: it is included when it exceeds the peak of the earlier worker processes
+        Nothing is measured or written if no telemetry run has been started
+    """
+    def __init__(self, step):
+        self.__step = step
+        self.__start = None
+
+    def __enter__(self):
+        if is_enabled():
+            _state['step'] = self.__step
+            _state['files_opened'] = 0
+            _state['operations'] = {}
+            self.__start = {
+                'time': datetime.now().isoformat(timespec='seconds'),
+                'wall': time.perf_counter(),
+                'cpu': _get_cpu_seconds(),
+                'io': _read_io_counters(),
+                'peak_reset': _reset_peak_rss(),
+                'children_peak': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+            }
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.__start is None:
+            return
+        read_bytes, written_bytes = _read_io_counters()
+        start_read, start_written = self.__start['io']
+        peak_rss = _read_peak_rss_kb() if self.__start['peak_reset'] else None
+        if peak_rss is None:
+            peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        children_peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        if children_peak > self.__start['children_peak']:
+            peak_rss = max(peak_rss, children_peak)
+        operations = {}
+        for name, operation in _state['operations'].items():
+            operations[name] = {
+                'calls': operation['calls'],
+                'wall_seconds': round(operation['wall_seconds'], 3),
+                'cpu_seconds': round(operation['cpu_seconds'], 3)
+            }
+        _write_record({
+            'run': os.environ.get(RUN_VARIABLE),
+            'step': self.__step,
+            'status': 'ok' if exc_type is None else 'failed',
+            'start': self.__start['time'],
+            'wall_seconds': round(time.perf_counter() - self.__start['wall'], 3),
+            'cpu_seconds': round(_get_cpu_seconds() - self.__start['cpu'], 3),
+            'peak_rss_mb': round(peak_rss / 1024.0, 1),
+            'peak_rss_scope': 'step' if self.__start['peak_reset'] else 'process',
+            'read_bytes': read_bytes - start_read if read_bytes is not None else None,
+            'written_bytes': written_bytes - start_written if written_bytes is not None else None,
+            'files_opened': _state['files_opened'],
+            'operations': operations
+        })
+        _state['step'] = None
+
+
+def read_run(file_path):
+    """
+    This function reads the step records of a telemetry file
+    Args:
+        file_path (str): fully-qualified path/name of the telemetry file
+
+    Returns:
+        dictionary of step name -> record, in the order the steps completed
+    """
+    records = {}
+    with open(file_path, 'r') as fh:
+        for line in fh:
+            if line.strip() != "":
+                record = json.loads(line)
+                records[record['step']] = record
+    return records
+
+
+def _format_change(first, second):
+    """
+    This function formats the relative change between two measurements
+    """
+    if first is None or second is None:
+        return "-"
+    if first == 0:
+        return "-" if second == 0 else "new"
+    return "{:+.0f}%".format((second - first) * 100.0 / first)
+
+
+def _format_value(value, scale=1.0):
+    """
+    This function formats a measurement, or '-' if it is not available
+    """
+    return "-" if value is None else "{:.1f}".format(value / scale)
+
+
+def format_comparison(first, second):
+    """
+    This function formats the records of two runs side by side, one line per step
+    Args:
+        first (dictionary): step name -> record of the earlier run (see read_run)
+        second (dictionary): step name -> record of the later run
+
+    Returns:
+        List of the lines of the table
+    """
+    columns = [('wall_seconds', "wall s", 1.0), ('cpu_seconds', "cpu s", 1.0), ('peak_rss_mb', "peak MB", 1.0),
+               ('read_bytes', "read MB", 1024.0 * 1024.0), ('written_bytes', "written MB", 1024.0 * 1024.0)]
+    header = "{:<34}".format("step")
+    for key, title, scale in columns:
+        header += " {:>22}".format(title)
+    lines = [header]
+    steps = list(first.keys()) + [s for s in second.keys() if s not in first]
+    for step in steps:
+        a = first.get(step, {})
+        b = second.get(step, {})
+        line = "{:<34}".format(step)
+        for key, title, scale in columns:
+            line += " {:>22}".format("{} / {} ({})".format(_format_value(a.get(key), scale), _format_value(b.get(key), scale),
+                                                           _format_change(a.get(key), b.get(key))))
+        lines.append(line)
+        # the helper functions of the step #
+        operations = list(a.get('operations', {}).keys()) + [o for o in b.get('operations', {}).keys() if o not in a.get('operations', {})]
+        for name in operations:
+            x = a.get('operations', {}).get(name, {})
+            y = b.get('operations', {}).get(name, {})
+            lines.append("{:<34} {:>22} {:>22}".format(
+                "  {} ({} / {} calls)".format(name, x.get('calls', 0), y.get('calls', 0)),
+                "{} / {} ({})".format(_format_value(x.get('wall_seconds')), _format_value(y.get('wall_seconds')),
+                                      _format_change(x.get('wall_seconds'), y.get('wall_seconds'))),
+                "{} / {} ({})".format(_format_value(x.get('cpu_seconds')), _format_value(y.get('cpu_seconds')),
+                                      _format_change(x.get('cpu_seconds'), y.get('cpu_seconds')))))
+    return lines
+
+
+def main(args):
+    """
+    This is the main entry point of the run comparison: it prints the records of two runs side by side
+    """
+    if args.first is not None and args.second is not None:
+        files = [args.first, args.second]
+    else:
+        files = sorted(glob.glob(os.path.join(args.log_dir, "telemetry_*.jsonl")))[-2:]
+        if len(files) < 2:
+            print("Two telemetry runs are needed for a comparison, found {} in '{}'".format(len(files), args.log_dir))
+            return
+    print("Comparing {} (first) with {} (second)".format(os.path.basename(files[0]), os.path.basename(files[1])))
+    for line in format_comparison(read_run(files[0]), read_run(files[1])):
+        print(line)
+
+
+if __name__ == '__main__':
+    # set up the command line argument parser
+    parser = ArgumentParser(description="Compare the step measurements of two CDI runs. Default is the latest two runs")
+    parser.add_argument("first", nargs='?', help="Telemetry file of the first run")
+    parser.add_argument("second", nargs='?', help="Telemetry file of the second run")
+    parser.add_argument("--log-dir", default=get_log_dir(), help="Directory of the telemetry files")
+    # execute the program with the supplied options
+    main(parser.parse_args())